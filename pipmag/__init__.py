@@ -0,0 +1,13 @@
+"""
+pipmag: pipeline for the La Palma observation archive.
+
+`pipmag.query(df, ...)` runs a widget-free query over an observation DataFrame (see `query_utils.query`).
+"""
+
+
+def __getattr__(name):
+    # Imported on first use, so that importing a submodule does not load the query engine
+    if name == 'query':
+        from pipmag.query_utils import query
+        return query
+    raise AttributeError(f"module 'pipmag' has no attribute '{name}'")
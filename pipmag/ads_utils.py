@@ -206,10 +206,10 @@ def get_search_terms(df, index):
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The dataframe containing the data.
+    df : pandas.DataFrame or catalog_utils.ObservationCatalog
+        The dataframe containing the data, or an observation catalog.
     index : int
-        The index of the dataframe to retrieve the search terms.
+        The index of the dataframe (the obs_id for a catalog) to retrieve the search terms.
 
     Returns
     -------
@@ -230,6 +230,7 @@ def get_search_terms(df, index):
     The date string is then appended to the 'instruments' list,
     along with the term 'SST', to create the final list of search terms.
     The function returns the list of search terms.
+    An `ObservationCatalog` is read through its `get_observation` method, so only one row is fetched.
 
     Examples
     --------
@@ -240,8 +241,13 @@ def get_search_terms(df, index):
 
     # function that take dataframe index, reads the datetime, converts into string,
     # and appends in to the instruments list to search ADS
-    date_string = datetime_to_string(df.at[index, 'date_time'])
-    instruments = df.at[index, 'instruments']
+    if hasattr(df, 'get_observation'):
+        observation = df.get_observation(index)
+        date_string = datetime_to_string(observation['date_time'])
+        instruments = observation['instruments']
+    else:
+        date_string = datetime_to_string(df.at[index, 'date_time'])
+        instruments = df.at[index, 'instruments']
     # append date string to instruments list
     search_terms = ['SST'] + instruments + [date_string]
     return search_terms
@@ -297,8 +303,8 @@ class ADS_Search(ADSSearch):
 
     Parameters
     ----------
-    dataframe : pandas.DataFrame
-        The dataframe containing the data to be used for searching the ADS API.
+    dataframe : pandas.DataFrame or catalog_utils.ObservationCatalog
+        The dataframe (or observation catalog) containing the data to be used for searching the ADS API.
 
     Attributes
     ----------
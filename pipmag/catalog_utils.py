@@ -0,0 +1,290 @@
+import os
+import sqlite3
+from datetime import timedelta
+import pandas as pd
+from pipmag import file_utils as fu
+from pipmag import instrument_utils as iu
+from pipmag import storage_utils as stu
+
+CATALOG_SCHEMA = """
+CREATE TABLE observations (
+    obs_id INTEGER PRIMARY KEY,
+    date_time TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    target TEXT,
+    comments TEXT,
+    num_links INTEGER NOT NULL,
+    polarimetry INTEGER NOT NULL,
+    instrument_mask INTEGER NOT NULL
+);
+CREATE TABLE observation_instruments (
+    obs_id INTEGER NOT NULL REFERENCES observations(obs_id),
+    instrument TEXT NOT NULL
+);
+CREATE TABLE observation_targets (
+    obs_id INTEGER NOT NULL REFERENCES observations(obs_id),
+    token TEXT NOT NULL
+);
+CREATE TABLE prefixes (
+    prefix_id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL
+);
+CREATE TABLE links (
+    obs_id INTEGER NOT NULL REFERENCES observations(obs_id),
+    position INTEGER NOT NULL,
+    prefix_id INTEGER NOT NULL REFERENCES prefixes(prefix_id),
+    relative_path TEXT NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE INDEX idx_observations_date_time ON observations(date_time);
+CREATE INDEX idx_observations_ymd ON observations(year, month, day);
+CREATE INDEX idx_instruments ON observation_instruments(instrument, obs_id);
+CREATE INDEX idx_targets ON observation_targets(token COLLATE NOCASE, obs_id);
+CREATE INDEX idx_links ON links(obs_id, position);
+"""
+
+
+def build_catalog(df, db_path):
+    """
+    Builds an SQLite observation catalog from an observation DataFrame.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, with list columns holding lists (as returned by `read_and_format_csv`).
+    db_path : str
+        The path of the SQLite database file. An existing file is replaced.
+
+    Returns
+    -------
+    ObservationCatalog
+        The catalog opened on the new database.
+
+    Dependencies
+    ------------
+    sqlite3 module
+    storage_utils module (to split the links into the normalized links table)
+    file_utils module (for the canonical target tokens)
+
+    Notes
+    -----
+    Function Name: build_catalog
+    The catalog has one row per observation and separate membership tables for instruments
+    and target tokens, so that instrument and target filters are index lookups. The target tokens are the
+    canonical tokens of `file_utils.get_target_token_lists`, as in the 'target_tokens' column.
+    The links are stored once, with dictionary-encoded prefixes, as in `storage_utils.normalize_observations`.
+    The database is written to a temporary file and renamed into place, so readers never see a partial catalog.
+
+    Examples
+    --------
+    >>> catalog = build_catalog(df, 'data/la_palma_obs_data.sqlite')
+    """
+    observations, links = stu.normalize_observations(df)
+    instruments = [[item.strip() for item in x] if isinstance(x, list) else [] for x in observations['instruments']]
+    observation_rows = [
+        (int(obs_id), pd.Timestamp(date_time).strftime('%Y-%m-%d %H:%M:%S'), int(year), int(month), int(day),
+         str(time), target if isinstance(target, str) else None, comments if isinstance(comments, str) else None,
+         int(num_links), int(str(polarimetry) == 'True'), iu.get_instrument_mask(items))
+        for obs_id, date_time, year, month, day, time, target, comments, num_links, polarimetry, items in zip(
+            observations['obs_id'], observations['date_time'], observations['year'], observations['month'],
+            observations['day'], observations['time'], observations['target'], observations['comments'],
+            observations['num_links'], observations['polarimetry'], instruments)
+    ]
+    instrument_rows = [(int(obs_id), item) for obs_id, items in zip(observations['obs_id'], instruments)
+                       for item in dict.fromkeys(items)]
+    token_lists = fu.get_target_token_lists(observations['target'])
+    target_rows = [(int(obs_id), token) for obs_id, tokens in zip(observations['obs_id'], token_lists)
+                   for token in tokens]
+    prefix_codes = links['prefix'].cat.codes.values
+    prefix_rows = list(enumerate(links['prefix'].cat.categories))
+    positions = links.groupby('obs_id').cumcount().values
+    link_rows = list(zip(links['obs_id'].astype(int).tolist(), positions.tolist(), prefix_codes.tolist(),
+                         links['relative_path'].tolist(), links['kind'].astype(str).tolist()))
+
+    temp_path = db_path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.executescript(CATALOG_SCHEMA)
+        connection.executemany('INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', observation_rows)
+        connection.executemany('INSERT INTO observation_instruments VALUES (?, ?)', instrument_rows)
+        connection.executemany('INSERT INTO observation_targets VALUES (?, ?)', target_rows)
+        connection.executemany('INSERT INTO prefixes VALUES (?, ?)', prefix_rows)
+        connection.executemany('INSERT INTO links VALUES (?, ?, ?, ?, ?)', link_rows)
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_path, db_path)
+    return ObservationCatalog(db_path)
+
+
+class ObservationCatalog:
+    """
+    Read access to an SQLite observation catalog built with `build_catalog`.
+
+    Parameters
+    ----------
+    db_path : str
+        The path of the SQLite database file.
+
+    Attributes
+    ----------
+    db_path : str
+        The path of the SQLite database file.
+    connection : sqlite3.Connection
+        The read-only connection to the catalog.
+
+    Methods
+    -------
+    get_years(), get_months(year), get_days(year, month), get_times(year, month, day)
+        The distinct values for the year/month/day/time dropdowns of the selector widgets.
+    get_instruments(), get_targets()
+        The distinct instruments and target tokens in the catalog.
+    get_observation(obs_id)
+        One observation as a dictionary, including its instruments and links.
+    get_links(obs_id, kind=None)
+        The links of one observation, optionally only 'video' or 'image' links.
+    find_obs_id(date_time)
+        The obs_id of the observation at a given date and time.
+    query(...)
+        The observations matching instrument, date, time, target and polarimetry filters.
+
+    Dependencies
+    ------------
+    - sqlite3: Required to read the catalog.
+    - pandas: Required to return query results as DataFrames.
+
+    Notes
+    -----
+    Class Name: ObservationCatalog
+    Every method runs a query on the indexes of the catalog, so nothing has to be loaded up front
+    and lookups stay fast as the archive grows. The catalog can be passed to `ads_utils.ADS_Search`
+    in place of a DataFrame, with obs_id as the index.
+
+    Examples
+    --------
+    >>> catalog = ObservationCatalog('data/la_palma_obs_data.sqlite')
+    >>> catalog.query(instruments=['CRISP', 'CHROMIS'], start_date='2022-06-01', targets=['Flare'])
+    (A DataFrame with the matching observations is returned.)
+    """
+
+    def __init__(self, db_path):
+        if not os.path.isfile(db_path):
+            raise FileNotFoundError(f"Catalog not found: {db_path}")
+        self.db_path = db_path
+        self.connection = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False)
+
+    def close(self):
+        self.connection.close()
+
+    def _column(self, sql, params=()):
+        return [row[0] for row in self.connection.execute(sql, params)]
+
+    def get_years(self):
+        return self._column('SELECT DISTINCT year FROM observations ORDER BY year')
+
+    def get_months(self, year):
+        return self._column('SELECT DISTINCT month FROM observations WHERE year = ? ORDER BY month', (year,))
+
+    def get_days(self, year, month):
+        return self._column('SELECT DISTINCT day FROM observations WHERE year = ? AND month = ? ORDER BY day',
+                            (year, month))
+
+    def get_times(self, year, month, day):
+        return self._column('SELECT time FROM observations WHERE year = ? AND month = ? AND day = ? ORDER BY time',
+                            (year, month, day))
+
+    def get_instruments(self):
+        return self._column('SELECT DISTINCT instrument FROM observation_instruments ORDER BY instrument')
+
+    def get_targets(self):
+        return self._column('SELECT DISTINCT token FROM observation_targets ORDER BY token')
+
+    def find_obs_id(self, date_time):
+        row = self.connection.execute('SELECT obs_id FROM observations WHERE date_time = ?',
+                                      (pd.Timestamp(date_time).strftime('%Y-%m-%d %H:%M:%S'),)).fetchone()
+        return row[0] if row else None
+
+    def get_links(self, obs_id, kind=None):
+        sql = ('SELECT p.prefix || l.relative_path FROM links l JOIN prefixes p ON p.prefix_id = l.prefix_id '
+               'WHERE l.obs_id = ?')
+        params = [obs_id]
+        if kind is not None:
+            sql += ' AND l.kind = ?'
+            params.append(kind)
+        return self._column(sql + ' ORDER BY l.position', params)
+
+    def get_observation(self, obs_id):
+        """
+        Return one observation as a dictionary with the columns of the observation DataFrame.
+        """
+        cursor = self.connection.execute('SELECT * FROM observations WHERE obs_id = ?', (obs_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(obs_id)
+        observation = dict(zip([column[0] for column in cursor.description], row))
+        observation['date_time'] = pd.Timestamp(observation['date_time'])
+        observation['polarimetry'] = str(bool(observation['polarimetry']))
+        observation['instruments'] = self._column(
+            'SELECT instrument FROM observation_instruments WHERE obs_id = ? ORDER BY rowid', (obs_id,))
+        observation['links'] = self.get_links(obs_id)
+        observation['video_links'] = self.get_links(obs_id, 'video')
+        observation['image_links'] = self.get_links(obs_id, 'image')
+        return observation
+
+    def query(self, instruments=None, all_instruments=True, start_date=None, end_date=None,
+              start_time=None, end_time=None, targets=None, polarimetry=None):
+        """
+        Return the observations matching all the given filters as a DataFrame, ordered by date and time.
+
+        `instruments` must all be present when `all_instruments` is True, otherwise any one of them.
+        The dates are inclusive, the times are 'HH:MM' or 'HH:MM:SS' strings compared with the time of day,
+        `targets` matches any of the canonical tokens of the given targets (see `file_utils.get_target_token_lists`),
+        so 'AR' finds 'Active Region', and `polarimetry` is True or False.
+        """
+        conditions, params = [], []
+        if instruments:
+            instruments = list(dict.fromkeys(instruments))
+            placeholders = ', '.join('?' * len(instruments))
+            subquery = f'SELECT obs_id FROM observation_instruments WHERE instrument IN ({placeholders})'
+            if all_instruments:
+                subquery += ' GROUP BY obs_id HAVING COUNT(DISTINCT instrument) = ?'
+                params.extend(instruments + [len(instruments)])
+            else:
+                params.extend(instruments)
+            conditions.append(f'o.obs_id IN ({subquery})')
+        if start_date is not None:
+            conditions.append('o.date_time >= ?')
+            params.append(pd.Timestamp(start_date).strftime('%Y-%m-%d'))
+        if end_date is not None:
+            conditions.append('o.date_time < ?')
+            params.append((pd.Timestamp(end_date) + timedelta(days=1)).strftime('%Y-%m-%d'))
+        if start_time:
+            conditions.append('o.time >= ?')
+            params.append(start_time)
+        if end_time:
+            conditions.append('o.time <= ?')
+            params.append(end_time if len(end_time) > 5 else end_time + ':59')
+        tokens = list(dict.fromkeys(token for items in fu.get_target_token_lists(targets or []) for token in items))
+        if tokens:
+            targets = tokens
+            placeholders = ', '.join('?' * len(targets))
+            conditions.append(f'o.obs_id IN (SELECT obs_id FROM observation_targets '
+                              f'WHERE token COLLATE NOCASE IN ({placeholders}))')
+            params.extend(targets)
+        if polarimetry is not None:
+            conditions.append('o.polarimetry = ?')
+            params.append(int(bool(polarimetry)))
+
+        where = ' AND '.join(conditions) if conditions else '1'
+        sql = (f"SELECT o.*, (SELECT group_concat(instrument, ';') FROM observation_instruments i "
+               f"WHERE i.obs_id = o.obs_id) AS instruments FROM observations o WHERE {where} ORDER BY o.date_time")
+        df = pd.read_sql_query(sql, self.connection, params=params, index_col='obs_id', parse_dates=['date_time'])
+        # Observations without instruments have no group_concat result
+        df['instruments'] = [items.split(';') if items else [] for items in df['instruments'].fillna('')]
+        df['polarimetry'] = df['polarimetry'].astype(bool).astype(str)
+        return df
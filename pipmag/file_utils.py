@@ -1,8 +1,68 @@
 import pickle
+import json
+import lzma
+import struct
+import zlib
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from datetime import datetime
 import glob
+import hashlib
 import os
+import re
+import numpy as np
 import pandas as pd
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, register_extension_dtype, take
+from pandas.api.indexers import check_array_indexer
+from pandas.api.types import is_integer
+from pipmag import instrument_utils as iu
+
+# Columns of the observation table holding lists, stored in CSV files as ';'-joined strings
+LIST_COLUMNS = ['links', 'video_links', 'image_links', 'instruments', 'target_tokens']
+
+# Spellings of the common targets rewritten by normalize_targets, matched as whole words only
+TARGET_KEYWORDS = {
+    'Active Region': ['active region', 'Active region', 'AR'],
+    'Quiet Sun': ['quiet Sun', 'quiet sun', 'QS', 'Quiet sun'],
+    'Sunspot': ['sunspot', 'SS', 'ss', 'SUnspot'],
+}
+TARGET_KEYWORD_MAP = {keyword: target for target, keywords in TARGET_KEYWORDS.items() for keyword in keywords}
+# Longest keywords first, so that a phrase wins over an abbreviation it contains
+TARGET_KEYWORD_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(re.escape(k) for k in sorted(TARGET_KEYWORD_MAP, key=len, reverse=True)) + r')\b')
+# Canonical target tokens (see get_target_token_lists), matched case-insensitively, and abbreviations of them
+TARGET_VOCABULARY = ['Active Region', 'Sunspot', 'Light Bridge', 'Flare', 'Burst', 'UV Burst', 'Ellerman Bombs',
+                     'Penumbral Ellerman Bombs', 'Surges', 'Flux Emergence', 'Pores', 'Faculae/Plage', 'Filament',
+                     'Quiet Sun', 'Coronal Bright Point', 'Coronal Hole', 'Magnetic Bright Points', 'Spicules',
+                     'Prominences', 'Ribbons', 'Review']
+TARGET_TOKEN_ALIASES = {'EB': 'Ellerman Bombs', 'PEB': 'Penumbral Ellerman Bombs', 'Pore': 'Pores',
+                        'Surge': 'Surges', 'Ribbon': 'Ribbons', 'Plage': 'Faculae/Plage', 'Faculae': 'Faculae/Plage'}
+TARGET_TOKEN_MAP = {**{token.casefold(): token for token in TARGET_VOCABULARY},
+                    **{alias.casefold(): token for alias, token in TARGET_TOKEN_ALIASES.items()}}
+
+# Suffix of the formatted DataFrame snapshot written next to a CSV file by read_and_format_csv
+CSV_SNAPSHOT_SUFFIX = '.snapshot.pkl'
+# Bump when the formatting done by read_and_format_csv changes, to invalidate existing snapshots
+CSV_SNAPSHOT_VERSION = 3
+
+# Magic bytes and format version of the chunked snapshot format written by save_snapshot
+SNAPSHOT_MAGIC = b'PIPMAGSNAP'
+SNAPSHOT_VERSION = 1
+# Size of the chunks that are compressed independently, in bytes
+SNAPSHOT_CHUNK_SIZE = 4 << 20
+# Compressors available for save_snapshot, as (compress, decompress) functions
+SNAPSHOT_COMPRESSORS = {
+    None: (lambda data: data, lambda data: data),
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+
+# Link columns that read_and_format_csv_lazy leaves on disk until a row is accessed
+LAZY_LINK_COLUMNS = ['links', 'video_links', 'image_links']
+# Suffixes of the scalar snapshot and of the memory-mapped link store written next to a CSV file
+LAZY_SNAPSHOT_SUFFIX = '.lazy.pkl'
+LINK_STORE_SUFFIX = '.links.npy'
 
 def add_timestamp(file_name):
     """
@@ -48,7 +108,7 @@ def add_timestamp(file_name):
     new_file_name = file_name.replace(extension, '_' + timestamp + extension)
     return new_file_name
 
-def get_latest_file(file_pattern):
+def get_latest_file(file_pattern, store_dir=None):
     """
     Get the latest file from a given file pattern.
 
@@ -56,6 +116,9 @@ def get_latest_file(file_pattern):
     ----------
     file_pattern : str
         The pattern to match the files (e.g., "path/to/files/*.txt").
+    store_dir : str, optional
+        The directory of a `snapshot_utils.SnapshotStore`. If it holds a version, the directory of its
+        latest version is returned without listing the files. The default is None.
 
     Returns
     -------
@@ -68,6 +131,7 @@ def get_latest_file(file_pattern):
     - glob: Required for pattern matching and retrieving file names.
     - os: Required for manipulating file paths and names.
     - datetime: Required for converting timestamps to datetime objects.
+    - snapshot_utils: Required to read the manifest of store_dir.
 
     Notes
     -----
@@ -77,6 +141,8 @@ def get_latest_file(file_pattern):
     If no files are found, the function returns None.
     The function extracts the timestamp from the file names, compares them,
     and returns the file with the latest timestamp.
+    If store_dir is given, the latest version is looked up in the manifest of the snapshot store,
+    and the file pattern is only used when the store is empty or missing.
     The file path is included in the returned file name.
 
     Examples
@@ -89,7 +155,18 @@ def get_latest_file(file_pattern):
 
     >>> get_latest_file("path/to/files/*.pdf")
     None
+
+    >>> get_latest_file("data/la_palma_obs_data_*.csv", store_dir="data/la_palma_obs_versions")
+    "data/la_palma_obs_versions/versions/v000004"
     """
+    if store_dir is not None:
+        # Imported here, as snapshot_utils depends on this module through storage_utils
+        from pipmag.snapshot_utils import SnapshotStore
+        store = SnapshotStore(store_dir)
+        if store.latest() is not None:
+            latest_file = store.get_path()
+            print(f'Latest file: {latest_file}')
+            return latest_file
     # define a function that extracts the timestamp from a list of file names
     # and returns the file name with the latest timestamp
     file_list = glob.glob(file_pattern)
@@ -120,7 +197,7 @@ def get_latest_file(file_pattern):
         print('No files found')
     return latest_file
 
-def save_pickle(data, filename):
+def save_pickle(data, filename, compression=False):
     """
     Save data as a pickle file.
 
@@ -130,6 +207,9 @@ def save_pickle(data, filename):
         The data to be saved as a pickle file.
     filename : str
         The name of the file to which the data will be saved.
+    compression : bool or str, optional
+        False (default) writes a plain pickle. None, 'zlib' or 'lzma' writes a chunked snapshot with
+        that compression instead (see `save_snapshot`), which `load_pickle` reads as well.
 
     Returns
     -------
@@ -138,6 +218,7 @@ def save_pickle(data, filename):
     Dependencies
     ------------
     - pickle: Required for pickling and saving data.
+    - save_snapshot: Required for the chunked snapshot format.
 
     Notes
     -----
@@ -154,6 +235,9 @@ def save_pickle(data, filename):
     (No output; data is saved as "data.pickle" file.)
     """
     # define a function that takes data and filename as input and saves the data as a pickle file
+    if compression is not False:
+        save_snapshot(data, filename, compression=compression)
+        return
     with open(filename, 'wb') as f:
         pickle.dump(data, f)
 
@@ -182,6 +266,7 @@ def load_pickle(filename):
     This function takes a filename as input and loads the data from the specified pickle file.
     It opens the file in binary read mode and uses pickle.load() to read the data from the file.
     Unpickling is the process of deserializing the data stored in a pickle file back into Python objects.
+    Files in the chunked snapshot format of `save_snapshot` are recognized and loaded with `load_snapshot`.
     The function returns the loaded data.
     A success message is printed to indicate that the file was loaded successfully.
 
@@ -192,12 +277,524 @@ def load_pickle(filename):
     (The loaded data is returned and assigned to the variable "loaded_data".)
     """
     # define a function that takes filename as input and loads the data from the pickle file
-    with open(filename, 'rb') as f:
-        data = pickle.load(f)
+    if is_snapshot(filename):
+        data = load_snapshot(filename)
+    else:
+        with open(filename, 'rb') as f:
+            data = pickle.load(f)
     print(f'loaded {filename} successfully')
     return data
 
-def read_and_format_csv(file_path, expected_columns=None):
+def is_snapshot(filename):
+    """
+    Return True if the file starts with the magic bytes of the chunked snapshot format.
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def save_snapshot(data, filename, compression='zlib', chunk_size=SNAPSHOT_CHUNK_SIZE, max_workers=None):
+    """
+    Save data in the chunked snapshot format.
+
+    Parameters
+    ----------
+    data : object
+        The data to be saved. A dictionary with string keys is stored as one part per key,
+        which can be loaded selectively; anything else is stored as a single part.
+    filename : str
+        The name of the file to which the data will be saved.
+    compression : str or None, optional
+        The compression applied to each chunk: 'zlib' (default), 'lzma' or None.
+    chunk_size : int, optional
+        The size of the chunks that are compressed independently (default: SNAPSHOT_CHUNK_SIZE).
+    max_workers : int, optional
+        The number of threads compressing chunks. The default is None, which lets ThreadPoolExecutor decide.
+
+    Returns
+    -------
+    None
+
+    Dependencies
+    ------------
+    - pickle: Required for pickling the data with protocol 5.
+    - zlib, lzma: Required for the compression of the chunks.
+    - concurrent.futures: Required to compress the chunks in a thread pool.
+
+    Notes
+    -----
+    Function Name: save_snapshot
+    Each part is pickled with protocol 5, and the data buffers of NumPy arrays (and so of the numeric
+    columns of pandas DataFrames) are kept out of band instead of being copied into the pickle stream.
+    The pickle stream and every buffer are cut into chunks that are compressed in a thread pool
+    (zlib and lzma release the GIL). The file holds the magic bytes, the length and JSON of a header
+    index with the offsets of all chunks, and the chunks. It is written to a temporary file and renamed into place.
+
+    Examples
+    --------
+    >>> save_snapshot({'links': all_media_links, 'df': df}, 'data/crawl.snapshot', compression='lzma')
+    (No output; the two parts are saved to data/crawl.snapshot.)
+    """
+    compress = SNAPSHOT_COMPRESSORS[compression][0]
+    if isinstance(data, dict) and data and all(isinstance(key, str) for key in data):
+        items, keyed = list(data.items()), True
+    else:
+        items, keyed = [(None, data)], False
+
+    # Pickle every part, keeping the buffers out of band, and cut everything into chunks
+    blobs, parts = [], []
+    for key, value in items:
+        buffers = []
+        stream = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+        part = {'key': key, 'stream': len(blobs), 'buffers': []}
+        blobs.append(memoryview(stream))
+        for buffer in buffers:
+            part['buffers'].append(len(blobs))
+            blobs.append(buffer.raw())
+        parts.append(part)
+    chunks = [(index, blob[start:start + chunk_size])
+              for index, blob in enumerate(blobs) for start in range(0, max(len(blob), 1), chunk_size)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        compressed = list(executor.map(lambda chunk: compress(chunk[1]), chunks))
+
+    blob_chunks = [[] for _ in blobs]
+    offset = 0
+    for (index, chunk), data_chunk in zip(chunks, compressed):
+        blob_chunks[index].append([offset, len(data_chunk), len(chunk)])
+        offset += len(data_chunk)
+    header = json.dumps({'version': SNAPSHOT_VERSION, 'compression': compression, 'keyed': keyed,
+                         'parts': parts, 'blobs': blob_chunks}).encode('utf-8')
+
+    temp_path = f'{filename}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for data_chunk in compressed:
+            f.write(data_chunk)
+    os.replace(temp_path, filename)
+
+
+def load_snapshot(filename, keys=None, max_workers=None):
+    """
+    Load data saved with `save_snapshot`, optionally only some of its parts.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the snapshot file.
+    keys : list, optional
+        The keys of the parts to load, if the data was a dictionary with string keys.
+        The default is None, which loads all parts.
+    max_workers : int, optional
+        The number of threads decompressing chunks. The default is None, which lets ThreadPoolExecutor decide.
+
+    Returns
+    -------
+    object
+        The saved data, or a dictionary with only the requested keys.
+
+    Dependencies
+    ------------
+    - pickle: Required for unpickling the parts.
+    - zlib, lzma: Required for the decompression of the chunks.
+    - concurrent.futures: Required to decompress the chunks in a thread pool.
+
+    Notes
+    -----
+    Function Name: load_snapshot
+    Only the header index and the chunks of the requested parts are read from the file.
+    The out-of-band buffers are restored as writable bytearrays, so loaded NumPy arrays are writable.
+    A ValueError is raised if the file is not a snapshot or has an unsupported version.
+
+    Examples
+    --------
+    >>> load_snapshot('data/crawl.snapshot', keys=['df'])
+    {'df': ...}
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a snapshot file: {filename}")
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length))
+        if header['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {header['version']}")
+        data_start = f.tell()
+
+        parts = header['parts']
+        if keys is not None:
+            parts = [part for part in parts if part['key'] in set(keys)]
+        chunk_list = []
+        for part in parts:
+            for index in [part['stream']] + part['buffers']:
+                chunk_list.extend((index, offset, length) for offset, length, _ in header['blobs'][index])
+        raw_chunks = []
+        for index, offset, length in chunk_list:
+            f.seek(data_start + offset)
+            raw_chunks.append(f.read(length))
+
+    decompress = SNAPSHOT_COMPRESSORS[header['compression']][1]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        decompressed = list(executor.map(decompress, raw_chunks))
+    blobs = {}
+    for (index, _, _), data_chunk in zip(chunk_list, decompressed):
+        blobs.setdefault(index, bytearray()).extend(data_chunk)
+
+    values = {part['key']: pickle.loads(blobs.get(part['stream'], b''),
+                                        buffers=[blobs.get(index, bytearray()) for index in part['buffers']])
+              for part in parts}
+    if not header['keyed']:
+        return values[None]
+    return values
+
+
+def split_at_offsets(values, offsets):
+    """
+    Cut a flat array into one list per group, where group i spans values[offsets[i]:offsets[i + 1]].
+    """
+    if len(offsets) < 2:
+        return []
+    return [part.tolist() for part in np.split(values, offsets[1:-1])]
+
+
+def decode_list_column(values, sep=';'):
+    """
+    Return an object array with the list of each cell of a column of sep-joined strings, with [] for missing cells.
+    The present cells are split by mapping `str.split` over them, so no Python code runs per cell.
+    """
+    values = np.asarray(values, dtype=object)
+    present = pd.notna(values)
+    texts = values[present].tolist()
+    cells = np.empty(len(values), dtype=object)
+    cells[present] = np.fromiter(map(str.split, texts, repeat(sep)), dtype=object, count=len(texts))
+    for i in np.flatnonzero(~present):
+        cells[i] = []
+    return cells
+
+
+def encode_list_column(values, sep=';'):
+    """
+    Return an object array with the sep-joined string of each list cell of a column.
+    Cells that are not lists are kept as they are. The list cells are joined by mapping `sep.join` over them.
+    """
+    values = np.asarray(values, dtype=object)
+    is_list = np.fromiter(map(type, values), dtype=object, count=len(values)) == list
+    cells = values.copy()
+    cells[is_list] = np.fromiter(map(sep.join, values[is_list]), dtype=object, count=int(is_list.sum()))
+    return cells
+
+
+def decode_list_columns(df, columns=LIST_COLUMNS, sep=';'):
+    """
+    Converts the ';'-joined string columns of an observation DataFrame to list columns, in place.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame, e.g. as read from 'la_palma_obs_data.csv'.
+    columns : list, optional
+        The columns to convert (default: LIST_COLUMNS). Columns missing from df are skipped.
+    sep : str, optional
+        The separator of the list items (default: ';').
+
+    Returns
+    -------
+    pd.DataFrame
+        The same DataFrame, for chaining.
+
+    Dependencies
+    ------------
+    decode_list_column function
+
+    Notes
+    -----
+    Function Name: decode_list_columns
+    This is the one implementation of the list codec used when reading CSV files. The missing cells
+    of each column are found with one vectorized `pd.notna`, and `str.split` is mapped over the other
+    cells, instead of calling a Python function per cell through `Series.apply`. Missing cells become
+    empty lists. `encode_list_columns` is the inverse.
+
+    Examples
+    --------
+    >>> df = decode_list_columns(pd.read_csv('data/la_palma_obs_data.csv'))
+    >>> df.at[0, 'instruments']
+    ['CRISP', 'CHROMIS']
+    """
+    for col in columns:
+        if col in df.columns:
+            df[col] = decode_list_column(df[col].values, sep)
+    return df
+
+
+def encode_list_columns(df, columns=LIST_COLUMNS, sep=';'):
+    """
+    Converts the list columns of an observation DataFrame to ';'-joined strings, in place,
+    as stored in CSV files. See `decode_list_columns`.
+    """
+    for col in columns:
+        if col in df.columns:
+            df[col] = encode_list_column(df[col].values, sep)
+    return df
+
+
+def nan_to_none(series):
+    """
+    Return the values of a Series as an object array with missing values replaced by None.
+    """
+    values = series.values.astype(object)
+    return np.where(pd.isna(values), None, values)
+
+
+def normalize_targets(targets):
+    """
+    Return the target strings with the spellings in TARGET_KEYWORDS rewritten to their standard form.
+
+    All keywords are replaced in one pass of the compiled TARGET_KEYWORD_PATTERN, and only where they
+    form whole words, so 'AR' becomes 'Active Region' but 'SOLAR' or 'Class' are left unchanged.
+    Each distinct string is rewritten once. Missing targets become None.
+    """
+    codes, uniques = pd.factorize(pd.Series(targets, dtype=object))
+    rewritten = np.array([TARGET_KEYWORD_PATTERN.sub(lambda m: TARGET_KEYWORD_MAP[m.group(0)], x) for x in uniques],
+                         dtype=object)
+    return np.where(codes >= 0, rewritten[codes] if len(rewritten) else None, None)
+
+
+def get_target_token_lists(targets):
+    """
+    Return the canonical target tokens of each target string.
+
+    Parameters
+    ----------
+    targets : iterable
+        The target strings, e.g. the 'target' column. Missing values are allowed.
+
+    Returns
+    -------
+    np.ndarray
+        An object array with a list of tokens per target, e.g. ['Active Region', 'Ellerman Bombs']
+        for 'AR, EB'. Missing targets get an empty list.
+
+    Dependencies
+    ------------
+    normalize_targets function
+
+    Notes
+    -----
+    Function Name: get_target_token_lists
+    A target string is normalized with `normalize_targets` and split at commas. Each stripped token is
+    looked up case-insensitively in TARGET_TOKEN_MAP, so 'Light bridge' and 'FIlament' become
+    'Light Bridge' and 'Filament' and abbreviations such as 'EB' are expanded. Other tokens are kept
+    as written. Repeated tokens are dropped. Each distinct string is tokenized once.
+
+    Examples
+    --------
+    >>> get_target_token_lists(['AR, Light bridge', None])
+    array([list(['Active Region', 'Light Bridge']), list([])], dtype=object)
+    """
+    codes, uniques = pd.factorize(pd.Series(targets, dtype=object))
+    token_lists = []
+    for target in normalize_targets(uniques):
+        tokens = (token.strip() for token in target.split(','))
+        token_lists.append(list(dict.fromkeys(TARGET_TOKEN_MAP.get(token.casefold(), token)
+                                              for token in tokens if token)))
+    token_lists.append([])
+    # Missing targets have code -1, which picks the trailing empty list
+    return np.fromiter((list(token_lists[code]) for code in codes), dtype=object, count=len(codes))
+
+
+def add_target_tokens(df):
+    """
+    Sets the 'target_tokens' list column of an observation DataFrame from its 'target' column, in place.
+    See `get_target_token_lists`.
+    """
+    df['target_tokens'] = get_target_token_lists(df['target'].values)
+    return df
+
+
+def to_compact_layout(df):
+    """
+    Converts an observation DataFrame to a compact typed layout.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, as returned by `read_and_format_csv`.
+
+    Returns
+    -------
+    pd.DataFrame
+        A copy of the DataFrame in which
+        - 'instruments' is categorical, holding the ';'-joined instrument names of each row,
+        - 'instrument_mask' is added, with one bit per instrument (see `instrument_utils.INSTRUMENT_BITS`),
+        - 'target' and 'comments' are categorical,
+        - 'polarimetry' is boolean,
+        - 'time' is replaced by 'seconds_of_day', the seconds since midnight as int32,
+        - 'year', 'month', 'day' and 'num_links' are downcast to the smallest integer type.
+
+    Dependencies
+    ------------
+    instrument_utils module (for the instrument bits)
+
+    Notes
+    -----
+    Function Name: to_compact_layout
+    The object columns of the CSV layout hold one Python object per cell. In this layout they are
+    integer codes or fixed-width numbers, so the table takes less memory and filters are vectorized
+    comparisons: instrument membership is `df['instrument_mask'] & bit`, the observing mode is
+    `df['polarimetry']` and time windows compare integers. The link and target token columns are kept as lists.
+    Run `scripts/memory_report.py` to compare the memory use of both layouts.
+
+    Examples
+    --------
+    >>> df = to_compact_layout(read_and_format_csv('data/la_palma_obs_data.csv'))
+    >>> df[df['instrument_mask'] & INSTRUMENT_BITS['CRISP'] != 0]
+    (Rows observed with CRISP.)
+    """
+    df = df.copy()
+    if 'instruments' in df.columns:
+        joined = [';'.join(item.strip() for item in x) if isinstance(x, Sequence) and not isinstance(x, str) else None
+                  for x in df['instruments']]
+        instruments = pd.Categorical(joined)
+        masks = np.array([iu.get_instrument_mask(x.split(';')) for x in instruments.categories], dtype=np.int64)
+        mask_dtype = np.min_scalar_type(sum(iu.INSTRUMENT_BITS.values()))
+        codes = instruments.codes
+        df['instruments'] = instruments
+        position = df.columns.get_loc('instruments') + 1
+        df.insert(position, 'instrument_mask', np.where(codes >= 0, masks[codes] if len(masks) else 0, 0)
+                  .astype(mask_dtype))
+    for col in ['target', 'comments']:
+        if col in df.columns:
+            df[col] = pd.Categorical(nan_to_none(df[col]))
+    if 'polarimetry' in df.columns:
+        df['polarimetry'] = df['polarimetry'].astype(str).eq('True').values
+    if 'time' in df.columns:
+        date_times = pd.to_datetime(df['date_time'])
+        seconds = ((date_times - date_times.dt.normalize()) // pd.Timedelta(seconds=1)).astype(np.int32)
+        df.insert(df.columns.get_loc('time'), 'seconds_of_day', seconds.values)
+        df = df.drop(columns=['time'])
+    for col in ['year', 'month', 'day', 'num_links']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+
+def get_file_checksum(file_path):
+    """
+    Return the SHA-1 hex digest of the content of a file, read in 1 MiB blocks.
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_csv_snapshot(file_path, suffix=CSV_SNAPSHOT_SUFFIX):
+    """
+    Loads the formatted DataFrame snapshot of a CSV file, if it is still valid.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the CSV file.
+    suffix : str, optional
+        The suffix of the snapshot file (default: CSV_SNAPSHOT_SUFFIX).
+
+    Returns
+    -------
+    object or None
+        The data stored in the snapshot (the formatted DataFrame for `read_and_format_csv`),
+        or None if there is no valid snapshot.
+
+    Dependencies
+    ------------
+    - load_snapshot: Required for loading the snapshot.
+    - os: Required to read the size and modification time of the CSV file.
+
+    Notes
+    -----
+    Function Name: load_csv_snapshot
+    The snapshot is a `save_snapshot` file with a small 'header' part holding the version, size,
+    modification time and checksum of the CSV file it was made from, so it can be validated without
+    loading the 'data' part. If size and modification time match, the snapshot is used as is.
+    If only the modification time differs (e.g. after a git checkout), the checksum of the CSV file decides,
+    and a matching snapshot is written again with the new modification time, so the checksum is computed once.
+    Unreadable or outdated snapshots are ignored.
+
+    Examples
+    --------
+    >>> df = load_csv_snapshot('data/la_palma_obs_data.csv')
+    (Returns the formatted DataFrame, or None if the CSV file changed since the snapshot was written.)
+    """
+    snapshot_path = file_path + suffix
+    try:
+        stat = os.stat(file_path)
+        header = load_snapshot(snapshot_path, keys=['header'])['header']
+        if header.get('version') != CSV_SNAPSHOT_VERSION or header.get('size') != stat.st_size:
+            return None
+        checksum = None
+        if header.get('mtime_ns') != stat.st_mtime_ns:
+            checksum = get_file_checksum(file_path)
+            if header.get('checksum') != checksum:
+                return None
+        data = load_snapshot(snapshot_path, keys=['data'])['data']
+    except (OSError, ValueError, KeyError, struct.error, pickle.UnpicklingError, EOFError, AttributeError,
+            ImportError):
+        return None
+    if checksum is not None:
+        save_csv_snapshot(file_path, data, suffix, checksum=checksum)
+    return data
+
+
+def save_csv_snapshot(file_path, df, suffix=CSV_SNAPSHOT_SUFFIX, checksum=None):
+    """
+    Saves a formatted DataFrame as a binary snapshot next to the CSV file it was read from.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the CSV file. The snapshot is written to `file_path + suffix`.
+    df : object
+        The data to store, usually the DataFrame formatted by `read_and_format_csv`.
+    suffix : str, optional
+        The suffix of the snapshot file (default: CSV_SNAPSHOT_SUFFIX).
+    checksum : str, optional
+        The checksum of the CSV file, if it is already known. The default is None, which computes it.
+
+    Returns
+    -------
+    None
+
+    Dependencies
+    ------------
+    - save_snapshot: Required for writing the snapshot.
+
+    Notes
+    -----
+    Function Name: save_csv_snapshot
+    The snapshot is written uncompressed with `save_snapshot`, since it is a local cache that is read
+    on every load, and `save_snapshot` renames it into place, so a concurrent reader never sees
+    a partial snapshot. A snapshot that cannot be written (e.g. in a read-only directory) is skipped.
+
+    Examples
+    --------
+    >>> save_csv_snapshot('data/la_palma_obs_data.csv', df)
+    (No output; data/la_palma_obs_data.csv.snapshot.pkl is written.)
+    """
+    snapshot_path = file_path + suffix
+    try:
+        stat = os.stat(file_path)
+        header = {'version': CSV_SNAPSHOT_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                  'checksum': checksum or get_file_checksum(file_path)}
+        save_snapshot({'header': header, 'data': df}, snapshot_path, compression=None)
+    except OSError:
+        temp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def read_and_format_csv(file_path, expected_columns=None, use_snapshot=True, compact=False):
     """
     Reads a CSV file into a DataFrame and formats specified columns.
     The function includes both error handling and type checking.
@@ -209,6 +806,11 @@ def read_and_format_csv(file_path, expected_columns=None):
     expected_columns : list, optional
         A list of column names that are expected to be in the DataFrame.
         The default is None, which skips the column check.
+    use_snapshot : bool, optional
+        Flag indicating whether to load the formatted DataFrame from its binary snapshot when the
+        CSV file is unchanged, and to write the snapshot after parsing (default: True).
+    compact : bool, optional
+        Flag indicating whether to return the compact typed layout of `to_compact_layout` (default: False).
 
     Returns
     -------
@@ -219,6 +821,7 @@ def read_and_format_csv(file_path, expected_columns=None):
     Dependencies
     ------------
     pandas as pd
+    load_csv_snapshot, save_csv_snapshot functions
 
     Notes
     -----
@@ -226,7 +829,9 @@ def read_and_format_csv(file_path, expected_columns=None):
     The function reads a CSV file into a DataFrame and applies several formatting operations.
     These include converting the 'date_time' column to datetime format,
     converting specified columns from strings to lists, replacing NaN values with None in specified columns,
-    and converting the 'polarimetry' column to a string.
+    converting the 'polarimetry' column to a string and adding the 'target_tokens' column (see `add_target_tokens`).
+    The formatted DataFrame is stored in a snapshot next to the CSV file (see `save_csv_snapshot`),
+    and later calls load the snapshot instead of parsing the CSV file again, as long as the CSV file is unchanged.
 
     The function expects the CSV file to have the following format:
     ```
@@ -241,6 +846,13 @@ def read_and_format_csv(file_path, expected_columns=None):
     Returns a DataFrame with the specified formatting if the file and columns are valid.
     """
 
+    # Load the formatted DataFrame from the snapshot if the CSV file is unchanged
+    df = load_csv_snapshot(file_path) if use_snapshot else None
+    if df is not None:
+        if expected_columns and not set(expected_columns).issubset(set(df.columns)):
+            return f"Error: Missing expected columns. Expected: {expected_columns}, Found: {list(df.columns)}"
+        return to_compact_layout(df) if compact else df
+
     try:
         # Read the DataFrame from the CSV file
         df = pd.read_csv(file_path)
@@ -259,26 +871,280 @@ def read_and_format_csv(file_path, expected_columns=None):
     # Convert the 'date_time' column to datetime format
     df['date_time'] = pd.to_datetime(df['date_time'])
 
-    # Columns to convert from strings to lists
-    list_columns = ['links', 'video_links', 'image_links', 'instruments']
-
-    # Convert the strings in each column to lists
-    for col in list_columns:
-        df[col] = df[col].apply(lambda x: x.split(';') if isinstance(x, str) else [])
+    # Convert the strings in the list columns to lists
+    decode_list_columns(df)
 
     # Columns to convert from NaN to None
     nan_to_none_columns = ['comments', 'polarimetry', 'target']
 
     # Convert the NaNs in each column to None
     for col in nan_to_none_columns:
-        df[col] = df[col].apply(lambda x: None if pd.isna(x) else x)
+        df[col] = nan_to_none(df[col])
 
     # Convert the 'polarimetry' column to string format
-    df['polarimetry'] = df['polarimetry'].apply(lambda x: str(x))
+    df['polarimetry'] = df['polarimetry'].astype(str)
+
+    # Derive the canonical target tokens, replacing any stored in the file
+    add_target_tokens(df)
 
+    if use_snapshot:
+        save_csv_snapshot(file_path, df)
+    if compact:
+        return to_compact_layout(df)
     return df
 
 
+class LinkStore:
+    """
+    Offset-indexed store of the link columns of an observation table, memory-mapped from disk.
+
+    Parameters
+    ----------
+    blob : np.ndarray
+        The UTF-8 bytes of the ';'-joined link strings of all rows and columns, as a (memory-mapped) uint8 array.
+    offsets : dict
+        A dictionary mapping each link column to an int64 array of n_rows + 1 byte offsets into `blob`.
+
+    Methods
+    -------
+    get(column, row)
+        Decode the list of links of one cell.
+
+    Notes
+    -----
+    Class Name: LinkStore
+    Only the bytes of the requested cell are read from the memory map, so pages of the store
+    that are never accessed are never loaded.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def get(self, column, row):
+        offsets = self.offsets[column]
+        start, end = offsets[row], offsets[row + 1]
+        if start == end:
+            return []
+        return self.blob[start:end].tobytes().decode('utf-8').split(';')
+
+
+@register_extension_dtype
+class LazyLinkDtype(ExtensionDtype):
+    """
+    Pandas dtype of the link columns loaded by `read_and_format_csv_lazy`, see `LazyLinkArray`.
+    """
+    name = 'lazy_links'
+    type = list
+    kind = 'O'
+
+    @classmethod
+    def construct_array_type(cls):
+        return LazyLinkArray
+
+
+class LazyLinkArray(ExtensionArray):
+    """
+    Read-only pandas array of link lists, decoded from a LinkStore when a cell is accessed.
+
+    Parameters
+    ----------
+    store : LinkStore
+        The store holding the links.
+    column : str
+        The link column of the store that the array reads.
+    rows : np.ndarray
+        The int64 row of the store of each element, or -1 for a missing element.
+
+    Notes
+    -----
+    Class Name: LazyLinkArray
+    The array holds the row numbers only, so loading a column creates no Python object per cell.
+    Accessing a cell (`df.at`, iteration, `tolist`, `apply`) returns a plain list, so the code that
+    reads the link columns, including `prepare_for_parquet` and `catalog_utils.build_catalog`, works unchanged.
+    Filtering, sorting and `take` only select rows. Arrays of other stores are concatenated by
+    re-encoding their links into an in-memory store.
+    """
+
+    def __init__(self, store, column, rows):
+        self.store = store
+        self.column = column
+        self.rows = np.asarray(rows, dtype=np.int64)
+
+    @classmethod
+    def _from_sequence(cls, scalars, dtype=None, copy=False):
+        cells = [list(x) if isinstance(x, Sequence) and not isinstance(x, str) else [] for x in scalars]
+        encoded = [';'.join(x).encode('utf-8') for x in cells]
+        lengths = np.fromiter((len(x) for x in encoded), dtype=np.int64, count=len(encoded))
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        store = LinkStore(np.frombuffer(b''.join(encoded), dtype=np.uint8), {None: offsets})
+        return cls(store, None, np.arange(len(cells)))
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls._from_sequence(values)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        first = to_concat[0]
+        if all(x.store is first.store and x.column == first.column for x in to_concat):
+            return cls(first.store, first.column, np.concatenate([x.rows for x in to_concat]))
+        return cls._from_sequence([cell for x in to_concat for cell in x])
+
+    @property
+    def dtype(self):
+        return LazyLinkDtype()
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, item):
+        if is_integer(item):
+            row = self.rows[item]
+            return self.store.get(self.column, row) if row >= 0 else self.dtype.na_value
+        return type(self)(self.store, self.column, self.rows[check_array_indexer(self, item)])
+
+    def __eq__(self, other):
+        others = other if isinstance(other, (ExtensionArray, np.ndarray, pd.Series)) else [other] * len(self)
+        return np.array([a == b for a, b in zip(self, others)], dtype=bool)
+
+    def __array__(self, dtype=None):
+        # Fill an object array element by element, so that numpy does not turn the lists into a 2-D array
+        cells = np.empty(len(self), dtype=object)
+        for i, cell in enumerate(self):
+            cells[i] = cell
+        return cells
+
+    def isna(self):
+        return self.rows < 0
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        rows = take(self.rows, indices, allow_fill=allow_fill, fill_value=-1)
+        return type(self)(self.store, self.column, rows)
+
+    def copy(self):
+        return type(self)(self.store, self.column, self.rows.copy())
+
+
+def build_link_store(df, store_path):
+    """
+    Writes the link columns of a formatted observation DataFrame into a link store file.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame formatted by `read_and_format_csv`, with the link columns holding lists.
+    store_path : str
+        The path of the .npy file holding the link bytes.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping each link column to its int64 array of row offsets into the store.
+
+    Dependencies
+    ------------
+    numpy as np
+
+    Notes
+    -----
+    Function Name: build_link_store
+    The cells are stored as ';'-joined UTF-8 strings, back to back, column after column.
+    The offsets are returned instead of written to the store, so that they can be kept with the scalar columns.
+    The store is written to a temporary file and renamed into place.
+
+    Examples
+    --------
+    >>> offsets = build_link_store(df, 'data/la_palma_obs_data.csv.links.npy')
+    """
+    chunks, offsets, position = [], {}, 0
+    for col in LAZY_LINK_COLUMNS:
+        encoded = [';'.join(x).encode('utf-8') for x in df[col]]
+        lengths = np.fromiter((len(x) for x in encoded), dtype=np.int64, count=len(encoded))
+        offsets[col] = position + np.concatenate(([0], np.cumsum(lengths)))
+        position = int(offsets[col][-1])
+        chunks.extend(encoded)
+    temp_path = f'{store_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.save(f, np.frombuffer(b''.join(chunks), dtype=np.uint8))
+    # Replace the store atomically, since other sessions may have the old one memory-mapped
+    os.replace(temp_path, store_path)
+    return offsets
+
+
+def read_and_format_csv_lazy(file_path, expected_columns=None):
+    """
+    Reads a CSV file like `read_and_format_csv`, but loads the link columns lazily.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the CSV file that is to be read.
+    expected_columns : list, optional
+        A list of column names that are expected to be in the DataFrame.
+        The default is None, which skips the column check.
+
+    Returns
+    -------
+    pd.DataFrame or str
+        Returns the formatted DataFrame, with `LazyLinkArray` columns for 'links', 'video_links'
+        and 'image_links', if the file reading and formatting are successful.
+        Otherwise, returns an error message.
+
+    Dependencies
+    ------------
+    read_and_format_csv, build_link_store, load_csv_snapshot, save_csv_snapshot functions
+    LinkStore, LazyLinkArray classes
+    numpy as np
+
+    Notes
+    -----
+    Function Name: read_and_format_csv_lazy
+    On the first call the CSV file is parsed in full, the link columns are written to a link store
+    (`file_path + LINK_STORE_SUFFIX`) and the scalar columns with the row offsets of the store to a snapshot
+    (`file_path + LAZY_SNAPSHOT_SUFFIX`). While the CSV file is unchanged, later calls only load the small
+    snapshot and memory-map the link store. The links of a cell are decoded each time the cell is accessed.
+    The other columns are formatted exactly as by `read_and_format_csv`.
+
+    Examples
+    --------
+    >>> df = read_and_format_csv_lazy('data/la_palma_obs_data.csv')
+    >>> df.at[0, 'video_links'][0]
+    (Only the video links of the first row are decoded.)
+    """
+    store_path = file_path + LINK_STORE_SUFFIX
+    snapshot = load_csv_snapshot(file_path, suffix=LAZY_SNAPSHOT_SUFFIX)
+    blob = None
+    if snapshot is not None and os.path.exists(store_path):
+        df, offsets = snapshot
+        blob = np.load(store_path, mmap_mode='r')
+        if blob.size != offsets[LAZY_LINK_COLUMNS[-1]][-1]:
+            blob = None
+    if blob is None:
+        df = read_and_format_csv(file_path, expected_columns)
+        if isinstance(df, str):
+            return df
+        offsets = build_link_store(df, store_path)
+        df = df.drop(columns=LAZY_LINK_COLUMNS)
+        save_csv_snapshot(file_path, (df, offsets), suffix=LAZY_SNAPSHOT_SUFFIX)
+        blob = np.load(store_path, mmap_mode='r')
+
+    if expected_columns and not set(expected_columns).issubset(set(df.columns) | set(LAZY_LINK_COLUMNS)):
+        return f"Error: Missing expected columns. Expected: {expected_columns}, Found: {list(df.columns)}"
+
+    store = LinkStore(blob, offsets)
+    for col in LAZY_LINK_COLUMNS:
+        df[col] = LazyLinkArray(store, col, np.arange(len(df)))
+    csv_columns = ['date_time', 'year', 'month', 'day', 'time', 'instruments', 'target', 'comments',
+                   'video_links', 'image_links', 'links', 'num_links', 'polarimetry']
+    columns = [col for col in csv_columns if col in df.columns]
+    return df[columns + [col for col in df.columns if col not in columns]]
+
+
 def preprocess_and_save_dataframe(df, la_palma_obs_data_file):
     """
     Preprocesses the input DataFrame and saves it as a .csv file.
@@ -304,9 +1170,10 @@ def preprocess_and_save_dataframe(df, la_palma_obs_data_file):
     -----
     Function Name: preprocess_and_save_dataframe
     This function performs the following preprocessing steps:
-    1. Rewrites specific keywords in the 'target' column to a standardized format.
-    2. Converts lists in certain columns to semi-colon separated strings.
-    3. Saves the preprocessed DataFrame to a .csv file.
+    1. Rewrites specific keywords in the 'target' column to a standardized format (see `normalize_targets`).
+    2. Sets the 'target_tokens' column from the rewritten targets (see `add_target_tokens`).
+    3. Converts lists in certain columns to semi-colon separated strings.
+    4. Saves the preprocessed DataFrame to a .csv file.
 
     Examples
     --------
@@ -314,28 +1181,10 @@ def preprocess_and_save_dataframe(df, la_palma_obs_data_file):
     The DataFrame `df` will be preprocessed and saved at "path/to/save/file.csv".
     """
 
-    def rewrite_keywords(text, target_keywords, replace_with):
-        for keyword in target_keywords:
-            if keyword in text:
-                text = text.replace(keyword, replace_with)
-        return text
+    df['target'] = normalize_targets(df['target'].values)
+    add_target_tokens(df)
 
-    ACTIVE_REGION_KEYWORDS = {'active region', 'Active region', 'AR'}
-    QUIET_SUN_KEYWORDS = {'quiet Sun', 'quiet sun', 'QS', 'Quiet sun'}
-    SUNSPOT_KEYWORDS = {'sunspot', 'Sunspot', 'SS', 'ss', 'SUnspot'}
-
-    df['target'] = df['target'].apply(lambda x: None if pd.isna(
-        x) else rewrite_keywords(x, ACTIVE_REGION_KEYWORDS, "Active Region"))
-    df['target'] = df['target'].apply(lambda x: None if pd.isna(
-        x) else rewrite_keywords(x, QUIET_SUN_KEYWORDS, "Quiet Sun"))
-    df['target'] = df['target'].apply(lambda x: None if pd.isna(
-        x) else rewrite_keywords(x, SUNSPOT_KEYWORDS, "Sunspot"))
-
-    df_copy = df.copy()
-
-    columns_to_convert = ['links', 'video_links', 'image_links', 'instruments']
-    for col in columns_to_convert:
-        df_copy[col] = df_copy[col].apply(lambda x: ';'.join(x))
+    df_copy = encode_list_columns(df.copy())
 
     df_copy.to_csv(la_palma_obs_data_file, index=False)
 
@@ -380,3 +1229,259 @@ def read_and_format_csv_for_query(file_path):
         df[col] = df[col].apply(lambda x: 'None' if pd.isna(x) else x)
 
     return df
+
+
+def prepare_for_parquet(df):
+    """
+    Converts an observation DataFrame to the typed layout stored in Parquet files.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, with list columns holding lists (as returned by `read_and_format_csv`).
+
+    Returns
+    -------
+    pd.DataFrame
+        A copy of the DataFrame with native list columns, a datetime 'date_time' column,
+        a boolean 'polarimetry' column and a categorical 'target' column.
+
+    Dependencies
+    ------------
+    pandas as pd
+
+    Notes
+    -----
+    Function Name: prepare_for_parquet
+    Missing lists become empty lists and the instrument names are stripped of surrounding whitespace,
+    so 'CRISP;  CHROMIS' in a CSV file is stored as ['CRISP', 'CHROMIS'].
+    The 'polarimetry' column is True for the values True and 'True', and False otherwise.
+
+    Examples
+    --------
+    >>> prepare_for_parquet(df).dtypes['polarimetry']
+    dtype('bool')
+    """
+    df = df.copy()
+    df['date_time'] = pd.to_datetime(df['date_time'])
+    for col in LIST_COLUMNS:
+        if col in df.columns:
+            df[col] = [list(x) if isinstance(x, (list, tuple)) else [] for x in df[col]]
+    if 'instruments' in df.columns:
+        df['instruments'] = [[item.strip() for item in x] for x in df['instruments']]
+    if 'time' in df.columns:
+        df['time'] = df['time'].astype(str)
+    if 'polarimetry' in df.columns:
+        df['polarimetry'] = df['polarimetry'].astype(str).eq('True')
+    if 'target' in df.columns:
+        df['target'] = df['target'].astype('category')
+    return df
+
+
+def save_parquet(df, file_path):
+    """
+    Saves an observation DataFrame as a Parquet file with native list columns.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, with list columns holding lists.
+    file_path : str
+        The path of the Parquet file to write.
+
+    Returns
+    -------
+    None
+
+    Dependencies
+    ------------
+    pandas as pd
+    pyarrow (optional dependency, install with `pip install pipmag[parquet]`)
+
+    Notes
+    -----
+    Function Name: save_parquet
+    The DataFrame is converted with `prepare_for_parquet`, so the list columns are stored as
+    Parquet list columns rather than ';'-joined strings and need no splitting when loaded.
+    Use `preprocess_and_save_dataframe` to export the same table as CSV.
+
+    Examples
+    --------
+    >>> save_parquet(df, 'data/la_palma_obs_data.parquet')
+    (No output; the DataFrame is saved as a Parquet file.)
+    """
+    pa, pq = import_pyarrow()
+    table = pa.Table.from_pandas(prepare_for_parquet(df), preserve_index=False)
+    pq.write_table(table, file_path, compression='zstd')
+
+
+def read_parquet(file_path, columns=None):
+    """
+    Reads an observation table from a Parquet file, optionally only some of its columns.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the Parquet file that is to be read.
+    columns : list, optional
+        The columns to read, e.g. ['date_time', 'instruments', 'target'].
+        The default is None, which reads all columns.
+
+    Returns
+    -------
+    pd.DataFrame or str
+        Returns the typed DataFrame, with Python lists in the list columns, if the file could be read.
+        Otherwise, returns an error message.
+
+    Dependencies
+    ------------
+    pandas as pd
+    pyarrow (optional dependency, install with `pip install pipmag[parquet]`)
+
+    Notes
+    -----
+    Function Name: read_parquet
+    Only the requested columns are read from disk. The list columns are converted to Python lists
+    in one call per column, and the other columns keep their stored types
+    (datetime 'date_time', boolean 'polarimetry', categorical 'target').
+
+    Examples
+    --------
+    >>> read_parquet('data/la_palma_obs_data.parquet', columns=['date_time', 'instruments', 'target'])
+    Returns a DataFrame with the three requested columns.
+    """
+    pa, pq = import_pyarrow()
+    try:
+        table = pq.read_table(file_path, columns=columns)
+    except FileNotFoundError:
+        return "Error: The specified file was not found."
+    except (pa.ArrowInvalid, OSError):
+        return "Error: The file could not be parsed."
+
+    list_columns = [col for col in LIST_COLUMNS if col in table.column_names]
+    df = table.drop(list_columns).to_pandas()
+    for col in list_columns:
+        df[col] = table.column(col).to_pylist()
+    return df[table.column_names]
+
+
+def read_and_format_parquet(file_path, expected_columns=None, columns=None, compact=False):
+    """
+    Reads an observation table from a Parquet file in the same format as `read_and_format_csv`.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the Parquet file that is to be read.
+    expected_columns : list, optional
+        A list of column names that are expected to be in the DataFrame.
+        The default is None, which skips the column check.
+    columns : list, optional
+        The columns to read. The default is None, which reads all columns.
+    compact : bool, optional
+        Flag indicating whether to return the compact typed layout of `to_compact_layout` (default: False).
+
+    Returns
+    -------
+    pd.DataFrame or str
+        Returns a formatted DataFrame if the file reading and formatting are successful.
+        Otherwise, returns an error message.
+
+    Dependencies
+    ------------
+    pandas as pd
+    pyarrow (optional dependency, install with `pip install pipmag[parquet]`)
+
+    Notes
+    -----
+    Function Name: read_and_format_parquet
+    This is a drop-in replacement for `read_and_format_csv` for tables saved with `save_parquet`:
+    missing values in 'comments', 'polarimetry' and 'target' are None,
+    'target' is a plain object column and 'polarimetry' holds the strings 'True' and 'False'.
+
+    Examples
+    --------
+    >>> read_and_format_parquet('data/la_palma_obs_data.parquet')
+    Returns the same DataFrame as read_and_format_csv on the equivalent CSV file.
+    """
+    df = read_parquet(file_path, columns=columns)
+    if isinstance(df, str):
+        return df
+
+    # Check if the DataFrame has the expected columns
+    if expected_columns:
+        if not set(expected_columns).issubset(set(df.columns)):
+            return f"Error: Missing expected columns. Expected: {expected_columns}, Found: {list(df.columns)}"
+    if compact:
+        return to_compact_layout(df)
+
+    for col in ['comments', 'target']:
+        if col in df.columns:
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+    if 'polarimetry' in df.columns:
+        df['polarimetry'] = df['polarimetry'].astype(str)
+
+    return df
+
+
+def convert_csv_to_parquet(csv_file_path, parquet_file_path):
+    """
+    Converts an observation table from CSV to Parquet.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        The path to the CSV file, in the format read by `read_and_format_csv`.
+    parquet_file_path : str
+        The path of the Parquet file to write.
+
+    Returns
+    -------
+    None
+
+    Dependencies
+    ------------
+    read_and_format_csv function
+    save_parquet function
+
+    Notes
+    -----
+    Function Name: convert_csv_to_parquet
+    Raises a ValueError with the message of `read_and_format_csv` if the CSV file cannot be read.
+
+    Examples
+    --------
+    >>> convert_csv_to_parquet('data/la_palma_obs_data.csv', 'data/la_palma_obs_data.parquet')
+    (No output; the Parquet file is written.)
+    """
+    df = read_and_format_csv(csv_file_path)
+    if isinstance(df, str):
+        raise ValueError(df)
+    save_parquet(df, parquet_file_path)
+
+
+def import_pyarrow():
+    """
+    Imports pyarrow and its Parquet module, which are only needed for the Parquet storage backend.
+
+    Returns
+    -------
+    tuple
+        The `pyarrow` and `pyarrow.parquet` modules.
+
+    Dependencies
+    ------------
+    pyarrow (optional dependency)
+
+    Notes
+    -----
+    Function Name: import_pyarrow
+    Raises an ImportError with installation instructions if pyarrow is not installed.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("The Parquet storage backend requires pyarrow. "
+                          "Install it with `pip install pipmag[parquet]` or `pip install pyarrow`.")
+    return pa, pq
@@ -1,20 +1,53 @@
 import os
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+from itertools import chain
+import numpy as np
 import pandas as pd
-from datetime import timedelta
 from pipmag import la_palma_utils as lp
+from pipmag import instrument_utils as iu
+from pipmag import file_utils as fu
+from pipmag import storage_utils as stu
+from pipmag import upsert_utils as us
+from pipmag import snapshot_utils as su
+from pipmag import catalog_utils as cu
+from pipmag import journal_utils as ju
 
 # Constants
 MEDIA_LINKS_FILE = 'data/all_media_links.csv'
 LA_PALMA_OBS_DATA_FILE = 'data/la_palma_obs_data.csv'
+LA_PALMA_OBS_PARQUET_FILE = 'data/la_palma_obs_data.parquet'
+LA_PALMA_OBS_PARTITION_DIR = 'data/la_palma_obs_data'
+LA_PALMA_OBS_STORE_DIR = 'data/la_palma_obs_store'
+LA_PALMA_OBS_VERSIONS_DIR = 'data/la_palma_obs_versions'
+LA_PALMA_OBS_CATALOG_FILE = 'data/la_palma_obs_data.sqlite'
+SNAPSHOT_KEEP_LAST = 20
+PARSE_CACHE_FILE = 'data/link_parse_cache.snapshot'
+PARSE_CACHE_VERSION = 1
+# Number of media links read and processed at a time by iter_media_links and generate_dataframe_chunked
+MEDIA_LINKS_CHUNK_SIZE = 100000
 TIME_DIFF_THRESHOLD_SECONDS = 60
-INSTRUMENT_KEYWORDS = {
-    'CRISP': ['wb_6563', 'ha', 'Crisp', '6173', '8542', '6563', 'crisp'],
-    'CHROMIS': ['Chromis', 'cak', '4846'],
-    'IRIS': ['sji']
+# Session id columns and the gap (in seconds) that starts a new session at each level.
+# Sessions never span two days; None splits at the day boundary only.
+SESSION_GAP_THRESHOLDS = {
+    'scan_id': TIME_DIFF_THRESHOLD_SECONDS,
+    'run_id': 2 * 3600,
+    'day_id': None
 }
+# Columns curated by users, which the store keeps when an observation is regenerated upstream
+ANNOTATION_COLUMNS = ['target', 'comments']
 POLARIMETRY_KEYWORDS = {
     'True': ['Bz+Bh', 'blos', 'Blos']
 }
+MEDIA_KIND_KEYWORDS = {
+    'video': ['mp4', 'mov'],
+    'image': ['jpg', 'png']
+}
+
+# Everything that is known about a single media link once it has been parsed
+LinkRecord = namedtuple('LinkRecord', ['date_string', 'date_time', 'date_format', 'instruments',
+                                       'polarimetry', 'file_name', 'extension', 'kind'])
 
 def load_or_fetch_links(reload=False):
     """
@@ -48,60 +81,280 @@ def load_or_fetch_links(reload=False):
     return all_media_links
 
 
-def preprocess_links(all_media_links):
+def iter_media_links(chunk_size=MEDIA_LINKS_CHUNK_SIZE, file_path=MEDIA_LINKS_FILE):
     """
-    Preprocess media links to extract date and time, and filter out invalid dates.
+    Yield the media links of the link inventory as lists of at most `chunk_size` links, in file order.
+
+    Only one chunk of the 'Links' column is held in memory at a time, unlike `load_or_fetch_links`.
     """
-    # Get date and time from link list
-    date_time_from_all_media_links, date_time_not_found = lp.get_date_time_from_link_list(all_media_links)
+    with pd.read_csv(file_path, usecols=['Links'], chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield chunk['Links'].tolist()
 
-    # Filter out links without date and time
-    all_media_links_with_date_time = [link for link in all_media_links if link not in date_time_not_found]
 
-    # Filter out invalid dates
-    invalid_dates = lp.get_invalid_dates(date_time_from_all_media_links)
-    date_time_from_all_media_links = [date for date in date_time_from_all_media_links if date not in invalid_dates]
+def get_parse_signature():
+    """
+    Return a checksum of the keyword tables and date patterns that determine how a link is parsed.
+    """
+    tables = (PARSE_CACHE_VERSION, lp.DATE_PATTERN_LIST, lp.DATE_FORMAT_LIST,
+              iu.INSTRUMENT_KEYWORDS, POLARIMETRY_KEYWORDS, MEDIA_KIND_KEYWORDS)
+    return hashlib.sha1(repr(tables).encode('utf-8')).hexdigest()
 
-    return date_time_from_all_media_links, all_media_links_with_date_time
+
+def parse_link(link):
+    """
+    Parse a single media link into a LinkRecord, or return None if it has no valid date and time.
+    """
+    # Use the first date pattern that matches, as get_date_time_from_link_list does
+    date_string = None
+    for date_pattern in lp.DATE_PATTERN_LIST:
+        date_string = lp.get_date_time_from_link(link, date_pattern)
+        if date_string:
+            break
+    if not date_string:
+        return None
+
+    # Convert the date and time with the first format that fits, otherwise the date is invalid
+    date_time = None
+    for date_format in lp.DATE_FORMAT_LIST:
+        try:
+            date_time = datetime.strptime(date_string, date_format)
+            break
+        except ValueError:
+            pass
+    if date_time is None:
+        return None
+
+    # Classify the link by instrument, polarimetry and kind of media
+    instruments = iu.get_link_instruments(link)
+    polarimetry = any(keyword in link for keyword in POLARIMETRY_KEYWORDS['True'])
+    kind = next((kind for kind, keywords in MEDIA_KIND_KEYWORDS.items()
+                 if any(keyword in link for keyword in keywords)), None)
+    file_name = os.path.basename(link)
+    extension = os.path.splitext(file_name)[1].lstrip('.').lower()
+
+    return LinkRecord(date_string, date_time, date_format, instruments, polarimetry, file_name, extension, kind)
+
+
+def load_parse_cache(cache_file=PARSE_CACHE_FILE):
+    """
+    Load the persistent link parse cache, starting afresh if the keyword tables or patterns have changed.
+    """
+    signature = get_parse_signature()
+    if os.path.isfile(cache_file) and fu.is_snapshot(cache_file):
+        # Check the signature before loading the records
+        if fu.load_snapshot(cache_file, keys=['signature']).get('signature') == signature:
+            return fu.load_snapshot(cache_file)
+        print('Parse tables have changed, discarding the link parse cache')
+    return {'signature': signature, 'records': {}}
 
 
-def generate_dataframe(date_time_from_all_media_links, all_media_links_with_date_time):
+def save_parse_cache(parse_cache, cache_file=PARSE_CACHE_FILE):
     """
-    Generate DataFrame from preprocessed media links.
+    Save the link parse cache as a zlib-compressed snapshot (see `file_utils.save_snapshot`).
+    """
+    fu.save_snapshot(parse_cache, cache_file, compression='zlib')
+
+
+def parse_links(all_media_links, parse_cache=None):
     """
-    # Convert date and time to datetime format
-    date_time_from_all_media_links_datetime = lp.convert_to_datetime(date_time_from_all_media_links)
+    Return the LinkRecord (or None) of every link, parsing only the links missing from the parse cache.
+    """
+    if parse_cache is None:
+        parse_cache = {'signature': get_parse_signature(), 'records': {}}
+    records = parse_cache['records']
+
+    new_links = [link for link in dict.fromkeys(all_media_links) if link not in records]
+    for link in new_links:
+        records[link] = parse_link(link)
+    if new_links:
+        print(f'Parsed {len(new_links)} new links')
+
+    return [records[link] for link in all_media_links]
+
+
+def preprocess_links(all_media_links, parse_cache=None):
+    """
+    Preprocess media links to extract date and time, and filter out invalid dates.
+    """
+    records = parse_links(all_media_links, parse_cache)
 
-    # Create DataFrame from media links with datetime index
-    df = pd.DataFrame(all_media_links_with_date_time, index=date_time_from_all_media_links_datetime, columns=['links'])
+    # Keep only the links with a valid date and time, keeping the two lists aligned
+    date_time_from_all_media_links = []
+    all_media_links_with_date_time = []
+    for link, record in zip(all_media_links, records):
+        if record is not None:
+            date_time_from_all_media_links.append(record.date_string)
+            all_media_links_with_date_time.append(link)
 
-    # Group links by datetime index
-    df = df.groupby(df.index).agg({'links': lambda x: list(x)})
-    df['obs_id'] = range(0, len(df))
-    df['date_time'] = df.index
-    df = df.set_index('obs_id')
+    return date_time_from_all_media_links, all_media_links_with_date_time
+
+
+def generate_dataframe(date_time_from_all_media_links, all_media_links_with_date_time, parse_cache=None):
+    """
+    Generate DataFrame from preprocessed media links.
 
-    # Extract features from date and time
-    df['num_links'] = df['links'].apply(lambda x: len(x))
+    The timestamps and instrument information are taken from the parsed link records, so
+    links already in `parse_cache` are not parsed again. The links are sorted by the code of
+    their timestamp, and every column of the table is derived in a single pass from the
+    group offsets into that flat link array.
+    """
+    # Look up the parsed records of the links
+    records = parse_links(all_media_links_with_date_time, parse_cache)
+    date_times = np.array([record.date_time for record in records], dtype='datetime64[ns]')
+
+    # Per-link attributes as flat arrays
+    links = np.array(all_media_links_with_date_time, dtype=object)
+    instrument_masks = np.array([iu.get_instrument_mask(record.instruments) for record in records], dtype=np.int64)
+    polarimetric = np.array([record.polarimetry for record in records], dtype=bool)
+    kinds = np.array([record.kind for record in records], dtype=object)
+
+    # Code the links by timestamp and sort them so that every observation is a contiguous slice
+    codes, unique_date_times = pd.factorize(date_times, sort=True)
+    order = np.argsort(codes, kind='stable')
+    links, instrument_masks, polarimetric, kinds = (links[order], instrument_masks[order],
+                                                    polarimetric[order], kinds[order])
+    num_links = np.bincount(codes, minlength=len(unique_date_times))
+    offsets = np.concatenate(([0], np.cumsum(num_links)))
+    starts = offsets[:-1]
+
+    # Reduce the per-link attributes over each observation
+    observation_masks = np.bitwise_or.reduceat(instrument_masks, starts) if len(links) else instrument_masks
+    observation_polarimetry = np.logical_or.reduceat(polarimetric, starts) if len(links) else polarimetric
+    is_video = kinds == 'video'
+    is_image = kinds == 'image'
+    video_offsets = np.concatenate(([0], np.cumsum(is_video)))[offsets]
+    image_offsets = np.concatenate(([0], np.cumsum(is_image)))[offsets]
+    mask_instruments = {mask: iu.get_instruments_from_mask(mask) for mask in np.unique(observation_masks)}
+
+    df = pd.DataFrame({'date_time': pd.DatetimeIndex(unique_date_times)})
+    df.index.name = 'obs_id'
     df['year'] = df['date_time'].dt.year
     df['month'] = df['date_time'].dt.month
     df['day'] = df['date_time'].dt.day
     df['time'] = df['date_time'].dt.time
+    df['instruments'] = [list(mask_instruments[mask]) or None for mask in observation_masks]
     df['target'] = None
     df['comments'] = None
-    df['polarimetry'] = 'False'
+    df['video_links'] = fu.split_at_offsets(links[is_video], video_offsets)
+    df['image_links'] = fu.split_at_offsets(links[is_image], image_offsets)
+    df['links'] = fu.split_at_offsets(links, offsets)
+    df['num_links'] = num_links
+    df['polarimetry'] = np.where(observation_polarimetry, 'True', 'False')
 
-    # Extract instrument info from links
-    df['instruments'] = df['links'].apply(lambda x: lp.get_instrument_info(x, INSTRUMENT_KEYWORDS))
-    df['polarimetry'] = df['links'].apply(lambda x: lp.get_instrument_info(x, POLARIMETRY_KEYWORDS, 'False'))
-    df['video_links'] = df['links'].apply(lambda x: lp.get_links_with_string(x, ['mp4', 'mov']))
-    df['image_links'] = df['links'].apply(lambda x: lp.get_links_with_string(x, ['jpg', 'png']))
+    return df
 
-    # Reorder columns
-    df = df[['date_time', 'year', 'month', 'day', 'time', 'instruments', 'target', 'comments',
-             'video_links', 'image_links', 'links', 'num_links', 'polarimetry']]
 
-    return df
+def merge_dataframe_chunks(frames):
+    """
+    Merge the DataFrames generated from consecutive chunks of the link inventory into one.
+
+    Observations with the same timestamp in several chunks become one row, with their links concatenated
+    in chunk order and their instruments and polarimetry combined, so the result is the same as
+    `generate_dataframe` on all links at once.
+    """
+    df = pd.concat(frames, ignore_index=True).sort_values('date_time', kind='stable')
+    group_ids, _ = pd.factorize(df['date_time'].values, sort=True)
+    num_groups = int(group_ids.max()) + 1 if len(group_ids) else 0
+    if num_groups == len(df):
+        df = df.reset_index(drop=True)
+        df.index.name = 'obs_id'
+        return df
+
+    group_starts = np.flatnonzero(np.diff(group_ids, prepend=-1))
+    merged_df = df.iloc[group_starts].reset_index(drop=True)
+    merged_df.index.name = 'obs_id'
+    masks = np.array([iu.get_instrument_mask(x or []) for x in df['instruments']], dtype=np.int64)
+    merged_df['instruments'] = [iu.get_instruments_from_mask(mask) or None
+                                for mask in np.bitwise_or.reduceat(masks, group_starts)]
+    for column in ['video_links', 'image_links', 'links']:
+        merged_df[column] = merge_list_column(df[column].values, group_ids, num_groups, unique=False)
+    merged_df['num_links'] = np.add.reduceat(df['num_links'].values, group_starts)
+    polarimetric = np.logical_or.reduceat(df['polarimetry'].values == 'True', group_starts)
+    merged_df['polarimetry'] = np.where(polarimetric, 'True', 'False')
+    return merged_df
+
+
+def generate_dataframe_chunked(link_chunks, parse_cache=None):
+    """
+    Preprocess media links and generate the DataFrame one chunk of links at a time.
+
+    Parameters
+    ----------
+    link_chunks : iterable
+        Lists of media links, e.g. from `iter_media_links`.
+    parse_cache : dict, optional
+        The link parse cache (see `load_parse_cache`). The default is None, which parses every link
+        and only keeps the parsed records of the current chunk.
+
+    Returns
+    -------
+    pd.DataFrame
+        The same DataFrame as `generate_dataframe` on the preprocessed links of all chunks.
+
+    Notes
+    -----
+    Function Name: generate_dataframe_chunked
+    Each chunk goes through `preprocess_links` and `generate_dataframe` and only its DataFrame is kept,
+    so the per-link arrays of those steps are bounded by the chunk size rather than by the size of
+    the inventory. The chunk DataFrames are combined by `merge_dataframe_chunks`.
+
+    Examples
+    --------
+    >>> df = generate_dataframe_chunked(iter_media_links(chunk_size=50000), load_parse_cache())
+    """
+    frames = []
+    for links in link_chunks:
+        chunk_cache = parse_cache if parse_cache is not None else {'signature': get_parse_signature(), 'records': {}}
+        date_times, links_with_date_time = preprocess_links(links, chunk_cache)
+        frames.append(generate_dataframe(date_times, links_with_date_time, chunk_cache))
+    if not frames:
+        return generate_dataframe([], [], parse_cache)
+    return merge_dataframe_chunks(frames)
+
+
+def get_proximity_group_ids(date_times, threshold_seconds=TIME_DIFF_THRESHOLD_SECONDS):
+    """
+    Return a group id for each of the sorted timestamps, starting a new group wherever the gap
+    to the previous timestamp exceeds `threshold_seconds`.
+    """
+    date_times = np.asarray(date_times, dtype='datetime64[ns]')
+    if len(date_times) == 0:
+        return np.zeros(0, dtype=np.int64)
+    threshold = np.timedelta64(int(threshold_seconds * 1e9), 'ns')
+    new_group = np.diff(date_times) > threshold
+    return np.concatenate(([0], np.cumsum(new_group))).astype(np.int64)
+
+
+def merge_list_column(values, group_ids, num_groups, unique=True):
+    """
+    Merge the lists of consecutive rows sharing a group id, dropping repeated items (unless `unique`
+    is False) but keeping their order.
+
+    Every row is visited once: the lists are exploded into one flat sequence and cut at the group
+    boundaries, so the cost is linear in the total number of items. Missing values count as empty lists.
+    """
+    lists = [x if isinstance(x, list) else [] for x in values]
+    lengths = np.fromiter((len(x) for x in lists), dtype=np.int64, count=len(lists))
+    flat = list(chain.from_iterable(lists))
+    owners = np.repeat(group_ids, lengths)
+    bounds = np.searchsorted(owners, np.arange(num_groups + 1))
+    if not unique:
+        return [flat[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+    return [list(dict.fromkeys(flat[start:stop])) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def first_valid_per_group(values, group_ids, num_groups):
+    """
+    Return the first non-missing value of each group, or None if the group has no value.
+    """
+    values = np.asarray(values, dtype=object)
+    valid = np.flatnonzero(pd.notna(values))
+    firsts = np.full(num_groups, None, dtype=object)
+    # np.unique returns the index of the first occurrence of each group among the valid rows
+    groups, first = np.unique(group_ids[valid], return_index=True)
+    firsts[groups] = values[valid[first]]
+    return firsts
 
 
 def fix_duplicate_times(df):
@@ -110,85 +363,345 @@ def fix_duplicate_times(df):
     """
     # Convert 'date_time' column to DateTime type and sort DataFrame by 'date_time'
     df['date_time'] = pd.to_datetime(df['date_time'])
-    sorted_df = df.sort_values('date_time')
-
-    # Define threshold for time difference
-    threshold = timedelta(seconds=TIME_DIFF_THRESHOLD_SECONDS)
-
-    # Group rows based on time proximity
-    grouped_df = sorted_df.groupby((sorted_df['date_time'].diff() > threshold).cumsum()).agg({
-        'date_time': 'first',
-        'year': 'first',
-        'month': 'first',
-        'day': 'first',
-        'time': 'first',
-        'instruments': 'sum',
-        'target': 'first',
-        'comments': 'first',
-        'video_links': 'sum',
-        'image_links': 'sum',
-        'links': 'sum',
-        'num_links': 'sum',
-        'polarimetry': lambda x: 'True' if any(x) else 'False'
-    })
+    sorted_df = df.sort_values('date_time', kind='stable')
 
-    # Fix duplicates in 'instruments' column
-    grouped_df['instruments'] = grouped_df['instruments'].apply(lambda x: list(set(x)))
+    # Group rows whose timestamps are within the threshold of the previous row
+    group_ids = get_proximity_group_ids(sorted_df['date_time'].values)
+    num_groups = int(group_ids[-1]) + 1 if len(group_ids) else 0
+    group_starts = np.flatnonzero(np.diff(group_ids, prepend=-1))
 
-    # Convert 'date_time' column back to native Python datetime
-    grouped_df['date_time'] = grouped_df['date_time'].apply(lambda x: x.to_pydatetime())
+    grouped_df = pd.DataFrame({
+        column: sorted_df[column].values[group_starts] for column in ['date_time', 'year', 'month', 'day', 'time']
+    })
+    grouped_df['instruments'] = merge_list_column(sorted_df['instruments'].values, group_ids, num_groups)
+    grouped_df['target'] = first_valid_per_group(sorted_df['target'].values, group_ids, num_groups)
+    grouped_df['comments'] = first_valid_per_group(sorted_df['comments'].values, group_ids, num_groups)
+    for column in ['video_links', 'image_links', 'links']:
+        grouped_df[column] = merge_list_column(sorted_df[column].values, group_ids, num_groups)
+    grouped_df['num_links'] = np.array([len(links) for links in grouped_df['links']], dtype=np.int64)
+
+    # A group is polarimetric if any of its rows is
+    polarimetric = sorted_df['polarimetry'].astype(str).eq('True').values
+    polarimetric_groups = np.bincount(group_ids, weights=polarimetric, minlength=num_groups) > 0
+    grouped_df['polarimetry'] = np.where(polarimetric_groups, 'True', 'False')
 
     return grouped_df
 
-def add_existing_and_new_dataframes(new_df):
+
+def get_session_ids(date_times, thresholds=SESSION_GAP_THRESHOLDS, boundaries=None):
+    """
+    Return the session ids of the sorted timestamps at every level of `thresholds`.
+
+    The gaps between consecutive timestamps are computed once and each level is a cumulative sum
+    over them. Every level also splits at calendar days and wherever `boundaries` is True, so the
+    levels nest: a session at a smaller threshold never straddles two sessions at a larger one.
+    """
+    date_times = np.asarray(date_times, dtype='datetime64[ns]')
+    if len(date_times) == 0:
+        return {name: np.zeros(0, dtype=np.int64) for name in thresholds}
+
+    gaps = np.diff(date_times)
+    split = np.diff(date_times.astype('datetime64[D]')) != np.timedelta64(0, 'D')
+    if boundaries is not None:
+        split |= np.asarray(boundaries, dtype=bool)[1:]
+
+    session_ids = {}
+    for name, seconds in thresholds.items():
+        level_split = split if seconds is None else split | (gaps > np.timedelta64(int(seconds * 1e9), 'ns'))
+        session_ids[name] = np.concatenate(([0], np.cumsum(level_split))).astype(np.int64)
+    return session_ids
+
+
+def add_session_ids(df, thresholds=SESSION_GAP_THRESHOLDS, by=None):
+    """
+    Add one session id column per level of `thresholds` to the DataFrame.
+
+    Rows are ordered by 'date_time' once and the ids are numbered in time order. With `by`, a
+    change in any of those columns (e.g. 'target') between consecutive rows also starts a new session.
+    Coarser views of the archive are then a groupby on the id column, e.g. df.groupby('run_id').
+    """
+    df = df.copy()
+    date_times = pd.to_datetime(df['date_time']).values
+    order = np.argsort(date_times, kind='stable')
+
+    boundaries = None
+    if by:
+        sorted_by = df[by].iloc[order].fillna('').astype(str)
+        boundaries = (sorted_by != sorted_by.shift()).any(axis=1).values
+
+    session_ids = get_session_ids(date_times[order], thresholds, boundaries)
+    for name, ids in session_ids.items():
+        column = np.empty_like(ids)
+        column[order] = ids
+        df[name] = column
+    return df
+
+
+def get_stable_obs_id(date_time, tie_break=0):
+    """
+    Return the stable id of an observation, derived from its start time.
+
+    The id is the first 63 bits of the SHA-1 of the ISO start time, so it is a non-negative int64 that
+    does not depend on the row position or on the links of the observation. Observations that share
+    a start time are told apart by `tie_break`, their rank among those observations (see `add_obs_ids`).
+    """
+    content = pd.Timestamp(date_time).isoformat()
+    if tie_break:
+        content = f"{content}|{tie_break}"
+    return int(hashlib.sha1(content.encode('utf-8')).hexdigest()[:16], 16) >> 1
+
+
+def get_link_anchor(links):
+    """
+    Return the smallest media id of the links, each computed from its link alone,
+    so that it does not depend on which variants are present (see `la_palma_utils.get_media_variants`).
+    """
+    return min((next(iter(lp.get_media_variants([link]))) for link in links), default='')
+
+
+def add_obs_ids(df):
+    """
+    Return a copy of the DataFrame with a stable 'obs_id' first column (see `get_stable_obs_id`).
+
+    Rows with a unique start time, which is every row after `fix_duplicate_times`, are identified by the start
+    time alone. Rows that share a start time are ranked by `get_link_anchor`, and the first keeps the plain id.
+    A ValueError is raised if two rows share both the start time and the anchor.
+    """
+    date_times = pd.to_datetime(df['date_time']).reset_index(drop=True)
+    tie_breaks = np.zeros(len(df), dtype=np.int64)
+    duplicated = date_times.duplicated(keep=False).values
+    if duplicated.any():
+        rows = pd.DataFrame({'date_time': date_times[duplicated].values,
+                             'anchor': [get_link_anchor(links) for links in df['links'].values[duplicated]]})
+        if rows.duplicated().any():
+            raise ValueError("Observations with the same start time and media items have the same obs_id")
+        rows = rows.sort_values(['date_time', 'anchor'])
+        tie_breaks[np.flatnonzero(duplicated)[rows.index]] = rows.groupby('date_time').cumcount().values
+    obs_ids = np.array([get_stable_obs_id(date_time, tie_break)
+                        for date_time, tie_break in zip(date_times, tie_breaks)], dtype=np.int64)
+    df = df.drop(columns=['obs_id'], errors='ignore')
+    df.insert(0, 'obs_id', obs_ids)
+    return df
+
+
+def get_obs_id_index(df):
+    """
+    Return a dictionary mapping each 'obs_id' of the DataFrame to its row position, for O(1) lookups.
+    """
+    return dict(zip(df['obs_id'].tolist(), range(len(df))))
+
+
+def get_file_signature(file_path):
+    """
+    Return the size and modification time of a file, or None if it does not exist.
+    """
+    if not os.path.isfile(file_path):
+        return None
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def record_export(store_dir, file_path, complete=True):
+    """
+    Record in the index of an upsert store the signature of the CSV file `file_path`, just read into
+    or exported from the store, and with `complete` that all exported files match the store.
+    """
+    with us.index_lock:
+        index = us.load_store_index(store_dir)
+        index.setdefault('exports', {})[file_path] = get_file_signature(file_path)
+        if complete:
+            index['exported_segment'] = index['next_segment']
+        us.save_store_index(store_dir, index)
+
+
+def is_exported(store_dir):
+    """
+    Return True if no rows were written to an upsert store since its last complete export.
+    """
+    index = us.load_store_index(store_dir)
+    return index.get('exported_segment') == index['next_segment']
+
+
+def read_csv_with_obs_ids(file_path):
+    """
+    Read an observation CSV file with its stable 'obs_id' column, which is derived again from the rows
+    so that files exported with an older id scheme get the current ids. The session id columns
+    that `main` adds on export are dropped, since the store does not hold them.
+    """
+    df = fu.read_and_format_csv(file_path)
+    if isinstance(df, str):
+        raise ValueError(df)
+    return add_obs_ids(df.drop(columns=list(SESSION_GAP_THRESHOLDS), errors='ignore'))
+
+
+def keep_annotations(new_df, store_dir):
+    """
+    Return a copy of new_df in which the observations already in the store keep their stored ANNOTATION_COLUMNS.
+    """
+    existing = read_store_table(store_dir).set_index('obs_id')
+    new_df = new_df.copy()
+    known = new_df['obs_id'].isin(existing.index).values
+    for col in ANNOTATION_COLUMNS:
+        if col in new_df.columns and col in existing.columns:
+            values = new_df[col].astype(object).values
+            values[known] = existing[col].reindex(new_df['obs_id'].values[known]).values
+            new_df[col] = values
+    return new_df
+
+
+def refresh_engine(engine, keys, store_dir=LA_PALMA_OBS_STORE_DIR):
+    """
+    Bring a `query_utils.QueryEngine` over the store table up to date with the stored rows of `keys`.
+
+    The rows the engine already holds, matched by 'obs_id', are overwritten in its DataFrame and
+    re-indexed with `refresh_rows`. The other rows are added with `append`, so the engine is not rebuilt.
+    """
+    if not keys:
+        return
+    stored = read_store_table(store_dir)
+    stored = stored[stored['obs_id'].astype(str).isin(keys)]
+    positions = pd.Index(engine.df['obs_id'].astype(str)).get_indexer(stored['obs_id'].astype(str))
+    known = positions >= 0
+    for col in engine.df.columns.intersection(stored.columns):
+        loc = engine.df.columns.get_loc(col)
+        for position, value in zip(positions[known], stored[col].values[known]):
+            engine.df.iat[position, loc] = value
+    if known.any():
+        engine.refresh_rows(positions[known])
+    if not known.all():
+        engine.append(stored[~known].reindex(columns=engine.df.columns))
+
+
+def update_store(new_df, store_dir=LA_PALMA_OBS_STORE_DIR, csv_file=LA_PALMA_OBS_DATA_FILE, journal=None,
+                 engine=None):
+    """
+    Merge the edits of the CSV file, the edits of the annotation journal and the new observations into
+    the upsert store, and return the keys of the rows that were written.
+
+    The store is the source of truth of the pipeline. It is created from the CSV file on first use and
+    is keyed by the stable 'obs_id'. When the CSV file has changed since it was last exported from the
+    store (see `record_export`), e.g. because annotations were saved with
+    `file_utils.preprocess_and_save_dataframe`, its changed rows replace the stored ones. The edits of
+    `journal`, a `journal_utils.AnnotationJournal` written by the widgets, are replayed next. The new
+    observations are then added, and the observations that changed upstream replace the stored ones,
+    keeping their stored annotations (see `keep_annotations`). A `query_utils.QueryEngine` over the
+    store table, passed as `engine`, is updated with the written rows (see `refresh_engine`).
+    """
+    if not os.path.isfile(os.path.join(store_dir, us.STORE_INDEX_FILE)):
+        us.create_store(read_csv_with_obs_ids(csv_file), store_dir, key='obs_id')
+        record_export(store_dir, csv_file, complete=False)
+
+    written = []
+    exports = us.load_store_index(store_dir).get('exports', {})
+    if os.path.isfile(csv_file) and exports.get(csv_file) != get_file_signature(csv_file):
+        written += us.upsert(read_csv_with_obs_ids(csv_file), store_dir, background=False)
+        record_export(store_dir, csv_file, complete=False)
+
+    if journal is not None:
+        written += us.upsert(journal.replay(read_store_table(store_dir)), store_dir, background=False)
+
+    if 'obs_id' not in new_df.columns:
+        new_df = add_obs_ids(new_df)
+    written += us.upsert(keep_annotations(new_df, store_dir), store_dir, background=False)
+    if engine is not None:
+        refresh_engine(engine, written, store_dir)
+    return written
+
+
+def read_store_table(store_dir=LA_PALMA_OBS_STORE_DIR):
+    """
+    Read the observation table of the upsert store, sorted by date and time.
+    """
+    return us.read_store(store_dir).reset_index(drop=True)
+
+
+def add_existing_and_new_dataframes(new_df, store_dir=None):
     """
     Add a potential new DataFrame to the old DataFrame file without losing any data.
+
+    With `store_dir`, the new observations are appended to the upsert store in that directory
+    (see `update_store`) instead of being merged in memory, so only the new rows are written.
     """
+    if store_dir is not None:
+        update_store(new_df, store_dir)
+        return read_store_table(store_dir)
+
     # Load the existing CSV file as a dataframe
     existing_df = pd.read_csv(LA_PALMA_OBS_DATA_FILE)
 
     # Read the date_time column as datetime
     existing_df['date_time'] = pd.to_datetime(existing_df['date_time'])
 
-    # List of columns to convert from strings to lists
-    columns_to_convert = ['links', 'video_links', 'image_links', 'instruments']
-
-    # Convert the strings in each column back to lists
-    for col in columns_to_convert:
-        existing_df[col] = existing_df[col].apply(lambda x: x.split(';') if isinstance(x, str) else [])
+    # Convert the strings in the list columns back to lists
+    fu.decode_list_columns(existing_df)
 
     # List of columns to convert from NaN to None
     columns_to_convert = ['comments', 'polarimetry', 'target']
 
     # Convert the NaNs in each column back to None
     for col in columns_to_convert:
-        existing_df[col] = existing_df[col].apply(lambda x: None if pd.isna(x) else x)
+        existing_df[col] = fu.nan_to_none(existing_df[col])
 
     # Concatenate the existing dataframe and the new dataframe
     df3 = pd.concat([existing_df, new_df])
     df3.drop_duplicates(subset=['date_time'], inplace=True, keep='first')
 
-    return df3
+    return add_obs_ids(df3)
 
 def main():
     """
-    Main function to load or fetch links, preprocess links, generate DataFrame, and fix duplicate times.
+    Main function to load or fetch links, preprocess links, generate DataFrame, fix duplicate times,
+    merge the new observations into the upsert store and, if anything changed, export the table,
+    its partitions, snapshot versions and SQLite catalog.
     """
-    all_media_links = load_or_fetch_links(reload=True)
-    date_time_from_all_media_links, all_media_links_with_date_time = preprocess_links(all_media_links)
-    df = generate_dataframe(date_time_from_all_media_links, all_media_links_with_date_time)
-    grouped_df = fix_duplicate_times(df)
-    grouped_df = add_existing_and_new_dataframes(grouped_df)
-
-    # List of columns to convert from lists to strings
-    columns_to_convert = ['links', 'video_links', 'image_links', 'instruments']
-    for col in columns_to_convert:
-        grouped_df[col] = grouped_df[col].apply(lambda x: ';'.join(x))
-
-    # Save DataFrame to CSV file
+    # Refresh the link inventory, then stream it back in chunks
+    load_or_fetch_links(reload=True)
+    parse_cache = load_parse_cache()
+    df = generate_dataframe_chunked(iter_media_links(), parse_cache)
+    save_parse_cache(parse_cache)
+    grouped_df = add_obs_ids(fix_duplicate_times(df))
+
+    # The store is the source of truth, the other files are exported from it only when it changed
+    journal = ju.AnnotationJournal()
+    written = update_store(grouped_df, LA_PALMA_OBS_STORE_DIR, journal=journal)
+    exported_files = [LA_PALMA_OBS_DATA_FILE, LA_PALMA_OBS_PARTITION_DIR, LA_PALMA_OBS_VERSIONS_DIR,
+                      LA_PALMA_OBS_CATALOG_FILE]
+    if is_exported(LA_PALMA_OBS_STORE_DIR) and all(os.path.exists(path) for path in exported_files):
+        print('No new or changed observations in {}'.format(LA_PALMA_OBS_STORE_DIR))
+        return
+    print('{} new or changed observations in {}'.format(len(written), LA_PALMA_OBS_STORE_DIR))
+    grouped_df = fu.add_target_tokens(add_session_ids(read_store_table(LA_PALMA_OBS_STORE_DIR)))
+
+    # Save DataFrame to Parquet file, keeping the list columns as lists
+    try:
+        fu.save_parquet(grouped_df, LA_PALMA_OBS_PARQUET_FILE)
+        print('Dataframe saved to {}'.format(LA_PALMA_OBS_PARQUET_FILE))
+    except ImportError as error:
+        print(error)
+
+    # Save the year-partitioned dataset, rewriting only the years that changed
+    changed_years = stu.write_partitioned(grouped_df, LA_PALMA_OBS_PARTITION_DIR)
+    print('Partitions written to {}: {}'.format(LA_PALMA_OBS_PARTITION_DIR, changed_years))
+
+    # Keep a version of the table in the snapshot store, sharing the unchanged years with the previous one
+    snapshot = su.SnapshotStore(LA_PALMA_OBS_VERSIONS_DIR, keep_last=SNAPSHOT_KEEP_LAST).commit(grouped_df)
+    print('Snapshot version {} in {}'.format(snapshot['version'], LA_PALMA_OBS_VERSIONS_DIR))
+
+    # Build the SQLite catalog read by the selector widgets and ADS_Search
+    cu.build_catalog(grouped_df, LA_PALMA_OBS_CATALOG_FILE).close()
+    print('Catalog saved to {}'.format(LA_PALMA_OBS_CATALOG_FILE))
+
+    # Convert the list columns to strings
+    fu.encode_list_columns(grouped_df)
+
+    # Export DataFrame to CSV file
     grouped_df.to_csv(LA_PALMA_OBS_DATA_FILE, index=False)
+    record_export(LA_PALMA_OBS_STORE_DIR, LA_PALMA_OBS_DATA_FILE)
     print('Dataframe saved to {}'.format(LA_PALMA_OBS_DATA_FILE))
 
+    # The journaled annotations are in the store now, keep only the latest edit of each cell
+    print('{} annotations kept in {}'.format(journal.compact(), journal.file_path + ju.JOURNAL_BASE_SUFFIX))
+
 
 if __name__ == "__main__":
     main()
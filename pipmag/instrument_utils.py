@@ -0,0 +1,31 @@
+# Instrument keywords of the media links, and the instrument bitmasks shared by the pipeline,
+# the storage layouts, the catalog and the query engine. This module imports no other pipmag module.
+INSTRUMENT_KEYWORDS = {
+    'CRISP': ['wb_6563', 'ha', 'Crisp', '6173', '8542', '6563', 'crisp'],
+    'CHROMIS': ['Chromis', 'cak', '4846'],
+    'IRIS': ['sji']
+}
+# One bit per instrument, in the order of INSTRUMENT_KEYWORDS
+INSTRUMENT_BITS = {instrument: 1 << i for i, instrument in enumerate(INSTRUMENT_KEYWORDS)}
+
+
+def get_link_instruments(link):
+    """
+    Return the instruments whose keywords appear in a link, in INSTRUMENT_KEYWORDS order.
+    """
+    return tuple(instrument for instrument, keywords in INSTRUMENT_KEYWORDS.items()
+                 if any(keyword in link for keyword in keywords))
+
+
+def get_instrument_mask(instruments):
+    """
+    Return the bitmask of a collection of instrument names, with one bit per INSTRUMENT_KEYWORDS entry.
+    """
+    return sum(INSTRUMENT_BITS[instrument] for instrument in set(instruments) if instrument in INSTRUMENT_BITS)
+
+
+def get_instruments_from_mask(mask):
+    """
+    Return the instrument names encoded in a bitmask, in INSTRUMENT_KEYWORDS order.
+    """
+    return [instrument for instrument, bit in INSTRUMENT_BITS.items() if mask & bit]
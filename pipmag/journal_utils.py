@@ -0,0 +1,176 @@
+import getpass
+import json
+import os
+from datetime import datetime
+import pandas as pd
+
+# Default journal of the annotations made with DataUpdater and the VideoSelector widgets
+ANNOTATION_JOURNAL_FILE = 'data/la_palma_annotations.jsonl'
+
+# Suffixes of the compacted journal and of the live journal while it is being compacted
+JOURNAL_BASE_SUFFIX = '.base'
+JOURNAL_COMPACTING_SUFFIX = '.compacting'
+
+
+def get_annotation_key(df, index):
+    """
+    Return the key of a row for the journal: {'obs_id': ...} if df has stable ids, {'date_time': ...} otherwise.
+    """
+    if 'obs_id' in df.columns:
+        return {'obs_id': int(df.at[index, 'obs_id'])}
+    return {'date_time': pd.Timestamp(df.at[index, 'date_time']).isoformat(sep=' ')}
+
+
+def read_journal_file(file_path):
+    """
+    Return the edits of one journal file, skipping a truncated last line left by an interrupted write.
+    """
+    edits = []
+    if not os.path.isfile(file_path):
+        return edits
+    with open(file_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                edits.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return edits
+
+
+class AnnotationJournal:
+    """
+    Append-only journal of edits to the annotation columns of the observation DataFrame.
+
+    Parameters
+    ----------
+    file_path : str, optional
+        The path of the journal file (default: ANNOTATION_JOURNAL_FILE).
+
+    Attributes
+    ----------
+    file_path : str
+        The path of the live journal. The compacted journal is kept in `file_path + JOURNAL_BASE_SUFFIX`.
+
+    Methods
+    -------
+    record(df, index, column, value)
+        Append one edit of a cell of df to the journal.
+    read_edits()
+        Return all edits, oldest first.
+    replay(df, inplace=False)
+        Return df with the edits applied, as a copy unless inplace is True.
+    compact()
+        Merge the journal into the compacted journal, keeping only the latest edit per cell.
+
+    Dependencies
+    ------------
+    - json: Required to store one edit per line.
+    - pandas: Required to apply the edits to the DataFrame.
+
+    Notes
+    -----
+    Class Name: AnnotationJournal
+    Each edit is one JSON line with a timestamp, the user, the row key, the column and the new value.
+    Rows are keyed by 'obs_id' when the DataFrame has stable ids, and by 'date_time' otherwise,
+    so edits still apply after the archive is rebuilt. Saving an edit appends a single line with one
+    O_APPEND write, so it does not depend on the size of the catalog and edits of concurrent
+    annotators are interleaved instead of overwriting each other. When edits of the same cell
+    are replayed, the latest timestamp wins.
+
+    Examples
+    --------
+    >>> journal = AnnotationJournal()
+    >>> journal.record(df, 12, 'target', 'Sunspot')
+    >>> df = journal.replay(fu.read_and_format_csv('data/la_palma_obs_data.csv'))
+    """
+
+    def __init__(self, file_path=ANNOTATION_JOURNAL_FILE):
+        self.file_path = file_path
+
+    def record(self, df, index, column, value):
+        edit = {'timestamp': datetime.now().isoformat(), 'user': get_user_name(), **get_annotation_key(df, index),
+                'column': column, 'value': value}
+        line = (json.dumps(edit) + '\n').encode('utf-8')
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        return edit
+
+    def read_edits(self):
+        edits = []
+        for suffix in [JOURNAL_BASE_SUFFIX, JOURNAL_COMPACTING_SUFFIX, '']:
+            edits.extend(read_journal_file(self.file_path + suffix))
+        # Stable sort, so edits with the same timestamp keep the file order
+        return sorted(edits, key=lambda edit: edit['timestamp'])
+
+    def replay(self, df, inplace=False):
+        """
+        Return df with the latest edit of every cell applied, as a copy unless inplace is True.
+        Edits of unknown rows are ignored.
+        """
+        if not inplace:
+            df = df.copy()
+        latest = get_latest_edits(self.read_edits())
+        if not latest:
+            return df
+        rows = {}
+        if 'obs_id' in df.columns:
+            rows['obs_id'] = dict(zip(df['obs_id'].astype('int64').tolist(), df.index))
+        rows['date_time'] = dict(zip(pd.to_datetime(df['date_time']).map(lambda x: x.isoformat(sep=' ')), df.index))
+        for edit in latest:
+            key = 'obs_id' if 'obs_id' in edit else 'date_time'
+            index = rows.get(key, {}).get(edit[key])
+            if index is None or edit['column'] not in df.columns:
+                continue
+            df.at[index, edit['column']] = edit['value']
+        return df
+
+    def compact(self):
+        """
+        Merge the live journal into the compacted journal and return the number of edits kept.
+
+        The live journal is first renamed aside, so edits recorded during the compaction go to a new
+        live journal. The renamed journal is only removed after the new compacted journal is in place,
+        and is replayed as well if a compaction was interrupted.
+        """
+        compacting_path = self.file_path + JOURNAL_COMPACTING_SUFFIX
+        if os.path.exists(self.file_path) and not os.path.exists(compacting_path):
+            os.replace(self.file_path, compacting_path)
+
+        base_path = self.file_path + JOURNAL_BASE_SUFFIX
+        edits = read_journal_file(base_path) + read_journal_file(compacting_path)
+        latest = get_latest_edits(sorted(edits, key=lambda edit: edit['timestamp']))
+        temp_path = f'{base_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for edit in latest:
+                f.write(json.dumps(edit) + '\n')
+        os.replace(temp_path, base_path)
+        if os.path.exists(compacting_path):
+            os.remove(compacting_path)
+        return len(latest)
+
+
+def get_latest_edits(edits):
+    """
+    Return the last edit of every (row, column) cell from a list of edits sorted oldest first.
+    """
+    latest = {}
+    for edit in edits:
+        key = ('obs_id', edit['obs_id']) if 'obs_id' in edit else ('date_time', edit['date_time'])
+        latest[key + (edit['column'],)] = edit
+    return sorted(latest.values(), key=lambda edit: edit['timestamp'])
+
+
+def get_user_name():
+    """
+    Return the login name of the annotator, or an empty string if it cannot be determined.
+    """
+    try:
+        return getpass.getuser()
+    except Exception:
+        return ''
@@ -1,9 +1,35 @@
 import requests
 from bs4 import BeautifulSoup
+import os
 import re
 from datetime import datetime
 import pandas as pd
 
+# Regular expressions tried in order to capture the date and time from a media link
+DATE_PATTERN_LIST = [r'(\d{4}-\d{2}-\d{2})_(\d{2}:\d{2}:\d{2})',
+                     r'(\d{4}-\d{2}-\d{2})_(\d{6})(?!\d)',
+                     r'(\d{4}-\d{2}-\d{2})T(\d{2}:\d{2}:\d{2})',
+                     r'(\d{2}[a-zA-Z]{3}\d{2})_(\d{6})(?!\d)',
+                     r'(\d{2}[a-zA-Z]{3}\d{4})_(\d{6})(?!\d)',
+                     r'(\d{4}\.\d{2}\.\d{2})_(\d{6})(?!\d)',
+                     r'(\d{8})_(\d{6})(?!\d)']
+
+# Formats accepted when converting the captured date and time strings to datetime objects
+DATE_FORMAT_LIST = [
+    '%Y-%m-%d_%H:%M:%S',
+    '%d%b%Y_%H:%M:%S',
+    '%Y.%m.%d_%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y%m%d_%H%M%S',
+    '%Y%m%d_%H:%M:%S'
+]
+
+# Filename suffixes of the same movie rendered with a different intensity scaling
+MEDIA_SCALING_SUFFIXES = ['histoopt', 'minmax']
+
+# Preferred file formats, best first, when choosing the canonical variant of a media item
+MEDIA_FORMAT_PREFERENCE = ['mp4', 'mov', 'jpg', 'png']
+
 
 def get_obs_years(la_palma_url='http://tsih3.uio.no/lapalma/', verbose=False):
     """
@@ -480,15 +506,7 @@ def get_date_time_from_link(link,
         return None
 
 
-def get_date_time_from_link_list(links_list,
-                                 date_pattern_list=[r'(\d{4}-\d{2}-\d{2})_(\d{2}:\d{2}:\d{2})',
-                                                    r'(\d{4}-\d{2}-\d{2})_(\d{6})(?!\d)',
-                                                    r'(\d{4}-\d{2}-\d{2})T(\d{2}:\d{2}:\d{2})',
-                                                    r'(\d{2}[a-zA-Z]{3}\d{2})_(\d{6})(?!\d)',
-                                                    r'(\d{2}[a-zA-Z]{3}\d{4})_(\d{6})(?!\d)',
-                                                    r'(\d{4}\.\d{2}\.\d{2})_(\d{6})(?!\d)',
-                                                    r'(\d{8})_(\d{6})(?!\d)']
-                                 ):
+def get_date_time_from_link_list(links_list, date_pattern_list=DATE_PATTERN_LIST):
     """
     Extracts date and time information from a list of image links using multiple date patterns.
 
@@ -609,14 +627,7 @@ def check_date_format(date_string, date_format_list):
 
 def get_invalid_dates(
     date_time_list,
-    date_format_list=[
-        '%Y-%m-%d_%H:%M:%S',
-        '%d%b%Y_%H:%M:%S',
-        '%Y.%m.%d_%H:%M:%S',
-        '%Y-%m-%d %H:%M:%S.%f',
-        '%Y%m%d_%H%M%S',
-        '%Y%m%d_%H:%M:%S'
-    ]
+    date_format_list=DATE_FORMAT_LIST
 ):
     """
     Retrieves the invalid dates from a list of date-time strings by comparing them against a list of date formats.
@@ -682,14 +693,7 @@ def get_invalid_dates(
 
 def convert_to_datetime(
     date_time_list,
-    date_format_list=[
-        '%Y-%m-%d_%H:%M:%S',
-        '%d%b%Y_%H:%M:%S',
-        '%Y.%m.%d_%H:%M:%S',
-        '%Y-%m-%d %H:%M:%S.%f',
-        '%Y%m%d_%H%M%S',
-        '%Y%m%d_%H:%M:%S'
-    ]
+    date_format_list=DATE_FORMAT_LIST
 ):
     """
     Converts a list of datetime strings to datetime objects using specified date formats.
@@ -906,6 +910,116 @@ def get_links_with_string(link_list, string_list):
     return result
 
 
+def get_media_variants(link_list, scaling_suffixes=MEDIA_SCALING_SUFFIXES,
+                       format_preference=MEDIA_FORMAT_PREFERENCE):
+    """
+    Groups near-duplicate media links into media items and labels each link with its variant.
+
+    Parameters
+    ----------
+    link_list : list
+        A list of media links, typically the video or image links of one observation.
+    scaling_suffixes : list, optional
+        Filename suffixes that mark the same movie with a different intensity scaling
+        (default: MEDIA_SCALING_SUFFIXES, i.e. 'histoopt' and 'minmax').
+    format_preference : list, optional
+        File extensions in order of preference (default: MEDIA_FORMAT_PREFERENCE).
+
+    Returns
+    -------
+    dict
+        A dictionary mapping each media item id to a list of (variant, link) tuples.
+        The items keep the order of their first link in link_list, and the variants of an item
+        are sorted best first, so the first link of each item is its canonical link.
+
+    Dependencies
+    ------------
+    os module
+    re module
+
+    Notes
+    -----
+    Function Name: get_media_variants
+    Three kinds of variants are grouped under one media item:
+    - the same movie with a different scaling suffix, e.g. '_histoopt.mp4' and '_minmax.mp4',
+    - the same file name with a different format, e.g. '.mp4' and '.mov',
+    - continuations with a trailing '_HHMMSS' stamp, e.g. '..._3860256865_081340.mp4',
+      as long as the link without the stamp is also in link_list.
+    The media item id is the link without the extension, the scaling suffix and the continuation stamp.
+    The variant is the part that was removed, e.g. 'histoopt.mp4', '081340.mp4' or 'mov'.
+    Variants without a continuation stamp come first, then the variants are ordered by format_preference.
+
+    Examples
+    --------
+    >>> links = ['http://example.com/wb_6563_histoopt.mp4', 'http://example.com/wb_6563_minmax.mp4',
+                 'http://example.com/movie.mov', 'http://example.com/movie.mp4']
+    >>> get_media_variants(links)
+    {'http://example.com/wb_6563': [('histoopt.mp4', 'http://example.com/wb_6563_histoopt.mp4'),
+                                    ('minmax.mp4', 'http://example.com/wb_6563_minmax.mp4')],
+     'http://example.com/movie': [('mp4', 'http://example.com/movie.mp4'), ('mov', 'http://example.com/movie.mov')]}
+    """
+    # split every link into its stem, scaling suffix and extension
+    parts = []
+    for link in link_list:
+        stem, extension = os.path.splitext(link)
+        extension = extension.lstrip('.').lower()
+        scaling = next((suffix for suffix in scaling_suffixes if stem.endswith('_' + suffix)), '')
+        if scaling:
+            stem = stem[:-len(scaling) - 1]
+        parts.append((link, stem, scaling, extension))
+
+    # a trailing '_HHMMSS' stamp marks a continuation only if the stem without it exists too
+    stems = {stem for _, stem, _, _ in parts}
+    media_variants = {}
+    for position, (link, stem, scaling, extension) in enumerate(parts):
+        continuation = ''
+        match = re.search(r'_(\d{6})$', stem)
+        if match and stem[:match.start()] in stems:
+            continuation = match.group(1)
+            stem = stem[:match.start()]
+        variant = '_'.join(label for label in (scaling, continuation) if label)
+        variant = f'{variant}.{extension}' if variant else extension
+        rank = (bool(continuation),
+                format_preference.index(extension) if extension in format_preference else len(format_preference),
+                position)
+        media_variants.setdefault(stem, []).append((rank, variant, link))
+
+    return {media_id: [(variant, link) for _, variant, link in sorted(variants)]
+            for media_id, variants in media_variants.items()}
+
+
+def get_canonical_links(link_list):
+    """
+    Retrieves one canonical link per media item from a list of links.
+
+    Parameters
+    ----------
+    link_list : list
+        A list of media links.
+
+    Returns
+    -------
+    list
+        The canonical (best ranked) link of every media item, in the order of the media items.
+
+    Dependencies
+    ------------
+    get_media_variants function
+
+    Notes
+    -----
+    Function Name: get_canonical_links
+    This function groups the links with `get_media_variants` and keeps the first variant of each media item.
+    The other variants remain available through `get_media_variants`.
+
+    Examples
+    --------
+    >>> get_canonical_links(['http://example.com/movie.mov', 'http://example.com/movie.mp4'])
+    ['http://example.com/movie.mp4']
+    """
+    return [variants[0][1] for variants in get_media_variants(link_list).values()]
+
+
 def print_obs_dates(year, obs_dates):
     """
     Prints the observing dates for a given year from a list of observing dates.
@@ -0,0 +1,663 @@
+import datetime
+from collections import OrderedDict, namedtuple
+from collections.abc import Sequence
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pipmag import file_utils as fu
+from pipmag import instrument_utils as iu
+
+# Number of query results kept by the LRU cache of a QueryEngine
+QUERY_CACHE_SIZE = 64
+
+# Facets counted by QueryEngine.get_facets
+FACETS = ('instruments', 'targets', 'years', 'months', 'polarimetry')
+
+# Normalized filters of a query, used as the key of the result cache: None means no filter
+QuerySpec = namedtuple('QuerySpec', ['instruments', 'all_instruments', 'start_date', 'end_date',
+                                     'start_seconds', 'end_seconds', 'targets', 'polarimetry'])
+
+
+def get_instrument_masks(df):
+    """
+    Return the instrument bitmask of every row (see `instrument_utils.INSTRUMENT_BITS`).
+
+    The 'instrument_mask' column of the compact layout is used if present. Otherwise the 'instruments'
+    column may hold lists (as from `file_utils.read_and_format_csv`) or ';'-joined strings (as from
+    `file_utils.read_and_format_csv_for_query`); each distinct value is converted once.
+    """
+    if 'instrument_mask' in df.columns:
+        return df['instrument_mask'].values.astype(np.int64)
+    keys = [';'.join(x) if isinstance(x, Sequence) and not isinstance(x, str) else x for x in df['instruments']]
+    codes, uniques = pd.factorize(pd.Series(keys, dtype=object))
+    masks = np.array([iu.get_instrument_mask(item.strip() for item in x.split(';')) for x in uniques] + [0],
+                     dtype=np.int64)
+    # Missing values have code -1, which picks the trailing 0
+    return masks[codes]
+
+
+def get_seconds(value):
+    """
+    Return the seconds since midnight of a time given as 'HH:MM', 'HH:MM:SS', a datetime.time or a number of seconds.
+    """
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str) and value.count(':') in (1, 2) and value.replace(':', '').isdigit():
+        parts = [int(part) for part in value.split(':')] + [0]
+        return parts[0] * 3600 + parts[1] * 60 + parts[2]
+    time = value if isinstance(value, datetime.time) else pd.to_datetime(str(value)).time()
+    return time.hour * 3600 + time.minute * 60 + time.second
+
+
+@lru_cache(maxsize=1024)
+def get_target_tokens(target):
+    """
+    Return the canonical tokens of a target string as a tuple, caching the tokens of recent targets.
+    """
+    return tuple(fu.get_target_token_lists([target])[0])
+
+
+def get_query_tokens(targets):
+    """
+    Return the canonical target tokens of the targets of a query, ignoring '' and 'None' (no target selected).
+    """
+    if isinstance(targets, str):
+        targets = [targets]
+    targets = [target for target in targets if target and target != 'None']
+    return sorted({token for target in targets for token in get_target_tokens(target)})
+
+
+def normalize_filters(instruments=None, all_instruments=True, date_range=None, time_range=None, targets=None,
+                      polarimetry=None):
+    """
+    Return the QuerySpec of the filters of a query (see `QueryEngine.get_mask` for the arguments).
+
+    Filters that select everything become None, instruments and targets become frozensets of names
+    and canonical tokens, dates become datetime64[D] and times seconds of the day, so that equivalent
+    filters have equal specs.
+    """
+    start_date = end_date = start_seconds = end_seconds = None
+    if date_range is not None:
+        start_date, end_date = [None if date is None else np.datetime64(pd.Timestamp(date).date(), 'D')
+                                for date in date_range]
+    if time_range is not None:
+        start_seconds, end_seconds = [None if time in (None, '') else get_seconds(time) for time in time_range]
+    if polarimetry is not None and not (isinstance(polarimetry, str) and polarimetry == 'All'):
+        polarimetry = str(polarimetry) == 'True'
+    else:
+        polarimetry = None
+    return QuerySpec(frozenset(instruments) if instruments else None, bool(all_instruments) if instruments else None,
+                     start_date, end_date, start_seconds, end_seconds,
+                     frozenset(get_query_tokens(targets)) or None if targets is not None else None, polarimetry)
+
+
+def is_within(start, end, outer_start, outer_end):
+    """
+    Return True if the inclusive range [start, end] lies within [outer_start, outer_end], where None is unbounded.
+    """
+    return (outer_start is None or (start is not None and start >= outer_start)) and \
+        (outer_end is None or (end is not None and end <= outer_end))
+
+
+def narrows(spec, cached_spec):
+    """
+    Return True if every row matching `spec` also matches `cached_spec`, so that `spec` can be
+    evaluated on the rows of `cached_spec` instead of on the whole table.
+    """
+    if cached_spec.instruments is not None:
+        if spec.instruments is None:
+            return False
+        if cached_spec.all_instruments:
+            if not (spec.all_instruments and cached_spec.instruments <= spec.instruments):
+                return False
+        elif spec.all_instruments:
+            if not spec.instruments & cached_spec.instruments:
+                return False
+        elif not spec.instruments <= cached_spec.instruments:
+            return False
+    if not is_within(spec.start_date, spec.end_date, cached_spec.start_date, cached_spec.end_date):
+        return False
+    times, cached_times = (spec.start_seconds, spec.end_seconds), (cached_spec.start_seconds, cached_spec.end_seconds)
+    if times != cached_times:
+        # Windows that wrap midnight only narrow themselves
+        wraps = None not in times and times[0] > times[1]
+        cached_wraps = None not in cached_times and cached_times[0] > cached_times[1]
+        if wraps or cached_wraps or not is_within(*times, *cached_times):
+            return False
+    if cached_spec.targets is not None and not (spec.targets is not None and spec.targets <= cached_spec.targets):
+        return False
+    return cached_spec.polarimetry is None or spec.polarimetry == cached_spec.polarimetry
+
+
+def get_token_lists(df):
+    """
+    Return the canonical target tokens of every row, derived from the 'target' column
+    (the 'target_tokens' column is missing from some layouts). The strings 'None' count as missing.
+    """
+    targets = df['target'].astype(object)
+    return fu.get_target_token_lists(targets.where(targets.astype(str) != 'None', None).values)
+
+
+def get_derived_columns(df):
+    """
+    Return the arrays a QueryEngine filters on, derived from the rows of an observation DataFrame.
+    """
+    date_times = pd.to_datetime(df['date_time']).values.astype('datetime64[ns]')
+    dates = date_times.astype('datetime64[D]')
+    return {
+        'date_times': date_times,
+        'dates': dates,
+        'seconds_of_day': ((date_times - dates) // np.timedelta64(1, 's')).astype(np.int32),
+        'instrument_masks': get_instrument_masks(df),
+        'polarimetry': df['polarimetry'].astype(str).eq('True').values,
+        'token_lists': get_token_lists(df),
+    }
+
+
+class InvertedIndex:
+    """
+    Inverted index mapping keys (e.g. instruments or target tokens) to the sorted row ids holding them.
+
+    Parameters
+    ----------
+    key_lists : iterable, optional
+        The keys of every row, with row ids numbered from `start`.
+    start : int, optional
+        The id of the first row of `key_lists` (default: 0).
+
+    Attributes
+    ----------
+    postings : dict
+        A dictionary mapping every key to a sorted int64 array of row ids.
+
+    Methods
+    -------
+    add(key_lists, start=0)
+        Add rows with consecutive ids from `start`.
+    remove(rows, key_lists)
+        Remove rows, given the keys they were added with.
+    get(key)
+        Return the row ids of a key.
+    union(keys), intersection(keys)
+        Return the row ids holding any or all of the keys.
+    count(selected)
+        Return the number of selected rows holding each key.
+    contains(rows, positions)
+        Return a boolean mask of the positions that are in a sorted array of row ids.
+
+    Notes
+    -----
+    Class Name: InvertedIndex
+    The postings are built in one pass: the keys of all rows are flattened, coded and sorted, and the
+    row ids are cut at the key boundaries. Rows added later only touch the postings of their own keys,
+    and appending rows with larger ids keeps the postings sorted without merging.
+
+    Examples
+    --------
+    >>> index = InvertedIndex([['CRISP'], ['CRISP', 'CHROMIS'], ['CHROMIS']])
+    >>> index.intersection(['CRISP', 'CHROMIS'])
+    array([1])
+    """
+
+    def __init__(self, key_lists=(), start=0):
+        self.postings = {}
+        self.flat = None
+        self.add(key_lists, start)
+
+    def add(self, key_lists, start=0):
+        self.flat = None
+        key_lists = list(key_lists)
+        lengths = np.fromiter((len(keys) for keys in key_lists), dtype=np.int64, count=len(key_lists))
+        codes, keys = pd.factorize(pd.Series([key for keys in key_lists for key in keys], dtype=object))
+        if not len(keys):
+            return
+        rows = np.repeat(np.arange(start, start + len(key_lists), dtype=np.int64), lengths)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+        for code, key in enumerate(keys):
+            new_rows = np.unique(rows[order[bounds[code]:bounds[code + 1]]])
+            old_rows = self.postings.get(key)
+            if old_rows is None or not len(old_rows):
+                self.postings[key] = new_rows
+            elif new_rows[0] > old_rows[-1]:
+                self.postings[key] = np.concatenate((old_rows, new_rows))
+            else:
+                self.postings[key] = np.union1d(old_rows, new_rows)
+
+    def remove(self, rows, key_lists):
+        self.flat = None
+        rows = np.asarray(rows, dtype=np.int64)
+        for key in {key for keys in key_lists for key in keys}:
+            if key in self.postings:
+                remaining = self.postings[key][~np.isin(self.postings[key], rows)]
+                if len(remaining):
+                    self.postings[key] = remaining
+                else:
+                    del self.postings[key]
+
+    def keys(self):
+        return sorted(self.postings)
+
+    def get(self, key):
+        return self.postings.get(key, np.zeros(0, dtype=np.int64))
+
+    def union(self, keys):
+        postings = [self.get(key) for key in keys]
+        return np.unique(np.concatenate(postings)) if postings else np.zeros(0, dtype=np.int64)
+
+    def intersection(self, keys):
+        postings = sorted((self.get(key) for key in keys), key=len)
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        rows = postings[0]
+        for other in postings[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
+
+    def count(self, selected):
+        """
+        Return a dictionary mapping the keys, sorted, to the number of rows flagged in the boolean array
+        `selected` (indexed by row id) that hold them. Keys held by no selected row are left out.
+        """
+        # The postings flattened into parallel arrays of row ids and key codes, so that one
+        # bincount over the selected entries counts all keys at once
+        if self.flat is None:
+            keys = self.keys()
+            lengths = [len(self.postings[key]) for key in keys]
+            rows = np.concatenate([self.postings[key] for key in keys]) if keys else np.zeros(0, dtype=np.int64)
+            self.flat = (keys, rows, np.repeat(np.arange(len(keys)), lengths))
+        keys, rows, codes = self.flat
+        counts = np.bincount(codes[selected[rows]], minlength=len(keys))
+        return {key: int(count) for key, count in zip(keys, counts) if count}
+
+    @staticmethod
+    def contains(rows, positions):
+        index = np.searchsorted(rows, positions)
+        return (index < len(rows)) & (rows[np.minimum(index, len(rows) - 1)] == positions) if len(rows) \
+            else np.zeros(len(positions), dtype=bool)
+
+
+class QueryEngine:
+    """
+    Widget-free query engine over an observation DataFrame.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, in the layout of `file_utils.read_and_format_csv` (optionally compact)
+        or of `file_utils.read_and_format_csv_for_query`.
+    cache_size : int, optional
+        The number of query results kept in the LRU cache (default: QUERY_CACHE_SIZE). 0 disables the cache.
+
+    Attributes
+    ----------
+    df : pd.DataFrame
+        The DataFrame, which is not modified. Results refer to its rows by position.
+    date_times : np.ndarray
+        The start times as datetime64[ns].
+    dates : np.ndarray
+        The start dates as datetime64[D].
+    seconds_of_day : np.ndarray
+        The seconds since midnight of the start times as int32.
+    instrument_masks : np.ndarray
+        The instrument bitmask of every row.
+    polarimetry : np.ndarray
+        True for polarimetric observations.
+    token_lists : np.ndarray
+        The canonical target tokens of every row (see `file_utils.get_target_token_lists`).
+    instrument_index, target_index : InvertedIndex
+        The rows of every instrument and of every canonical target token.
+    time_order : np.ndarray
+        The row positions in the order of their start times.
+    sorted_date_times : np.ndarray
+        The start times in sorted order, i.e. `date_times[time_order]`.
+    cache : OrderedDict
+        The row positions of recent queries by QuerySpec, least recently used first.
+    cache_size : int
+        The number of results kept in the cache.
+
+    Methods
+    -------
+    query(instruments=None, all_instruments=True, date_range=None, time_range=None, targets=None, polarimetry=None)
+        Return a QueryResult with the rows matching all the given filters.
+    get_mask(positions=None, **filters)
+        Return the boolean mask of the filters over the given row positions (by default all rows).
+    get_targets(positions=None)
+        Return the sorted target tokens of the given rows.
+    get_facets(positions=None)
+        Return the number of the given rows per instrument, target token, year, month and observing mode.
+    get_date_positions(start=None, end=None)
+        Return the sorted positions of the rows between two dates, found by binary search.
+    append(df)
+        Add new rows at the end, updating the indexes for those rows only.
+    refresh_rows(positions)
+        Update the derived columns and the indexes of rows of `df` that were edited in place.
+    clear_cache()
+        Drop the cached query results.
+
+    Dependencies
+    ------------
+    - file_utils: Required for the canonical target tokens.
+    - instrument_utils: Required for the instrument bits.
+
+    Notes
+    -----
+    Class Name: QueryEngine
+    Every column a filter needs is derived once, when the engine is created, as a NumPy array:
+    bitmasks for the instruments, day numbers and seconds of the day for the start times and booleans
+    for the observing mode. A sorted index of the start times resolves the date range of a query by binary
+    search to the slice of rows in that range, and the other filters only look at those rows, so a date range
+    query takes O(log n + k) for k matching rows. Time windows compare the precomputed seconds of the day and
+    may wrap midnight, e.g. ('22:00', '02:00'). Instruments and canonical target tokens
+    (see `file_utils.get_target_token_lists`) also have inverted indexes, so instrument and target filters
+    are intersections and unions of sorted row id arrays. A query converts its arguments once to the same
+    representation and each filter is a single vectorized operation, so no per-row Python code runs at query time.
+    Targets match whole canonical tokens, so 'AR' finds rows whose target contains 'Active Region',
+    but 'Flare' does not find 'Flare Ribbon'.
+    The filters of a query are normalized to a QuerySpec (see `normalize_filters`), which keys an LRU cache
+    of results. A query that is not cached but narrows a cached one (see `narrows`), e.g. the same query with
+    one more target or a shorter date range, is evaluated on the smallest such cached result instead of on
+    the whole table. `append` and `refresh_rows` clear the cache.
+    Facet counts (see `get_facets`) reuse the same arrays and indexes: the target tokens of a result set
+    are counted with one bincount over the flattened postings and the instruments from the distinct
+    bitmasks, so refreshing the options of facet dropdowns does not split any target strings.
+
+    Examples
+    --------
+    >>> engine = QueryEngine(fu.read_and_format_csv('data/la_palma_obs_data.csv'))
+    >>> result = engine.query(instruments=['CRISP', 'CHROMIS'], date_range=('2020-01-01', None), targets=['Flare'])
+    >>> result.to_frame()[['date_time', 'target']]
+    """
+
+    def __init__(self, df, cache_size=QUERY_CACHE_SIZE):
+        self.df = df
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        for name, values in get_derived_columns(df).items():
+            setattr(self, name, values)
+        self.instrument_index = InvertedIndex(iu.get_instruments_from_mask(mask) for mask in self.instrument_masks)
+        self.target_index = InvertedIndex(self.token_lists)
+        self.update_time_index()
+
+    def __len__(self):
+        return len(self.df)
+
+    def get_mask(self, positions=None, **filters):
+        """
+        Return the boolean mask of the rows at `positions` (by default all rows) matching all the filters.
+
+        `instruments` are instrument names, all of which (or any of which, if `all_instruments` is False)
+        must have been used. `date_range` and `time_range` are inclusive (start, end) pairs, in which
+        either end may be None; dates may be strings, dates or Timestamps and times are as in `get_seconds`.
+        A time window whose start is after its end wraps midnight.
+        `targets` matches rows with any of the canonical tokens of the given targets. `polarimetry` is
+        True or False, and None or 'All' disables the filter.
+        """
+        return self.get_spec_mask(np.arange(len(self.df)) if positions is None else positions,
+                                  normalize_filters(**filters))
+
+    def get_spec_mask(self, positions, spec, dates=True):
+        """
+        Return the boolean mask of the rows at `positions` matching a QuerySpec, optionally skipping the dates.
+        """
+        mask = np.ones(len(positions), dtype=bool)
+
+        if spec.instruments is not None:
+            index = self.instrument_index
+            rows = index.intersection(spec.instruments) if spec.all_instruments else index.union(spec.instruments)
+            mask &= InvertedIndex.contains(rows, positions)
+
+        if dates and spec.start_date is not None:
+            mask &= self.dates[positions] >= spec.start_date
+        if dates and spec.end_date is not None:
+            mask &= self.dates[positions] <= spec.end_date
+
+        start, end = spec.start_seconds, spec.end_seconds
+        if start is not None and end is not None and start > end:
+            seconds = self.seconds_of_day[positions]
+            mask &= (seconds >= start) | (seconds <= end)
+        else:
+            if start is not None:
+                mask &= self.seconds_of_day[positions] >= start
+            if end is not None:
+                mask &= self.seconds_of_day[positions] <= end
+
+        if spec.polarimetry is not None:
+            mask &= self.polarimetry[positions] == spec.polarimetry
+
+        if spec.targets is not None:
+            mask &= InvertedIndex.contains(self.target_index.union(spec.targets), positions)
+
+        return mask
+
+    def query(self, **filters):
+        """
+        Return a QueryResult with the rows matching all the filters (see `get_mask` for the arguments).
+        """
+        spec = normalize_filters(**filters)
+        positions = self.cache.get(spec)
+        if positions is not None:
+            self.cache.move_to_end(spec)
+            return QueryResult(self, positions)
+
+        # Start from the smallest cached result that the query narrows, or from the date range
+        bases = [cached for cached_spec, cached in self.cache.items() if narrows(spec, cached_spec)]
+        if bases:
+            positions = min(bases, key=len)
+            positions = positions[self.get_spec_mask(positions, spec)]
+        else:
+            positions = self.get_date_positions(spec.start_date, spec.end_date)
+            positions = positions[self.get_spec_mask(positions, spec, dates=False)]
+
+        if self.cache_size:
+            self.cache[spec] = positions
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return QueryResult(self, positions)
+
+    def clear_cache(self):
+        self.cache.clear()
+
+    def get_date_positions(self, start=None, end=None):
+        """
+        Return the sorted positions of the rows whose start date is between `start` and `end` (inclusive).
+        """
+        low, high = 0, len(self.sorted_date_times)
+        if start is not None:
+            low = np.searchsorted(self.sorted_date_times, np.datetime64(pd.Timestamp(start).normalize(), 'ns'))
+        if end is not None:
+            high = np.searchsorted(self.sorted_date_times,
+                                   np.datetime64(pd.Timestamp(end).normalize() + pd.Timedelta(days=1), 'ns'))
+        positions = self.time_order[low:max(low, high)]
+        return positions if self.is_time_ordered else np.sort(positions)
+
+    def update_time_index(self, start=0):
+        """
+        Update the sorted index of the start times for the rows from position `start` on.
+
+        Rows appended in time order after the existing rows are added at the end; otherwise the index is sorted again.
+        """
+        new_date_times = self.date_times[start:]
+        in_order = start > 0 and (np.diff(new_date_times) >= np.timedelta64(0)).all()
+        if in_order and len(new_date_times):
+            in_order = new_date_times[0] >= self.sorted_date_times[-1]
+        if in_order:
+            self.time_order = np.concatenate((self.time_order, np.arange(start, len(self.date_times))))
+            self.sorted_date_times = np.concatenate((self.sorted_date_times, new_date_times))
+            return
+        self.time_order = np.argsort(self.date_times, kind='stable')
+        self.sorted_date_times = self.date_times[self.time_order]
+        self.is_time_ordered = bool((self.time_order == np.arange(len(self.time_order))).all())
+
+    def get_targets(self, positions=None):
+        if positions is None:
+            return self.target_index.keys()
+        return list(self.get_facets(positions, ['targets'])['targets'])
+
+    def get_facets(self, positions=None, facets=FACETS):
+        """
+        Return the facet counts of the rows at `positions` (by default all rows).
+
+        The result maps each of the `facets` to a dictionary of counts: 'instruments' by instrument name
+        (in INSTRUMENT_KEYWORDS order), 'targets' by canonical target token, 'years' by year, 'months'
+        by 'YYYY-MM' and 'polarimetry' by True/False. Values that no row has are left out.
+        """
+        if positions is None:
+            positions = np.arange(len(self.df))
+        counts = {}
+        if 'instruments' in facets:
+            # Count the distinct masks first, there are far fewer of them than rows
+            masks, mask_counts = np.unique(self.instrument_masks[positions], return_counts=True)
+            counts['instruments'] = {}
+            for instrument, bit in iu.INSTRUMENT_BITS.items():
+                count = int(mask_counts[(masks & bit) != 0].sum())
+                if count:
+                    counts['instruments'][instrument] = count
+        if 'targets' in facets:
+            selected = np.zeros(len(self.df), dtype=bool)
+            selected[positions] = True
+            counts['targets'] = self.target_index.count(selected)
+        if 'years' in facets or 'months' in facets:
+            months, month_counts = np.unique(self.dates[positions].astype('datetime64[M]'), return_counts=True)
+            if 'months' in facets:
+                counts['months'] = {str(month): int(count) for month, count in zip(months, month_counts)}
+            if 'years' in facets:
+                years = months.astype('datetime64[Y]').astype(int) + 1970
+                counts['years'] = {int(year): int(month_counts[years == year].sum()) for year in np.unique(years)}
+        if 'polarimetry' in facets:
+            num_true = int(self.polarimetry[positions].sum())
+            counts['polarimetry'] = {key: count for key, count in [(True, num_true), (False, len(positions) - num_true)]
+                                     if count}
+        return counts
+
+    def append(self, df):
+        """
+        Add the rows of df after the existing rows, indexing only the new rows.
+        """
+        self.clear_cache()
+        start = len(self.df)
+        derived = get_derived_columns(df)
+        self.df = pd.concat([self.df, df], ignore_index=True)
+        for name, values in derived.items():
+            setattr(self, name, np.concatenate((getattr(self, name), values)))
+        self.instrument_index.add((iu.get_instruments_from_mask(mask) for mask in derived['instrument_masks']), start)
+        self.target_index.add(derived['token_lists'], start)
+        self.update_time_index(start)
+
+    def refresh_rows(self, positions):
+        """
+        Update the derived columns and the indexes of the rows at `positions`, after they were edited in `df`.
+        """
+        self.clear_cache()
+        positions = np.asarray(positions, dtype=np.int64)
+        derived = get_derived_columns(self.df.iloc[positions])
+        self.instrument_index.remove(positions, (iu.get_instruments_from_mask(mask)
+                                                 for mask in self.instrument_masks[positions]))
+        self.target_index.remove(positions, self.token_lists[positions])
+        moved = (self.date_times[positions] != derived['date_times']).any()
+        for name, values in derived.items():
+            getattr(self, name)[positions] = values
+        for position, mask, tokens in zip(positions, derived['instrument_masks'], derived['token_lists']):
+            self.instrument_index.add([iu.get_instruments_from_mask(mask)], position)
+            self.target_index.add([tokens], position)
+        if moved:
+            self.update_time_index()
+
+
+class QueryResult(Sequence):
+    """
+    Lightweight view of the rows matched by a query, holding only their positions in the engine's DataFrame.
+
+    Rows are only copied out of the DataFrame by `to_frame`. `refine` applies further filters to the
+    matched rows only, e.g. a target filter after the date and instrument filters.
+
+    Examples
+    --------
+    >>> result = engine.query(date_range=('2022-06-01', '2022-06-30'))
+    >>> len(result.refine(targets=['Sunspot']))
+    12
+    """
+
+    def __init__(self, engine, positions):
+        self.engine = engine
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return QueryResult(self.engine, self.positions[index])
+        return self.engine.df.iloc[self.positions[index]]
+
+    def __repr__(self):
+        return f'QueryResult({len(self)} of {len(self.engine)} observations)'
+
+    def refine(self, **filters):
+        """
+        Return a QueryResult with the rows of this result that also match `filters` (see `QueryEngine.get_mask`).
+        """
+        return QueryResult(self.engine, self.positions[self.engine.get_mask(self.positions, **filters)])
+
+    def get_targets(self):
+        """
+        Return the sorted canonical target tokens of the matched rows.
+        """
+        return self.engine.get_targets(self.positions)
+
+    def get_facets(self, facets=FACETS):
+        """
+        Return the facet counts of the matched rows (see `QueryEngine.get_facets`).
+        """
+        return self.engine.get_facets(self.positions, facets)
+
+    def to_frame(self, columns=None):
+        """
+        Return the matched rows of the DataFrame, optionally only some of its columns.
+        """
+        df = self.engine.df if columns is None else self.engine.df[columns]
+        return df.iloc[self.positions]
+
+
+def get_facet_options(counts):
+    """
+    Return the (label, value) options of a facet dropdown, e.g. ('Sunspot (42)', 'Sunspot'),
+    from a dictionary of counts as returned by `QueryEngine.get_facets`.
+    """
+    return [(f'{value} ({count})', value) for value, count in counts.items()]
+
+
+def query(df, **filters):
+    """
+    Queries an observation DataFrame without widgets.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame (see `QueryEngine`).
+    **filters
+        instruments, all_instruments, date_range, time_range, targets and polarimetry,
+        as described in `QueryEngine.get_mask`.
+
+    Returns
+    -------
+    QueryResult
+        The view of the matching rows.
+
+    Dependencies
+    ------------
+    QueryEngine class
+
+    Notes
+    -----
+    Function Name: query
+    This builds a QueryEngine for a single query. To run several queries over the same DataFrame,
+    create the engine once and call its `query` method, so the derived columns are computed only once.
+    It is also available as `pipmag.query`.
+
+    Examples
+    --------
+    >>> import pipmag
+    >>> pipmag.query(df, instruments=['CRISP'], time_range=('08:00', '12:00'), polarimetry=True).to_frame()
+    """
+    return QueryEngine(df).query(**filters)
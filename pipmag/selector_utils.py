@@ -2,14 +2,66 @@ import pandas as pd
 from IPython.display import display, clear_output, Video, HTML
 import ipywidgets as widgets
 from pipmag.ads_utils import ADS_Search
+from pipmag import la_palma_utils as lp
+from pipmag import storage_utils as stu
+from pipmag import query_utils as qu
 import os
 
 
-class MovieSelector:
+def get_first_canonical_link(links):
+    """
+    Return the canonical link of the first media item of a list or ';'-joined string of links, or None.
+    """
+    if isinstance(links, str):
+        links = links.split(';') if links else []
+    canonical = lp.get_canonical_links(links) if isinstance(links, list) else []
+    return canonical[0] if canonical else None
+
+
+class MediaVariantMenu:
+    """
+    Listing of one canonical link per media item, with a dropdown of the variants of the selected item,
+    shared by the VideoSelector widgets, which set `links_dropdown` and `variant_dropdown`.
+    """
+
+    def set_media_links(self, links):
+        """
+        Group the links into media items (see `la_palma_utils.get_media_variants`) and list the file name
+        of the canonical link of every item in the links dropdown.
+        """
+        self.media_variants = lp.get_media_variants(links)
+        self.links_full_name = [variants[0][1] for variants in self.media_variants.values()]
+        options = [os.path.basename(link) for link in self.links_full_name]
+        self.links_dropdown.options = options if options else ['No Video Links']
+
+    def select_media_item(self, option):
+        """
+        Select the canonical link of the links dropdown option `option` and list the variants of its media item.
+        """
+        if not self.links_full_name or option not in self.links_dropdown.options:
+            self.selected_link = ''
+            self.variant_dropdown.options = []
+            return
+        self.selected_link = self.links_full_name[self.links_dropdown.options.index(option)]
+        variants = next((variants for variants in self.media_variants.values()
+                         if variants[0][1] == self.selected_link), [])
+        self.variant_dropdown.options = [(variant, link) for variant, link in variants]
+
+    def select_variant(self, link):
+        """
+        Switch to another variant of the selected media item.
+        """
+        if link:
+            self.selected_link = link
+
+
+class MovieSelector(MediaVariantMenu):
     '''Class to create a widget to select a movie from a list of movies'''
 
     def __init__(self, df):
         self.df = df
+        self.links_full_name = []
+        self.media_variants = {}
 
     def get_links(self, date_time):
         return self.df[self.df['date_time'] == date_time]['video_links'].values[0]
@@ -23,6 +75,10 @@ class MovieSelector:
         self.links_dropdown = widgets.Dropdown(
             options=[], description='Movie Links:')
 
+        # Create a dropdown widget for the variants (scaling, format, continuation) of the selected movie
+        self.variant_dropdown = widgets.Dropdown(
+            options=[], description='Variant:')
+
         # Create a variable to store the selected link
         self.selected_link = ''
 
@@ -32,22 +88,27 @@ class MovieSelector:
         # Function to update the links dropdown based on the selected date_time
         def update_links(change):
             date_time = change.new
-            links = self.get_links(date_time)
-            self.links_dropdown.options = links
+            self.set_media_links(self.get_links(date_time))
 
-        # Function to update the selected link when the links dropdown value changes
+        # Function to update the selected link and its variants when the links dropdown value changes
         def links_value_changed(change):
-            self.selected_link = change.new
+            self.select_media_item(change.new)
+
+        # Function to switch to another variant of the selected movie
+        def variant_value_changed(change):
+            self.select_variant(change.new)
 
         # Register the function to be called when the date_time dropdown value changes
         self.date_time_dropdown.observe(update_links, names='value')
 
         # Register the function to be called when the links dropdown value changes
         self.links_dropdown.observe(links_value_changed, names='value')
+        self.variant_dropdown.observe(variant_value_changed, names='value')
 
         # Display the dropdown widgets and the output widget
         display(self.date_time_dropdown)
         display(self.links_dropdown)
+        display(self.variant_dropdown)
 
         def display_selected_link_button(b):
             with self.output:
@@ -60,14 +121,87 @@ class MovieSelector:
         display(self.output)
 
 
-class VideoSelector:
-    def __init__(self, df):
+def get_date_time(year, month, day, time):
+    """
+    Return the start time selected in the year, month, day and time ('HH:MM:SS') dropdowns.
+    """
+    return pd.Timestamp(f'{int(year):04d}-{int(month):02d}-{int(day):02d} {time}')
+
+
+class ObservationLookup:
+    """
+    Date and link lookups of the selector widgets.
+
+    With a catalog_utils.ObservationCatalog, every lookup is a query on the indexes of the catalog,
+    so the widgets neither load nor scan the observation table. Otherwise the DataFrame is filtered.
+    Row indexes refer to df when it is given, and are the catalog obs_ids otherwise.
+    """
+
+    def __init__(self, df=None, catalog=None):
+        if df is None and catalog is None:
+            raise ValueError("Either a DataFrame or an observation catalog is required")
         self.df = df
+        self.catalog = catalog
+
+    def get_years(self):
+        if self.catalog is not None:
+            return self.catalog.get_years()
+        return list(self.df['year'].unique())
+
+    def get_months(self, year):
+        if self.catalog is not None:
+            return self.catalog.get_months(year)
+        return list(self.df[self.df['year'] == year]['month'].unique())
+
+    def get_days(self, year, month):
+        if self.catalog is not None:
+            return self.catalog.get_days(year, month)
+        return list(self.df[(self.df['year'] == year) & (self.df['month'] == month)]['day'].unique())
+
+    def get_times(self, year, month, day):
+        if self.catalog is not None:
+            return self.catalog.get_times(year, month, day)
+        return list(self.df[(self.df['year'] == year) & (self.df['month'] == month) & (
+            self.df['day'] == day)]['time'].unique())
+
+    def get_index(self, date_time):
+        """
+        Return the index of the observation starting at `date_time`, or None.
+        """
+        if self.catalog is None:
+            rows = self.df.index[self.df['date_time'] == date_time]
+            return rows[0] if len(rows) else None
+        obs_id = self.catalog.find_obs_id(date_time)
+        if obs_id is None or self.df is None or 'obs_id' not in self.df.columns:
+            return obs_id
+        rows = self.df.index[self.df['obs_id'] == obs_id]
+        return rows[0] if len(rows) else None
+
+    def get_video_links(self, date_time):
+        """
+        Return the video links of the observation starting at `date_time`.
+        """
+        if self.catalog is None:
+            rows = self.df[self.df['date_time'] == date_time]
+            return list(rows['video_links'].values[0]) if len(rows) else []
+        obs_id = self.catalog.find_obs_id(date_time)
+        return [] if obs_id is None else self.catalog.get_links(obs_id, 'video')
+
+
+class VideoSelector(MediaVariantMenu):
+    def __init__(self, df=None, catalog=None):
+        # With an observation catalog (see catalog_utils.build_catalog), the dropdowns are filled
+        # from its indexes and df is not needed
+        self.df = df
+        self.lookup = ObservationLookup(df, catalog)
+        self.selected_date_time = None
+        self.links_full_name = []
+        self.media_variants = {}
 
     def create_widget(self):
         # Create a dropdown widget for the year column
         self.year_dropdown = widgets.Dropdown(
-            options=self.df['year'].unique(), description='Year:')
+            options=self.lookup.get_years(), description='Year:')
 
         # Create a dropdown widget for the month column
         self.month_dropdown = widgets.Dropdown(
@@ -83,6 +217,10 @@ class VideoSelector:
         self.links_dropdown = widgets.Dropdown(
             options=[], description='Links:')
 
+        # Create a dropdown widget for the variants (scaling, format, continuation) of the selected link
+        self.variant_dropdown = widgets.Dropdown(
+            options=[], description='Variant:')
+
         # Create a variable to store the selected link
         self.selected_link = ''
 
@@ -91,40 +229,32 @@ class VideoSelector:
 
         # Function to update the month dropdown based on the selected year
         def update_months(change):
-            year = change.new
-            months = self.df[self.df['year'] == year]['month'].unique()
-            self.month_dropdown.options = months
+            self.month_dropdown.options = self.lookup.get_months(change.new)
 
         # Function to update the day dropdown based on the selected month and year
         def update_days(change):
-            year = self.year_dropdown.value
-            month = change.new
-            days = self.df[(self.df['year'] == year) & (
-                self.df['month'] == month)]['day'].unique()
-            self.day_dropdown.options = days
+            self.day_dropdown.options = self.lookup.get_days(self.year_dropdown.value, change.new)
 
         # Function to update the time dropdown based on the selected day, month, and year
         def update_time(change):
-            year = self.year_dropdown.value
-            month = self.month_dropdown.value
-            day = change.new
-            time = self.df[(self.df['year'] == year) & (
-                self.df['month'] == month) & (self.df['day'] == day)]['time'].unique()
-            self.time_dropdown.options = time
-
-        # Function to update the links dropdown based on the selected time
+            self.time_dropdown.options = self.lookup.get_times(
+                self.year_dropdown.value, self.month_dropdown.value, change.new)
+
+        # Function to update the links dropdown based on the selected time, listing the canonical link of every
+        # media item
         def update_links(change):
-            time = change.new
-            links = list(self.df[self.df['time'] == time]
-                         ['video_links'].values[0])
-            self.links_dropdown.options = links
+            self.selected_date_time = get_date_time(
+                self.year_dropdown.value, self.month_dropdown.value, self.day_dropdown.value, change.new)
+            self.set_media_links(self.lookup.get_video_links(self.selected_date_time))
 
-        # Function to update the selected link when the links dropdown value changes
+        # Function to update the selected link and its variants when the links dropdown value changes
         def links_value_changed(change):
-            self.selected_link = change.new
-            self.matches = self.df[self.df['video_links'].apply(
-                lambda x: self.selected_link in x)]
-            self.selected_index = self.matches.index[0]
+            self.select_media_item(change.new)
+            self.selected_index = self.lookup.get_index(self.selected_date_time)
+
+        # Function to switch to another variant of the selected media item
+        def variant_value_changed(change):
+            self.select_variant(change.new)
 
         # Function to display the selected link when the display button is pressed
         def display_selected_link(b):
@@ -147,6 +277,9 @@ class VideoSelector:
         # Register the function to be called when the links dropdown value changes
         self.links_dropdown.observe(links_value_changed, names='value')
 
+        # Register the function to be called when the variant dropdown value changes
+        self.variant_dropdown.observe(variant_value_changed, names='value')
+
         # Create a button widget to display the selected link
         self.display_button = widgets.Button(description='Show')
         self.display_button.on_click(display_selected_link)
@@ -159,14 +292,67 @@ class VideoSelector:
         display(self.day_dropdown)
         display(self.time_dropdown)
         display(self.links_dropdown)
+        display(self.variant_dropdown)
         display(self.display_button)
         display(self.output)
 
 
-class DataUpdater:
-    def __init__(self, df, column_names):
+class AnnotationEditor:
+    """
+    Editing of the annotation columns shared by DataUpdater and the VideoSelector widgets, which set
+    `df`, `column_names`, `journal`, `engine`, `value_texts` and `output`. `engine` is an optional
+    `query_utils.QueryEngine` over the same `df`, whose indexes are kept in step with the edits.
+    """
+
+    def replay_journal(self):
+        """
+        Apply the edits of the journal to `df` in place, so the widget starts from the latest annotations.
+        """
+        if self.journal is not None:
+            self.journal.replay(self.df, inplace=True)
+            if self.engine is not None:
+                self.engine.refresh_rows(range(len(self.df)))
+
+    def update_annotations(self, index):
+        """
+        Set the annotation columns of row `index` from the text fields and record every edit in the journal.
+        """
+        for column_name in self.column_names:
+            value = self.value_texts[column_name].value
+            if isinstance(self.df.at[index, column_name], list):
+                self.df.at[index, column_name] = value.split(',')
+            else:
+                self.df.at[index, column_name] = value
+            if self.journal is not None:
+                self.journal.record(self.df, index, column_name, self.df.at[index, column_name])
+        if self.engine is not None:
+            self.engine.refresh_rows([self.df.index.get_loc(index)])
+        with self.output:
+            clear_output()
+            display(widgets.HTML(
+                f"<b>{', '.join(self.column_names)} updated for index {index}</b>"))
+
+    def display_annotations(self, index):
+        """
+        Fill the text fields with the annotation columns of row `index`.
+        """
+        for column_name in self.column_names:
+            existing_value = self.df.at[index, column_name]
+            if isinstance(existing_value, list):
+                self.value_texts[column_name].value = ', '.join(existing_value)
+            else:
+                self.value_texts[column_name].value = existing_value if pd.notna(existing_value) else ""
+
+
+class DataUpdater(AnnotationEditor):
+    def __init__(self, df, column_names, journal=None, engine=None):
         self.df = df
         self.column_names = column_names
+        # Optional journal_utils.AnnotationJournal, to which every update is appended
+        self.journal = journal
+        # Optional query_utils.QueryEngine over df, refreshed after every update
+        self.engine = engine
+        self.replay_journal()
         self.index_text = widgets.Text(description='Index:')
         self.value_texts = {}
         for column_name in self.column_names:
@@ -179,29 +365,11 @@ class DataUpdater:
         self.index_text.observe(self.display_existing_values, names='value')
 
     def update_values(self, b):
-        index = int(self.index_text.value)
-        for column_name in self.column_names:
-            value = self.value_texts[column_name].value
-            if isinstance(self.df.at[index, column_name], list):
-                self.df.at[index, column_name] = value.split(',')
-            else:
-                self.df.at[index, column_name] = value
-        with self.output:
-            clear_output()
-            display(widgets.HTML(
-                f"<b>{', '.join(self.column_names)} updated for index {index}</b>"))
+        self.update_annotations(int(self.index_text.value))
 
     def display_existing_values(self, change):
         if self.index_text.value:
-            index = int(self.index_text.value)
-            for column_name in self.column_names:
-                existing_value = self.df.at[index, column_name]
-                if isinstance(existing_value, list):
-                    self.value_texts[column_name].value = ', '.join(
-                        existing_value)
-                else:
-                    self.value_texts[column_name].value = existing_value if pd.notna(
-                        existing_value) else ""
+            self.display_annotations(int(self.index_text.value))
 
     def display(self):
         display(self.index_text)
@@ -211,18 +379,25 @@ class DataUpdater:
         display(self.output)
 
 
-class VideoSelector2:
-    def __init__(self, df, column_names):
+class VideoSelector2(AnnotationEditor, MediaVariantMenu):
+    def __init__(self, df, column_names, journal=None, engine=None, catalog=None):
         self.df = df
+        # The dropdowns are filled from the indexes of the observation catalog, if one is given
+        self.lookup = ObservationLookup(df, catalog)
+        self.selected_date_time = None
         self.column_names = column_names
+        self.journal = journal
+        self.engine = engine
+        self.replay_journal()
         self.selected_index = None
         self.links_full_name = []
+        self.media_variants = {}
 
     def create_widget(self):
 
         # Create a dropdown widget for the year column
         self.year_dropdown = widgets.Dropdown(
-            options=self.df['year'].unique(), description='Year:')
+            options=self.lookup.get_years(), description='Year:')
 
         # Create a dropdown widget for the month column
         self.month_dropdown = widgets.Dropdown(
@@ -238,6 +413,10 @@ class VideoSelector2:
         self.links_dropdown = widgets.Dropdown(
             options=[], description='Links:')
 
+        # Create a dropdown widget for the variants (scaling, format, continuation) of the selected link
+        self.variant_dropdown = widgets.Dropdown(
+            options=[], description='Variant:')
+
         # Create a variable to store the selected link
         self.selected_link = ''
 
@@ -251,34 +430,31 @@ class VideoSelector2:
         self.update_button = widgets.Button(description='Update')
 
         # Initialize the year dropdown with default value if only one year exists
-        if len(self.df['year'].unique()) == 1:
-            self.year_dropdown.value = self.df['year'].unique()[0]
-            months = self.df[self.df['year'] == self.year_dropdown.value]['month'].unique()
+        years = self.lookup.get_years()
+        if len(years) == 1:
+            self.year_dropdown.value = years[0]
+            months = self.lookup.get_months(self.year_dropdown.value)
             self.month_dropdown.options = months
 
             # If only one month exists, initialize the month dropdown too
             if len(months) == 1:
                 self.month_dropdown.value = months[0]
-                days = self.df[(self.df['year'] == self.year_dropdown.value) & (
-                               self.df['month'] == self.month_dropdown.value)]['day'].unique()
+                days = self.lookup.get_days(self.year_dropdown.value, self.month_dropdown.value)
                 self.day_dropdown.options = days
 
                 # If only one date exists, initialize the day dropdown too
                 if len(days) == 1:
                     self.day_dropdown.value = days[0]
-                    times = self.df[(self.df['year'] == self.year_dropdown.value) & (
-                                    self.df['month'] == self.month_dropdown.value) & (
-                                    self.df['day'] == self.day_dropdown.value)]['time'].unique()
+                    times = self.lookup.get_times(self.year_dropdown.value, self.month_dropdown.value,
+                                                  self.day_dropdown.value)
                     self.time_dropdown.options = times
 
                     # If only one time exists, initialize the time dropdown too
                     if len(times) == 1:
                         self.time_dropdown.value = times[0]
-                        links = list(self.df[(self.df['year'] == self.year_dropdown.value) & (
-                            self.df['month'] == self.month_dropdown.value) & (
-                            self.df['day'] == self.day_dropdown.value) & (
-                            self.df['time'] == self.time_dropdown.value)]['video_links'].values[0])
-                        self.links_dropdown.options = links
+                        self.selected_date_time = get_date_time(self.year_dropdown.value, self.month_dropdown.value,
+                                                                self.day_dropdown.value, self.time_dropdown.value)
+                        self.set_media_links(self.lookup.get_video_links(self.selected_date_time))
 
         # Initialize all dropdowns if only one entry in the DataFrame
         if len(self.df) == 1:
@@ -290,75 +466,49 @@ class VideoSelector2:
             self.day_dropdown.value = single_row['day']
             self.time_dropdown.options = [single_row['time']]
             self.time_dropdown.value = single_row['time']
+            self.selected_date_time = pd.Timestamp(single_row['date_time'])
 
-            # Handle multiple links
-            self.links_dropdown.options = list(single_row['video_links'])
-            self.links_dropdown.value = single_row['video_links'][0] if single_row['video_links'] else None
-            self.selected_link = self.links_dropdown.value
-            self.links_full_name = list(single_row['video_links'])  # Make sure to set this!
+            # Handle multiple links, one entry per media item
+            self.set_media_links(single_row['video_links'])
+            self.select_media_item(self.links_dropdown.options[0])
             self.selected_index = 0  # Since there's only one row, the index is 0
 
         # Function to update the month dropdown based on the selected year
         def update_months(change):
-            year = change.new
-            months = self.df[self.df['year'] == year]['month'].unique()
-            self.month_dropdown.options = months
+            self.month_dropdown.options = self.lookup.get_months(change.new)
 
         # Function to update the day dropdown based on the selected month and year
         def update_days(change):
-            year = self.year_dropdown.value
-            month = change.new
-            days = self.df[(self.df['year'] == year) & (
-                self.df['month'] == month)]['day'].unique()
-            self.day_dropdown.options = days
+            self.day_dropdown.options = self.lookup.get_days(self.year_dropdown.value, change.new)
 
         # Function to update the time dropdown based on the selected day, month, and year
         def update_time(change):
-            year = self.year_dropdown.value
-            month = self.month_dropdown.value
-            day = change.new
-            time = self.df[(self.df['year'] == year) & (
-                self.df['month'] == month) & (self.df['day'] == day)]['time'].unique()
-            self.time_dropdown.options = time
+            self.time_dropdown.options = self.lookup.get_times(
+                self.year_dropdown.value, self.month_dropdown.value, change.new)
 
         # Function to update the links dropdown based on the selected time, day, month, and year
         def update_links(change):
-            year = self.year_dropdown.value
-            month = self.month_dropdown.value
-            day = self.day_dropdown.value
-            time = change.new
-            selected_datetime = pd.Timestamp(year=year, month=month, day=day, hour=int(
-                time.split(':')[0]), minute=int(time.split(':')[1]), second=int(time.split(':')[2]))
-
-            links = list(self.df[self.df['date_time'] == selected_datetime]['video_links'].values[0])
+            self.selected_date_time = get_date_time(
+                self.year_dropdown.value, self.month_dropdown.value, self.day_dropdown.value, change.new)
 
-            # Create a list of the link names (without the full path)
-            options = [os.path.basename(link) for link in links]
-
-            # Store the full path of the links in a variable
-            self.links_full_name = links
-            self.links_dropdown.options = options if links else ['No Video Links']
+            # Group the variants of each movie and list only the canonical link of every media item
+            self.set_media_links(self.lookup.get_video_links(self.selected_date_time))
 
         # Function to update the selected link when the links dropdown value changes
         def links_value_changed(change):
+            # Get the full path of the selected link and list the variants of its media item
+            self.select_media_item(change.new)
             if self.links_full_name:  # Check if links_full_name is not empty
-                # Get the index of the selected link
-                index = self.links_dropdown.options.index(change.new)
-                # Get the full path of the selected link
-                self.selected_link = self.links_full_name[index]
-
-                self.matches = self.df[self.df['video_links'].apply(
-                    lambda x: self.selected_link in x)]
-
-                if self.matches.empty:  # Check for an empty DataFrame
-                    self.selected_index = None
+                self.selected_index = self.lookup.get_index(self.selected_date_time)
+                if self.selected_index is None:
                     print("No matches found for the selected link.")
-                    return
-                self.selected_index = self.matches.index[0]
             else:
-                self.selected_link = ''
                 self.selected_index = None
 
+        # Function to switch to another variant of the selected media item
+        def variant_value_changed(change):
+            self.select_variant(change.new)
+
         # Function to display the selected link when the display button is pressed
         def display_selected_link(b):
             with self.output:
@@ -372,29 +522,11 @@ class VideoSelector2:
         # Function to update the index dropdown based on the selected time
 
         def update_values(b):
-            index = int(self.selected_index)
-            for column_name in self.column_names:
-                value = self.value_texts[column_name].value
-                if isinstance(self.df.at[index, column_name], list):
-                    self.df.at[index, column_name] = value.split(',')
-                else:
-                    self.df.at[index, column_name] = value
-            with self.output:
-                clear_output()
-                display(widgets.HTML(
-                    f"<b>{', '.join(self.column_names)} updated for index {index}</b>"))
+            self.update_annotations(int(self.selected_index))
 
         def display_existing_values(change):
             if self.selected_index:
-                index = int(self.selected_index)
-                for column_name in self.column_names:
-                    existing_value = self.df.at[index, column_name]
-                    if isinstance(existing_value, list):
-                        self.value_texts[column_name].value = ', '.join(
-                            existing_value)
-                    else:
-                        self.value_texts[column_name].value = existing_value if pd.notna(
-                            existing_value) else ""
+                self.display_annotations(int(self.selected_index))
 
         # Register the functions to be called when the year, month, and day dropdown values change
         self.year_dropdown.observe(update_months, names='value')
@@ -407,6 +539,9 @@ class VideoSelector2:
         # Register the function to be called when the links dropdown value changes
         self.links_dropdown.observe(links_value_changed, names='value')
 
+        # Register the function to be called when the variant dropdown value changes
+        self.variant_dropdown.observe(variant_value_changed, names='value')
+
         # Create a button widget to display the selected link
         self.display_button = widgets.Button(description='Show')
         self.display_button.on_click(display_selected_link)
@@ -423,6 +558,7 @@ class VideoSelector2:
         display(self.day_dropdown)
         display(self.time_dropdown)
         display(self.links_dropdown)
+        display(self.variant_dropdown)
         display(self.display_button)
 
         display(self.output)
@@ -437,10 +573,18 @@ class VideoSelector2:
             display(self.value_texts[column_name])
         display(self.update_button)
 
-class VideoSelector3:
-    def __init__(self, df, column_names):
+class VideoSelector3(AnnotationEditor, MediaVariantMenu):
+    def __init__(self, df, column_names, journal=None, engine=None, catalog=None):
         self.df = df
         self.column_names = column_names
+        self.journal = journal
+        self.engine = engine
+        self.replay_journal()
+        # The dropdowns are filled from the indexes of the observation catalog, if one is given
+        self.lookup = ObservationLookup(df, catalog)
+        self.selected_date_time = None
+        self.links_full_name = []
+        self.media_variants = {}
 
         # Adds a search of papers according to the selected day
         self.ads = ADS_Search(df)
@@ -448,7 +592,7 @@ class VideoSelector3:
     def create_widget(self):
         # Create a dropdown widget for the year column
         self.year_dropdown = widgets.Dropdown(
-            options=self.df['year'].unique(), description='Year:')
+            options=self.lookup.get_years(), description='Year:')
 
         # Create a dropdown widget for the month column
         self.month_dropdown = widgets.Dropdown(
@@ -464,6 +608,10 @@ class VideoSelector3:
         self.links_dropdown = widgets.Dropdown(
             options=[], description='Links:')
 
+        # Create a dropdown widget for the variants (scaling, format, continuation) of the selected link
+        self.variant_dropdown = widgets.Dropdown(
+            options=[], description='Variant:')
+
         # Create a variable to store the selected link
         self.selected_link = ''
 
@@ -479,40 +627,32 @@ class VideoSelector3:
 
         # Function to update the month dropdown based on the selected year
         def update_months(change):
-            year = change.new
-            months = self.df[self.df['year'] == year]['month'].unique()
-            self.month_dropdown.options = months
+            self.month_dropdown.options = self.lookup.get_months(change.new)
 
         # Function to update the day dropdown based on the selected month and year
         def update_days(change):
-            year = self.year_dropdown.value
-            month = change.new
-            days = self.df[(self.df['year'] == year) & (
-                self.df['month'] == month)]['day'].unique()
-            self.day_dropdown.options = days
+            self.day_dropdown.options = self.lookup.get_days(self.year_dropdown.value, change.new)
 
         # Function to update the time dropdown based on the selected day, month, and year
         def update_time(change):
-            year = self.year_dropdown.value
-            month = self.month_dropdown.value
-            day = change.new
-            time = self.df[(self.df['year'] == year) & (
-                self.df['month'] == month) & (self.df['day'] == day)]['time'].unique()
-            self.time_dropdown.options = time
-
-        # Function to update the links dropdown based on the selected time
+            self.time_dropdown.options = self.lookup.get_times(
+                self.year_dropdown.value, self.month_dropdown.value, change.new)
+
+        # Function to update the links dropdown based on the selected time, listing the canonical link of every
+        # media item
         def update_links(change):
-            time = change.new
-            links = list(self.df[self.df['time'] == time]
-                         ['video_links'].values[0])
-            self.links_dropdown.options = links
+            self.selected_date_time = get_date_time(
+                self.year_dropdown.value, self.month_dropdown.value, self.day_dropdown.value, change.new)
+            self.set_media_links(self.lookup.get_video_links(self.selected_date_time))
 
-        # Function to update the selected link when the links dropdown value changes
+        # Function to update the selected link and its variants when the links dropdown value changes
         def links_value_changed(change):
-            self.selected_link = change.new
-            self.matches = self.df[self.df['video_links'].apply(
-                lambda x: self.selected_link in x)]
-            self.selected_index = self.matches.index[0]
+            self.select_media_item(change.new)
+            self.selected_index = self.lookup.get_index(self.selected_date_time)
+
+        # Function to switch to another variant of the selected media item
+        def variant_value_changed(change):
+            self.select_variant(change.new)
 
         # Function to display the selected link when the display button is pressed
 
@@ -531,30 +671,11 @@ class VideoSelector3:
 
         # Function to update the index dropdown based on the selected time
         def update_values(b):
-            index = int(self.selected_index)
-            for column_name in self.column_names:
-                value = self.value_texts[column_name].value
-                if isinstance(self.df.at[index, column_name], list):
-                    self.df.at[index, column_name] = value.split(',')
-                else:
-                    self.df.at[index, column_name] = value
-            with self.output:
-                clear_output()
-                display(widgets.HTML(
-                    f"<b>{', '.join(self.column_names)} updated for index {index}</b>"))
+            self.update_annotations(int(self.selected_index))
 
         def display_existing_values(change):
-
             if self.selected_index:
-                index = int(self.selected_index)
-                for column_name in self.column_names:
-                    existing_value = self.df.at[index, column_name]
-                    if isinstance(existing_value, list):
-                        self.value_texts[column_name].value = ', '.join(
-                            existing_value)
-                    else:
-                        self.value_texts[column_name].value = existing_value if pd.notna(
-                            existing_value) else ""
+                self.display_annotations(int(self.selected_index))
 
         # Register the functions to be called when the year, month, and day dropdown values change
         self.year_dropdown.observe(update_months, names='value')
@@ -567,6 +688,9 @@ class VideoSelector3:
         # Register the function to be called when the links dropdown value changes
         self.links_dropdown.observe(links_value_changed, names='value')
 
+        # Register the function to be called when the variant dropdown value changes
+        self.variant_dropdown.observe(variant_value_changed, names='value')
+
         # Create a button widget to display the selected link
         self.display_button = widgets.Button(description='Show')
         self.display_button.on_click(display_selected_link)
@@ -581,6 +705,7 @@ class VideoSelector3:
         display(self.day_dropdown)
         display(self.time_dropdown)
         display(self.links_dropdown)
+        display(self.variant_dropdown)
         display(self.display_button)
 
         # Display the video
@@ -593,15 +718,63 @@ class VideoSelector3:
 
 
 class Query:
-    def __init__(self, df):
+    def __init__(self, df=None, partition_dir=None):
+        # With a year-partitioned dataset (see storage_utils.write_partitioned), only the partitions
+        # overlapping the selected dates are read, and the widget options come from its manifest
         self.df = df
+        self.partition_dir = partition_dir
+        self.manifest = stu.load_partition_manifest(partition_dir) if partition_dir is not None else None
+        # The filtering is done by the query engine, which derives its columns once
+        self.engine = qu.QueryEngine(df) if df is not None else None
+        self.engine_dates = None
+        self.result = None
         self.target_dropdown = None  # Initialize target_dropdown as None
 
+    def load_date_range(self, start_date, end_date):
+        if self.partition_dir is None:
+            return self.df
+        return stu.read_partitioned(self.partition_dir, start_date, end_date, for_query=True)
+
+    def get_engine(self, start_date, end_date):
+        if self.partition_dir is None:
+            return self.engine
+        # Keep the engine of the last date range, so that its cached results serve the following queries
+        if self.engine is None or self.engine_dates != (start_date, end_date):
+            self.engine = qu.QueryEngine(self.load_date_range(start_date, end_date))
+            self.engine_dates = (start_date, end_date)
+        return self.engine
+
+    def get_filters(self):
+        """
+        Return the filters selected in the widgets, as arguments of `query_utils.QueryEngine.query`.
+        """
+        return {
+            'instruments': list(self.instrument_dropdown.value),
+            'all_instruments': True,
+            'date_range': (self.start_date_dropdown.value, self.end_date_dropdown.value),
+            'time_range': (self.start_time_dropdown.value, self.end_time_dropdown.value),
+            'polarimetry': self.observation_mode_dropdown.value,
+        }
+
     def create_widget(self):
 
+        if self.manifest is not None:
+            partitions = list(self.manifest['partitions'].values())
+            instrument_options = sorted({item for entry in partitions for item in entry['instruments']})
+            targets = sorted({item for entry in partitions for item in entry['targets']})
+            target_options = [(item, item) for item in targets]
+            min_date = pd.Timestamp(partitions[0]['start']).date() if partitions else None
+            max_date = pd.Timestamp(partitions[-1]['end']).date() if partitions else None
+        else:
+            facets = self.engine.get_facets(facets=['instruments', 'targets'])
+            instrument_options = qu.get_facet_options(facets['instruments'])
+            target_options = qu.get_facet_options(facets['targets'])
+            min_date = pd.Timestamp(self.engine.dates.min()).date() if len(self.engine) else None
+            max_date = pd.Timestamp(self.engine.dates.max()).date() if len(self.engine) else None
+
         # Create a dropdown widget for the instruments column (allows for several instruments to be selected)
         self.instrument_dropdown = widgets.SelectMultiple(
-            options=self.df['instruments'].str.split(';').explode().str.strip().unique(),
+            options=instrument_options,
             description='Instrument(s):',
             layout=widgets.Layout(width='300px')
             # layout=widgets.Layout(width='300px', description_width='300px'),
@@ -610,10 +783,10 @@ class Query:
 
         # Create picker widgets for the start date, end date, start time, and end time
         self.start_date_dropdown = widgets.DatePicker(description='Start Date:',
-                                                      value=pd.to_datetime(self.df['date_time']).dt.date.min(),
+                                                      value=min_date,
                                                       continuous_update=False)
         self.end_date_dropdown = widgets.DatePicker(description='End Date:',
-                                                    value=pd.to_datetime(self.df['date_time']).dt.date.max(),
+                                                    value=max_date,
                                                     continuous_update=False)
         self.start_time_dropdown = widgets.Text(description='Start Time:', value='00:00')
         self.end_time_dropdown = widgets.Text(description='End Time:', value='23:59')
@@ -627,7 +800,7 @@ class Query:
 
         # Create a dropdown widget for target selection
         self.target_dropdown = widgets.SelectMultiple(
-            options=[''] + self.df['target'].str.split(',').explode().str.strip().unique(),
+            options=[('', '')] + target_options,
             description='Target(s):',
             layout=widgets.Layout(width='300px')
         )
@@ -635,71 +808,18 @@ class Query:
         # Function to update the filtered dates and targets based on instrument,
         # start date, end date, start time, and end time selection
         def update_target_options(change):
-            selected_instruments = self.instrument_dropdown.value
-            selected_start_date = self.start_date_dropdown.value
-            selected_end_date = self.end_date_dropdown.value
-            selected_start_time = self.start_time_dropdown.value
-            selected_end_time = self.end_time_dropdown.value
-
-            filtered_df = self.df
-
-            # Filter the result based on selected instruments
-            if selected_instruments:
-                filtered_df = filtered_df[filtered_df['instruments'].apply(
-                    # lambda x: any(item in selected_instruments for item in x.split(';')))] # any
-                    lambda x: all(item in x.split(';') for item in selected_instruments))]  # all
-
-            # Filter the result based on the selected start date, end date, start time, and end time
-            if selected_start_date:
-                filtered_df = filtered_df[pd.to_datetime(
-                    filtered_df['date_time']).dt.date >= pd.to_datetime(selected_start_date).date()]
-            if selected_end_date:
-                filtered_df = filtered_df[pd.to_datetime(
-                    filtered_df['date_time']).dt.date <= pd.to_datetime(selected_end_date).date()]
-            if selected_start_time:
-                filtered_df = filtered_df[pd.to_datetime(
-                    filtered_df['time'], format='%H:%M:%S').dt.time >= pd.to_datetime(selected_start_time).time()]
-            if selected_end_time:
-                filtered_df = filtered_df[pd.to_datetime(
-                    filtered_df['time'], format='%H:%M:%S').dt.time <= pd.to_datetime(selected_end_time).time()]
-
-            # Filter the result based on polarimetric or spectroscopic mode
-            if self.observation_mode_dropdown.value is False:
-                filtered_df = filtered_df[filtered_df['polarimetry'].eq(False)]  # Spectroscopic mode
-            elif self.observation_mode_dropdown.value is True:
-                filtered_df = filtered_df[filtered_df['polarimetry'].eq(True)]  # Polarimetric mode
-            elif self.observation_mode_dropdown.value == 'All':
-                pass
-
-            # Update the 'target' dropdown options based on the filtered DataFrame after the button is clicked
-            target_options = [''] + filtered_df['target'].str.split(',').explode().str.strip().dropna().unique()
-            self.target_dropdown.options = target_options
-
-            selected_target = self.target_dropdown.value
-
-            # Filter the result based on the selected targets
-            if 'None' not in selected_target:
-                # Combine selected targets with a regex OR '|' to search for any keyword
-                target_pattern = '|'.join(selected_target)
-                # Use str.contains() with the combined pattern
-                filtered_df = filtered_df[filtered_df['target'].str.contains(target_pattern)]
-
-            # Filter the result based on selected instruments
-            selected_instruments = self.instrument_dropdown.value
-            if selected_instruments:
-                filtered_df = filtered_df[filtered_df['instruments'].apply(
-                    lambda x: any(item in selected_instruments for item in x.split(';')))]
-
-            # Filter the result based on polarimetric or spectroscopic mode
-            if not self.observation_mode_dropdown.value:
-                filtered_df = filtered_df[filtered_df['polarimetry'].eq(False)]  # Spectroscopic mode
-            elif self.observation_mode_dropdown.value is True:
-                filtered_df = filtered_df[filtered_df['polarimetry'].eq(True)]  # Polarimetric mode
-            elif self.observation_mode_dropdown.value == 'All':
-                pass
+            filters = self.get_filters()
+            result = self.get_engine(*filters['date_range']).query(**filters)
+
+            # Update the 'target' dropdown options based on the filtered rows after the button is clicked,
+            # labelled with the number of matching observations, e.g. 'Sunspot (42)'
+            self.target_dropdown.options = [('', '')] + qu.get_facet_options(result.get_facets(['targets'])['targets'])
+
+            # Filter the result based on the selected targets, matching any of them
+            self.result = result.refine(targets=list(self.target_dropdown.value))
 
             # Store the filtered DataFrame in an instance variable
-            self.filtered_df = filtered_df
+            self.filtered_df = self.result.to_frame()
 
         def update_targets(change):
             update_target_options(change)
@@ -714,7 +834,8 @@ class Query:
             with output:
                 clear_output(wait=True)
                 display_df = filtered_df[['date_time', 'instruments', 'target', 'comments', 'polarimetry']].copy()
-                display_df['video_link'] = filtered_df['video_links'].str.split(';').str[0]  # Extract the first link
+                # Extract the canonical link of the first media item
+                display_df['video_link'] = [get_first_canonical_link(links) for links in filtered_df['video_links']]
                 # Convert to clickable links
                 display_df['video_link'] = display_df['video_link'].apply(
                     lambda x: f'<a href="{x}" target="_blank">Video Link</a>' if pd.notnull(x) else '')
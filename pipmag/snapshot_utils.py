@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from pipmag import storage_utils as stu
+
+# Manifest of a snapshot store and the directory holding its versions
+SNAPSHOT_STORE_MANIFEST = 'manifest.json'
+SNAPSHOT_STORE_FORMAT = 1
+SNAPSHOT_VERSIONS_DIR = 'versions'
+
+
+def get_version_dir_name(version):
+    """
+    Return the directory name of a version of a snapshot store, e.g. 'v000012'.
+    """
+    return f'v{int(version):06d}'
+
+
+def link_or_copy(source, destination):
+    """
+    Hard-link a file, falling back to a copy where hard links are not supported.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+class SnapshotStore:
+    """
+    Versioned store of the observation table, with a manifest index of all versions.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the store. It is created on the first commit.
+    keep_last : int, optional
+        The number of most recent versions kept by the retention policy. The default is None, which keeps all.
+    max_age_days : float, optional
+        The age in days beyond which versions are pruned. The default is None, which keeps all.
+
+    Attributes
+    ----------
+    directory : str
+        The directory of the store.
+    manifest : dict
+        The manifest, with the number of the 'latest' version and an entry per version holding its
+        'version', 'timestamp', 'checksum', 'rows', 'parent' and 'path'.
+
+    Methods
+    -------
+    commit(df)
+        Store df as a new version, unless it is identical to the latest version.
+    latest()
+        Return the manifest entry of the latest version, or None.
+    get_path(version=None)
+        Return the directory of a version (by default the latest).
+    read(version=None, start_date=None, end_date=None)
+        Read a version, optionally only a date range.
+    prune(keep_last=None, max_age_days=None)
+        Remove old versions.
+
+    Dependencies
+    ------------
+    - storage_utils: Required to write and read the year-partitioned versions.
+    - json: Required for the manifest.
+
+    Notes
+    -----
+    Class Name: SnapshotStore
+    Every version is a year-partitioned dataset (see `storage_utils.write_partitioned`) in its own directory.
+    A new version starts as hard links to the partitions of its parent, and only the partitions that
+    changed are rewritten, so unchanged years are stored once across all versions. The manifest keeps
+    the number of the latest version, so finding it does not involve listing or parsing file names
+    (`file_utils.get_latest_file` uses it when given the store directory). Versions are written to a
+    temporary directory and renamed into place before the manifest is updated, so a crash never leaves
+    a half-written version in the manifest.
+    The latest version is never pruned.
+
+    Examples
+    --------
+    >>> store = SnapshotStore('data/la_palma_obs_versions', keep_last=20)
+    >>> store.commit(df)
+    {'version': 4, 'timestamp': '2023-08-01T10:12:44', ...}
+    >>> df = store.read(start_date='2023-01-01')
+    """
+
+    def __init__(self, directory, keep_last=None, max_age_days=None):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.max_age_days = max_age_days
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        manifest_path = os.path.join(self.directory, SNAPSHOT_STORE_MANIFEST)
+        if not os.path.isfile(manifest_path):
+            return {'format': SNAPSHOT_STORE_FORMAT, 'latest': None, 'versions': {}}
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    def save_manifest(self):
+        stu.write_text_atomic(os.path.join(self.directory, SNAPSHOT_STORE_MANIFEST),
+                              json.dumps(self.manifest, indent=1))
+
+    def latest(self):
+        latest = self.manifest['latest']
+        return None if latest is None else self.manifest['versions'][str(latest)]
+
+    def get_path(self, version=None):
+        if version is None:
+            version = self.manifest['latest']
+        if version is None or str(version) not in self.manifest['versions']:
+            raise KeyError(f"Unknown snapshot version: {version}")
+        return os.path.join(self.directory, self.manifest['versions'][str(version)]['path'])
+
+    def read(self, version=None, start_date=None, end_date=None):
+        return stu.read_partitioned(self.get_path(version), start_date, end_date)
+
+    def commit(self, df):
+        """
+        Store df as a new version and return its manifest entry.
+
+        If df has the same content as the latest version, no version is added and the entry of
+        the latest version is returned.
+        """
+        versions_dir = os.path.join(self.directory, SNAPSHOT_VERSIONS_DIR)
+        os.makedirs(versions_dir, exist_ok=True)
+        parent = self.latest()
+        version = max((int(key) for key in self.manifest['versions']), default=0) + 1
+        temp_dir = os.path.join(versions_dir, f'.{get_version_dir_name(version)}.{os.getpid()}.tmp')
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        os.makedirs(temp_dir)
+
+        # Start from hard links to the parent, so that unchanged partitions are not written again
+        if parent is not None:
+            parent_dir = os.path.join(self.directory, parent['path'])
+            partition_manifest = stu.load_partition_manifest(parent_dir)
+            for entry in partition_manifest['partitions'].values():
+                link_or_copy(os.path.join(parent_dir, entry['file']), os.path.join(temp_dir, entry['file']))
+            shutil.copy2(os.path.join(parent_dir, stu.PARTITION_MANIFEST_FILE), temp_dir)
+
+        stu.write_partitioned(df, temp_dir)
+        partitions = stu.load_partition_manifest(temp_dir)['partitions']
+        checksum = hashlib.sha1(json.dumps(
+            [[key, entry['checksum']] for key, entry in sorted(partitions.items())]).encode('utf-8')).hexdigest()
+        if parent is not None and parent['checksum'] == checksum:
+            shutil.rmtree(temp_dir)
+            return parent
+
+        path = os.path.join(SNAPSHOT_VERSIONS_DIR, get_version_dir_name(version))
+        os.replace(temp_dir, os.path.join(self.directory, path))
+        entry = {
+            'version': version,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'checksum': checksum,
+            'rows': int(len(df)),
+            'parent': parent['version'] if parent is not None else None,
+            'path': path,
+        }
+        self.manifest['versions'][str(version)] = entry
+        self.manifest['latest'] = version
+        self.save_manifest()
+        self.prune()
+        return entry
+
+    def prune(self, keep_last=None, max_age_days=None):
+        """
+        Remove the versions beyond the `keep_last` most recent ones or older than `max_age_days`,
+        defaulting to the retention policy of the store, and return the numbers of the removed versions.
+        """
+        keep_last = self.keep_last if keep_last is None else keep_last
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+        versions = sorted(self.manifest['versions'].values(), key=lambda entry: entry['version'], reverse=True)
+
+        removed = []
+        now = datetime.now()
+        for rank, entry in enumerate(versions):
+            if entry['version'] == self.manifest['latest']:
+                continue
+            too_many = keep_last is not None and rank >= keep_last
+            too_old = max_age_days is not None and \
+                now - datetime.fromisoformat(entry['timestamp']) > timedelta(days=max_age_days)
+            if too_many or too_old:
+                removed.append(entry['version'])
+        if not removed:
+            return removed
+
+        # Update the manifest first, so that a crash only leaves unreferenced directories behind
+        for version in removed:
+            del self.manifest['versions'][str(version)]
+        self.save_manifest()
+        for version in removed:
+            shutil.rmtree(os.path.join(self.directory, SNAPSHOT_VERSIONS_DIR, get_version_dir_name(version)),
+                          ignore_errors=True)
+        return sorted(removed)
@@ -0,0 +1,392 @@
+import hashlib
+import json
+import os
+from itertools import chain
+import numpy as np
+import pandas as pd
+from pipmag import file_utils as fu
+from pipmag import instrument_utils as iu
+
+# Columns of the normalized links table
+LINK_TABLE_COLUMNS = ['obs_id', 'prefix', 'relative_path', 'kind', 'instrument_mask', 'size', 'mtime']
+
+# Manifest of a year-partitioned dataset, and the columns of its partitions
+PARTITION_MANIFEST_FILE = 'manifest.json'
+PARTITION_MANIFEST_VERSION = 1
+PARTITION_COLUMNS = ['date_time', 'year', 'month', 'day', 'time', 'instruments', 'target', 'comments',
+                     'video_links', 'image_links', 'links', 'num_links', 'polarimetry', 'target_tokens']
+
+
+def normalize_observations(df, link_info=None):
+    """
+    Splits an observation DataFrame into an observations table and a links table.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, with list columns holding lists (as returned by `read_and_format_csv`).
+    link_info : dict, optional
+        A dictionary mapping links to (size, mtime) tuples. Links without an entry get missing values.
+        The default is None, which leaves 'size' and 'mtime' empty.
+
+    Returns
+    -------
+    tuple
+        A tuple (observations, links) of DataFrames.
+        - observations : pd.DataFrame
+            The scalar columns and 'instruments' of df, with an 'obs_id' column and without the link columns.
+        - links : pd.DataFrame
+            One row per link with the columns of LINK_TABLE_COLUMNS, in the order of the 'links' lists.
+
+    Dependencies
+    ------------
+    numpy as np
+    pandas as pd
+    instrument_utils module (for the instrument bitmask of each link)
+
+    Notes
+    -----
+    Function Name: normalize_observations
+    Every URL is stored once, instead of once in 'links' and again in 'video_links' or 'image_links'.
+    The URL is split at its last '/' into a 'prefix', which is categorical so that the repeated
+    'http://tsih3.uio.no/lapalma/YYYY/YYYY-MM-DD//' directories are dictionary encoded, and a 'relative_path'.
+    The 'kind' of a link is 'video' or 'image' if it is in the corresponding list, and 'other' otherwise.
+    The 'obs_id' is the 'obs_id' column of df if present, and the row position otherwise.
+    A ValueError is raised if 'video_links' or 'image_links' holds a link that is not in 'links'.
+
+    Examples
+    --------
+    >>> observations, links = normalize_observations(df)
+    >>> links.columns.tolist()
+    ['obs_id', 'prefix', 'relative_path', 'kind', 'instrument_mask', 'size', 'mtime']
+    """
+    link_lists = [x if isinstance(x, list) else [] for x in df['links']]
+    obs_ids = df['obs_id'].values if 'obs_id' in df.columns else np.arange(len(df))
+
+    # Explode the links into one flat array, remembering the observation of each link
+    lengths = np.fromiter((len(x) for x in link_lists), dtype=np.int64, count=len(link_lists))
+    flat_links = pd.Series(list(chain.from_iterable(link_lists)), dtype=object)
+    video_links = set(chain.from_iterable(x for x in df['video_links'] if isinstance(x, list)))
+    image_links = set(chain.from_iterable(x for x in df['image_links'] if isinstance(x, list)))
+    missing = (video_links | image_links).difference(flat_links)
+    if missing:
+        raise ValueError(f"Links missing from the 'links' column: {sorted(missing)[:5]}")
+
+    is_video = flat_links.isin(video_links).values
+    is_image = flat_links.isin(image_links).values
+    parts = flat_links.str.rpartition('/')
+    links = pd.DataFrame({
+        'obs_id': np.repeat(obs_ids, lengths),
+        'prefix': (parts[0] + parts[1]).astype('category'),
+        'relative_path': parts[2],
+        'kind': pd.Categorical(np.where(is_video, 'video', np.where(is_image, 'image', 'other')),
+                               categories=['video', 'image', 'other']),
+        'instrument_mask': np.array([iu.get_instrument_mask(iu.get_link_instruments(link))
+                                     for link in flat_links], dtype=np.int64),
+    })
+    link_info = link_info or {}
+    links['size'] = pd.array([link_info.get(link, (None, None))[0] for link in flat_links], dtype='Int64')
+    links['mtime'] = pd.to_datetime([link_info.get(link, (None, None))[1] for link in flat_links])
+
+    observations = df.drop(columns=['links', 'video_links', 'image_links']).copy()
+    observations['obs_id'] = obs_ids
+    observations = observations[['obs_id'] + [col for col in observations.columns if col != 'obs_id']]
+    return observations.reset_index(drop=True), links
+
+
+def denormalize_observations(observations, links):
+    """
+    Rebuilds the observation DataFrame with list columns from an observations table and a links table.
+
+    Parameters
+    ----------
+    observations : pd.DataFrame
+        The observations table, with an 'obs_id' column.
+    links : pd.DataFrame
+        The links table, with the 'obs_id', 'prefix', 'relative_path' and 'kind' columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        The observation DataFrame with the 'links', 'video_links' and 'image_links' list columns restored.
+
+    Dependencies
+    ------------
+    numpy as np
+    pandas as pd
+
+    Notes
+    -----
+    Function Name: denormalize_observations
+    The links are ordered by observation once, and each list column is cut from the flat array of
+    URLs at the observation offsets, so no per-row Python callbacks are involved.
+    Links keep their order within an observation. The columns are returned in the order of the CSV file,
+    with 'obs_id' and any extra columns last.
+
+    Examples
+    --------
+    >>> df = denormalize_observations(*normalize_observations(df))
+    """
+    rows = pd.Index(observations['obs_id']).get_indexer(links['obs_id'])
+    order = np.argsort(rows, kind='stable')
+    rows = rows[order]
+    urls = (links['prefix'].astype(str) + links['relative_path'].astype(str)).values[order]
+    kinds = links['kind'].astype(str).values[order]
+
+    counts = np.bincount(rows[rows >= 0], minlength=len(observations))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    urls, kinds = urls[rows >= 0], kinds[rows >= 0]
+    is_video = kinds == 'video'
+    is_image = kinds == 'image'
+
+    df = observations.copy()
+    df['links'] = fu.split_at_offsets(urls, offsets)
+    df['video_links'] = fu.split_at_offsets(urls[is_video], np.concatenate(([0], np.cumsum(is_video)))[offsets])
+    df['image_links'] = fu.split_at_offsets(urls[is_image], np.concatenate(([0], np.cumsum(is_image)))[offsets])
+
+    csv_columns = ['date_time', 'year', 'month', 'day', 'time', 'instruments', 'target', 'comments',
+                   'video_links', 'image_links', 'links', 'num_links', 'polarimetry']
+    columns = [col for col in csv_columns if col in df.columns]
+    return df[columns + [col for col in df.columns if col not in columns]]
+
+
+def get_partition_file_name(year):
+    """
+    Return the file name of the partition holding the observations of a year, e.g. 'year=2020.csv'.
+    """
+    return f'year={int(year)}.csv'
+
+
+def load_partition_manifest(directory):
+    """
+    Return the manifest of a partitioned dataset, or an empty manifest if the directory has none.
+    """
+    manifest_path = os.path.join(directory, PARTITION_MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return {'version': PARTITION_MANIFEST_VERSION, 'partition_by': 'year', 'partitions': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_partitioned(df, directory, keep_other_partitions=False):
+    """
+    Writes an observation DataFrame as a year-partitioned dataset, rewriting only the partitions that changed.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, with list columns holding lists.
+    directory : str
+        The directory of the dataset. It is created if it does not exist.
+    keep_other_partitions : bool, optional
+        Flag indicating whether to keep the partitions of years not in df, instead of removing them
+        (default: False).
+
+    Returns
+    -------
+    list
+        The years of the partitions that were written or removed.
+
+    Dependencies
+    ------------
+    pandas as pd
+    hashlib, json modules
+
+    Notes
+    -----
+    Function Name: write_partitioned
+    Each year is stored as a CSV file in the format of 'la_palma_obs_data.csv', so it can be read with
+    `file_utils.read_and_format_csv`. The manifest ('manifest.json') records, per year, the file name,
+    the number of rows, the first and last date_time, the SHA-1 of the CSV content and the instruments
+    and canonical target tokens present, so readers can prune partitions and fill widget options without
+    opening them.
+    A partition whose content checksum is unchanged is not rewritten, and partitions of years no longer
+    in df are removed unless `keep_other_partitions` is set.
+    Files and the manifest are written to temporary files and renamed into place.
+
+    Examples
+    --------
+    >>> write_partitioned(df, 'data/la_palma_obs_data')
+    [2023]
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_partition_manifest(directory)
+    old_partitions = manifest['partitions']
+    partitions, changed = {}, []
+
+    df = df.sort_values('date_time', kind='stable')
+    years = pd.to_datetime(df['date_time']).dt.year
+    for year, part in df.groupby(years.values, sort=True):
+        # The target tokens are derived from the targets, so that they cannot go stale in a partition
+        csv_part = fu.add_target_tokens(part.copy())
+        targets = sorted(set(chain.from_iterable(csv_part['target_tokens'])))
+        content = fu.encode_list_columns(csv_part).to_csv(index=False)
+        checksum = hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+        key = str(year)
+        file_name = get_partition_file_name(year)
+        if old_partitions.get(key, {}).get('checksum') != checksum \
+                or not os.path.isfile(os.path.join(directory, file_name)):
+            write_text_atomic(os.path.join(directory, file_name), content)
+            changed.append(int(year))
+
+        instruments = chain.from_iterable(x for x in part['instruments'] if isinstance(x, list))
+        date_times = pd.to_datetime(part['date_time'])
+        partitions[key] = {
+            'file': file_name,
+            'rows': len(part),
+            'start': date_times.min().isoformat(),
+            'end': date_times.max().isoformat(),
+            'checksum': checksum,
+            'instruments': sorted({item.strip() for item in instruments if item.strip()}),
+            'targets': targets,
+        }
+
+    for key, entry in old_partitions.items():
+        if key in partitions:
+            continue
+        if keep_other_partitions:
+            partitions[key] = entry
+        else:
+            file_path = os.path.join(directory, entry['file'])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            changed.append(int(key))
+
+    partitions = {key: partitions[key] for key in sorted(partitions, key=int)}
+    manifest = {'version': PARTITION_MANIFEST_VERSION, 'partition_by': 'year', 'partitions': partitions}
+    write_text_atomic(os.path.join(directory, PARTITION_MANIFEST_FILE), json.dumps(manifest, indent=1))
+    return sorted(changed)
+
+
+def select_partitions(manifest, start_date=None, end_date=None):
+    """
+    Return the manifest entries of the partitions overlapping the inclusive date range, in time order.
+    """
+    start = pd.Timestamp(start_date).normalize() if start_date is not None else None
+    end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1) if end_date is not None else None
+    selected = []
+    for key in sorted(manifest['partitions'], key=int):
+        entry = manifest['partitions'][key]
+        if start is not None and pd.Timestamp(entry['end']) < start:
+            continue
+        if end is not None and pd.Timestamp(entry['start']) >= end:
+            continue
+        selected.append(entry)
+    return selected
+
+
+def read_partitioned(directory, start_date=None, end_date=None, for_query=False):
+    """
+    Reads the observations of a year-partitioned dataset in a date range, opening only the overlapping partitions.
+
+    Parameters
+    ----------
+    directory : str
+        The directory written by `write_partitioned`.
+    start_date, end_date : str, datetime.date or pd.Timestamp, optional
+        The first and last day to read, inclusive. The default is None, which leaves the range open.
+    for_query : bool, optional
+        Flag indicating whether to format the partitions with `file_utils.read_and_format_csv_for_query`,
+        as used by the `Query` widget, instead of `file_utils.read_and_format_csv` (default: False).
+
+    Returns
+    -------
+    pd.DataFrame or str
+        Returns the observations in the date range, in time order, if the partitions could be read.
+        Otherwise, returns an error message.
+
+    Dependencies
+    ------------
+    select_partitions function
+    file_utils module
+
+    Notes
+    -----
+    Function Name: read_partitioned
+    The partitions are selected from the first and last date_time recorded in the manifest,
+    and the rows of the boundary partitions are filtered to the exact range.
+
+    Examples
+    --------
+    >>> read_partitioned('data/la_palma_obs_data', start_date='2022-06-01', end_date='2022-06-30')
+    Returns a DataFrame with the observations of June 2022, read from 'year=2022.csv' only.
+    """
+    manifest_path = os.path.join(directory, PARTITION_MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return "Error: The specified dataset was not found."
+    manifest = load_partition_manifest(directory)
+
+    parts = []
+    for entry in select_partitions(manifest, start_date, end_date):
+        file_path = os.path.join(directory, entry['file'])
+        part = fu.read_and_format_csv_for_query(file_path) if for_query else fu.read_and_format_csv(file_path)
+        if isinstance(part, str):
+            return part
+        parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=PARTITION_COLUMNS)
+
+    df = pd.concat(parts, ignore_index=True)
+    date_times = pd.to_datetime(df['date_time'])
+    mask = np.ones(len(df), dtype=bool)
+    if start_date is not None:
+        mask &= (date_times >= pd.Timestamp(start_date).normalize()).values
+    if end_date is not None:
+        mask &= (date_times < pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)).values
+    return df[mask].reset_index(drop=True)
+
+
+def update_partitions(new_df, directory):
+    """
+    Adds new observations to a year-partitioned dataset, reading and rewriting only the partitions they fall in.
+
+    Parameters
+    ----------
+    new_df : pd.DataFrame
+        The new observations, with list columns holding lists.
+    directory : str
+        The directory of the dataset.
+
+    Returns
+    -------
+    list
+        The years of the partitions that were written.
+
+    Dependencies
+    ------------
+    read_partitioned, write_partitioned functions
+
+    Notes
+    -----
+    Function Name: update_partitions
+    This is the partitioned counterpart of `gen_la_palma_df.add_existing_and_new_dataframes`:
+    existing observations are kept and new observations with an already known date_time are dropped.
+    Partitions of other years are neither read nor written.
+
+    Examples
+    --------
+    >>> update_partitions(new_df, 'data/la_palma_obs_data')
+    [2023]
+    """
+    manifest = load_partition_manifest(directory)
+    years = sorted(set(pd.to_datetime(new_df['date_time']).dt.year))
+    existing = [read_partitioned(directory, f'{year}-01-01', f'{year}-12-31')
+                for year in years if str(year) in manifest['partitions']]
+    for part in existing:
+        if isinstance(part, str):
+            raise ValueError(part)
+
+    df = pd.concat(existing + [new_df], ignore_index=True)
+    df = df.drop_duplicates(subset=['date_time'], keep='first')
+    return write_partitioned(df, directory, keep_other_partitions=True)
+
+
+def write_text_atomic(file_path, content):
+    """
+    Write a text file through a temporary file renamed into place.
+    """
+    temp_path = f'{file_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(content)
+    os.replace(temp_path, file_path)
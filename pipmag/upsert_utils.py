@@ -0,0 +1,313 @@
+import hashlib
+import os
+import pickle
+import threading
+import pandas as pd
+from pipmag import file_utils as fu
+
+# Files of an upsert store: the compacted base table, the write-ahead segments and the row index
+STORE_BASE_FILE = 'base.csv'
+STORE_SEGMENT_DIR = 'segments'
+STORE_INDEX_FILE = 'index.pkl'
+STORE_INDEX_VERSION = 1
+
+# Number of segments after which upsert starts a compaction
+COMPACT_SEGMENT_THRESHOLD = 8
+
+# Serializes compactions of the same process, so that a background compaction and an explicit one do not overlap
+_compaction_lock = threading.Lock()
+# Serializes the read-modify-write updates of store indexes in this process, see `upsert`
+index_lock = threading.RLock()
+
+
+def to_csv_frame(df):
+    """
+    Return a copy of an observation DataFrame with the list columns joined by ';', as stored in CSV files.
+    The 'target_tokens' column is derived from the 'target' column.
+    """
+    df = df.copy()
+    if 'target' in df.columns:
+        fu.add_target_tokens(df)
+    return fu.encode_list_columns(df)
+
+
+def get_row_hashes(df, key):
+    """
+    Return a dictionary mapping the key of each row to a SHA-1 hash of the row content.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, with list columns holding lists.
+    key : str
+        The column identifying a row.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping the key values (as strings) to hex digests.
+
+    Notes
+    -----
+    Function Name: get_row_hashes
+    The row content is hashed in its CSV form, with missing values written as empty strings,
+    so a row read back from a store has the same hash as the row that was written.
+    """
+    csv_df = to_csv_frame(df)
+    keys = csv_df[key].astype(str).tolist()
+    cells = csv_df.astype(object).where(csv_df.notna(), '').astype(str).values.tolist()
+    return {k: hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest() for k, row in zip(keys, cells)}
+
+
+def write_csv_atomic(df, file_path):
+    """
+    Write an observation DataFrame as CSV through a temporary file renamed into place.
+    """
+    temp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    to_csv_frame(df).to_csv(temp_path, index=False)
+    os.replace(temp_path, file_path)
+
+
+def load_store_index(directory):
+    """
+    Return the row index of an upsert store: the key column, the row hashes and the next segment number.
+    """
+    index_path = os.path.join(directory, STORE_INDEX_FILE)
+    with open(index_path, 'rb') as f:
+        index = pickle.load(f)
+    if index.get('version') != STORE_INDEX_VERSION:
+        raise ValueError(f"Unsupported upsert store index version: {index.get('version')}")
+    return index
+
+
+def save_store_index(directory, index):
+    """
+    Write the row index of an upsert store through a temporary file renamed into place.
+    """
+    index_path = os.path.join(directory, STORE_INDEX_FILE)
+    temp_path = f'{index_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, index_path)
+
+
+def get_segment_files(directory):
+    """
+    Return the paths of the write-ahead segments of an upsert store, oldest first.
+    """
+    segment_dir = os.path.join(directory, STORE_SEGMENT_DIR)
+    if not os.path.isdir(segment_dir):
+        return []
+    names = sorted(name for name in os.listdir(segment_dir) if name.endswith('.csv'))
+    return [os.path.join(segment_dir, name) for name in names]
+
+
+def create_store(df, directory, key='date_time'):
+    """
+    Creates an upsert store holding an observation DataFrame as its base table.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observation DataFrame, with list columns holding lists.
+    directory : str
+        The directory of the store. It is created if it does not exist.
+    key : str, optional
+        The column identifying an observation (default: 'date_time').
+
+    Returns
+    -------
+    None
+
+    Dependencies
+    ------------
+    get_row_hashes, write_csv_atomic, save_store_index functions
+
+    Notes
+    -----
+    Function Name: create_store
+    The store consists of 'base.csv', in the format of 'la_palma_obs_data.csv', a 'segments' directory
+    of write-ahead segments added by `upsert`, and 'index.pkl' holding the columns of the store and
+    a hash of every row by key, which lets `upsert` find new and changed rows without reading the tables.
+
+    Examples
+    --------
+    >>> create_store(df, 'data/la_palma_obs_store')
+    (No output; the store is written to data/la_palma_obs_store.)
+    """
+    os.makedirs(os.path.join(directory, STORE_SEGMENT_DIR), exist_ok=True)
+    write_csv_atomic(df, os.path.join(directory, STORE_BASE_FILE))
+    save_store_index(directory, {'version': STORE_INDEX_VERSION, 'key': key, 'columns': list(to_csv_frame(df).columns),
+                                 'hashes': get_row_hashes(df, key), 'next_segment': 1})
+
+
+def upsert(df, directory, keep_existing=False, compact_threshold=COMPACT_SEGMENT_THRESHOLD, background=True):
+    """
+    Adds new and changed observations to an upsert store by appending a write-ahead segment.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The observations to add, with list columns holding lists.
+    directory : str
+        The directory of a store created with `create_store`.
+    keep_existing : bool, optional
+        Flag indicating whether rows whose key is already in the store are left unchanged, as in
+        `gen_la_palma_df.add_existing_and_new_dataframes`, instead of being replaced when their
+        content differs (default: False).
+    compact_threshold : int, optional
+        The number of segments from which a compaction is started (default: COMPACT_SEGMENT_THRESHOLD).
+        None disables compaction.
+    background : bool, optional
+        Flag indicating whether the compaction runs in a background thread (default: True).
+
+    Returns
+    -------
+    list
+        The keys (as strings) of the rows that were written.
+
+    Dependencies
+    ------------
+    get_row_hashes, load_store_index, save_store_index, write_csv_atomic, compact_store functions
+
+    Notes
+    -----
+    Function Name: upsert
+    The rows of df are hashed and compared with the row index of the store, so neither the base table
+    nor the segments are read, and the cost depends on the size of df, not on the size of the archive.
+    Only the columns of the store are hashed and written, so columns derived on export, such as the
+    session ids, do not make every row look changed.
+    The index is read, the segment written and the index saved while holding `index_lock`, so concurrent
+    upserts of the same process never write the same segment.
+    The new and changed rows are written to the next segment through a temporary file renamed into place,
+    which is the commit point, and the index is updated afterwards. A crash before the index update only
+    leaves rows that the next upsert writes again, which replaying handles, since the last version of a key wins.
+
+    Examples
+    --------
+    >>> upsert(new_df, 'data/la_palma_obs_store', keep_existing=True)
+    ['2023-06-01 08:12:03']
+    """
+    with index_lock:
+        index = load_store_index(directory)
+        key = index['key']
+        df = df.drop_duplicates(subset=[key], keep='first')
+        if 'columns' in index:
+            df = df.reindex(columns=index['columns'])
+        hashes = get_row_hashes(df, key)
+        old_hashes = index['hashes']
+        if keep_existing:
+            written = [k for k in hashes if k not in old_hashes]
+        else:
+            written = [k for k, h in hashes.items() if old_hashes.get(k) != h]
+        if not written:
+            return []
+
+        segment_path = os.path.join(directory, STORE_SEGMENT_DIR, f"{index['next_segment']:08d}.csv")
+        write_csv_atomic(df[df[key].astype(str).isin(written)], segment_path)
+        old_hashes.update((k, hashes[k]) for k in written)
+        index['next_segment'] += 1
+        save_store_index(directory, index)
+
+    if compact_threshold is not None and len(get_segment_files(directory)) >= compact_threshold:
+        if background:
+            threading.Thread(target=compact_store, args=(directory,), daemon=True).start()
+        else:
+            compact_store(directory)
+    return written
+
+
+def read_store(directory):
+    """
+    Reads an upsert store, replaying its segments over the base table.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of a store created with `create_store`.
+
+    Returns
+    -------
+    pd.DataFrame
+        The observations, formatted as by `file_utils.read_and_format_csv` and sorted by date and time.
+
+    Dependencies
+    ------------
+    file_utils module
+
+    Notes
+    -----
+    Function Name: read_store
+    Segments are applied oldest first, and the last version of each key wins.
+    The base table is read through the snapshot cache of `file_utils.read_and_format_csv`.
+    The store is read while holding the compaction lock, so a background compaction started by `upsert`
+    cannot remove the segments being replayed.
+
+    Examples
+    --------
+    >>> df = read_store('data/la_palma_obs_store')
+    """
+    with _compaction_lock:
+        key = load_store_index(directory)['key']
+        segment_files = get_segment_files(directory)
+        return replay_segments(directory, key, segment_files)
+
+
+def replay_segments(directory, key, segment_files):
+    """
+    Return the base table of a store with the given segments applied, sorted by date and time.
+    """
+    parts = [fu.read_and_format_csv(os.path.join(directory, STORE_BASE_FILE))]
+    parts += [fu.read_and_format_csv(file_path, use_snapshot=False) for file_path in segment_files]
+    for part in parts:
+        if isinstance(part, str):
+            raise ValueError(part)
+    parts = [part for part in parts if len(part)]
+    if len(parts) == 1:
+        return parts[0]
+    df = pd.concat(parts, ignore_index=True)
+    df = df.drop_duplicates(subset=[key], keep='last')
+    return df.sort_values('date_time', kind='stable').reset_index(drop=True)
+
+
+def compact_store(directory):
+    """
+    Merges the write-ahead segments of an upsert store into its base table.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of a store created with `create_store`.
+
+    Returns
+    -------
+    int
+        The number of segments that were merged.
+
+    Dependencies
+    ------------
+    replay_segments, write_csv_atomic functions
+
+    Notes
+    -----
+    Function Name: compact_store
+    The segments present when the compaction starts are replayed over the base table, the result
+    replaces the base table by an atomic rename, and only then are those segments removed.
+    Segments appended meanwhile are kept for the next compaction, and a crash between the rename
+    and the removal only leaves segments whose rows are already in the base table.
+
+    Examples
+    --------
+    >>> compact_store('data/la_palma_obs_store')
+    3
+    """
+    with _compaction_lock:
+        key = load_store_index(directory)['key']
+        segment_files = get_segment_files(directory)
+        if not segment_files:
+            return 0
+        df = replay_segments(directory, key, segment_files)
+        write_csv_atomic(df, os.path.join(directory, STORE_BASE_FILE))
+        for file_path in segment_files:
+            os.remove(file_path)
+        return len(segment_files)
@@ -0,0 +1,84 @@
+"""
+Benchmark of the list-column codec in file_utils against the per-cell apply and loop versions it replaces.
+
+Run from the repository root, with pipmag installed (pip install -e .):
+    python scripts/benchmark_list_codec.py [--repeat 20] [--scale 1]
+"""
+import argparse
+import timeit
+import numpy as np
+import pandas as pd
+from pipmag import file_utils as fu
+
+
+def get_list_columns(df):
+    # The shipped CSV file may predate some of the list columns
+    return [col for col in fu.LIST_COLUMNS if col in df.columns]
+
+
+def decode_with_apply(df):
+    for col in get_list_columns(df):
+        df[col] = df[col].apply(lambda x: x.split(';') if isinstance(x, str) else [])
+    for col in ['comments', 'polarimetry', 'target']:
+        df[col] = df[col].apply(lambda x: None if pd.isna(x) else x)
+    df['polarimetry'] = df['polarimetry'].apply(lambda x: str(x))
+    return df
+
+
+def decode_with_loop(df):
+    for col in get_list_columns(df):
+        df[col] = np.fromiter((x.split(';') if type(x) is str else [] for x in df[col].values),
+                              dtype=object, count=len(df))
+    for col in ['comments', 'polarimetry', 'target']:
+        df[col] = fu.nan_to_none(df[col])
+    df['polarimetry'] = df['polarimetry'].astype(str)
+    return df
+
+
+def decode_with_codec(df):
+    fu.decode_list_columns(df)
+    for col in ['comments', 'polarimetry', 'target']:
+        df[col] = fu.nan_to_none(df[col])
+    df['polarimetry'] = df['polarimetry'].astype(str)
+    return df
+
+
+def encode_with_apply(df):
+    for col in get_list_columns(df):
+        df[col] = df[col].apply(lambda x: ';'.join(x))
+    return df
+
+
+def encode_with_loop(df):
+    for col in get_list_columns(df):
+        df[col] = np.fromiter((';'.join(x) if type(x) is list else x for x in df[col].values),
+                              dtype=object, count=len(df))
+    return df
+
+
+def encode_with_codec(df):
+    return fu.encode_list_columns(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--csv', default='data/la_palma_obs_data.csv')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--scale', type=int, default=1, help='number of copies of the table to concatenate')
+    args = parser.parse_args()
+
+    raw = pd.concat([pd.read_csv(args.csv)] * args.scale, ignore_index=True)
+    decoded = decode_with_codec(raw.copy())
+    print(f'{len(raw)} rows, best of {args.repeat} runs')
+    for name, function, data in [('decode apply', decode_with_apply, raw),
+                                 ('decode loop', decode_with_loop, raw),
+                                 ('decode codec', decode_with_codec, raw),
+                                 ('encode apply', encode_with_apply, decoded),
+                                 ('encode loop', encode_with_loop, decoded),
+                                 ('encode codec', encode_with_codec, decoded)]:
+        best = min(timeit.repeat(lambda: function(data.copy()), number=1, repeat=args.repeat))
+        print(f'{name:>14}: {best * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Memory report of the observation table in the CSV layout and in the compact typed layout of file_utils.
+
+Run from the repository root, with pipmag installed (pip install -e .):
+    python scripts/memory_report.py [--csv data/la_palma_obs_data.csv]
+"""
+import argparse
+import sys
+from collections.abc import Sequence
+import numpy as np
+from pipmag import file_utils as fu
+
+
+def get_column_size(series):
+    """
+    Return the size in bytes of a column, counting the items of the lists held in object columns,
+    which `Series.memory_usage(deep=True)` leaves out.
+    """
+    size = series.memory_usage(deep=True, index=False)
+    if series.dtype == object:
+        size += sum(sys.getsizeof(item) for x in series
+                    if isinstance(x, Sequence) and not isinstance(x, str) for item in x)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--csv', default='data/la_palma_obs_data.csv')
+    args = parser.parse_args()
+
+    df = fu.read_and_format_csv(args.csv, use_snapshot=False)
+    compact_df = fu.to_compact_layout(df)
+    columns = list(dict.fromkeys(list(df.columns) + list(compact_df.columns)))
+
+    print(f'{len(df)} rows of {args.csv}')
+    print(f"{'column':>16} {'csv layout':>22} {'compact layout':>22}")
+    totals = np.zeros(2)
+    for col in columns:
+        cells = []
+        for i, frame in enumerate([df, compact_df]):
+            if col in frame.columns:
+                size = get_column_size(frame[col])
+                totals[i] += size
+                cells.append(f'{str(frame[col].dtype):>10} {size / 1024:8.1f} KiB')
+            else:
+                cells.append(f"{'-':>22}")
+        print(f'{col:>16} {cells[0]} {cells[1]}')
+    print(f"{'total':>16} {totals[0] / 1024:19.1f} KiB {totals[1] / 1024:19.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -23,5 +23,8 @@ setup(
         'pandas==1.5.3',
         'requests==2.31.0'
     ],
+    extras_require={
+        'parquet': ['pyarrow']
+    },
     python_requires='>=3.10',
 )
@@ -0,0 +1,24 @@
+import pandas as pd
+
+
+def make_sample_dataframe():
+    """
+    Return a two-row observation DataFrame in the list-column layout of `read_and_format_csv`.
+    """
+    prefix = 'http://tsih3.uio.no/lapalma/2020/2020-08-07//'
+    return pd.DataFrame({
+        'date_time': pd.to_datetime(['2020-08-07 08:22:14', '2020-08-07 09:40:02']),
+        'year': [2020, 2020],
+        'month': [8, 8],
+        'day': [7, 7],
+        'time': ['08:22:14', '09:40:02'],
+        'instruments': [['CRISP', 'CHROMIS'], ['CHROMIS']],
+        'target': ['Sunspot', None],
+        'comments': [None, None],
+        'video_links': [[prefix + 'crisp_blos_082214.mp4'], []],
+        'image_links': [[prefix + 'chromis_cak_082214.jpg'], [prefix + 'chromis_cak_094002.jpg']],
+        'links': [[prefix + 'crisp_blos_082214.mp4', prefix + 'chromis_cak_082214.jpg'],
+                  [prefix + 'chromis_cak_094002.jpg']],
+        'num_links': [2, 1],
+        'polarimetry': ['True', 'False']
+    })
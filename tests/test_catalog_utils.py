@@ -0,0 +1,88 @@
+import unittest
+import os
+import tempfile
+import pandas as pd
+
+from pipmag.catalog_utils import build_catalog, ObservationCatalog
+from pipmag.ads_utils import get_search_terms
+from pipmag.selector_utils import ObservationLookup
+from tests.helpers import make_sample_dataframe
+
+
+class TestObservationCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'catalog.sqlite')
+        self.df = make_sample_dataframe()
+        self.df.at[1, 'target'] = 'Quiet Sun, sunspot'
+        self.catalog = build_catalog(self.df, self.db_path)
+
+    def tearDown(self):
+        self.catalog.close()
+        self.temp_dir.cleanup()
+
+    def test_target_tokens(self):
+        # The catalog holds the canonical tokens of file_utils, as the 'target_tokens' column
+        self.assertEqual(self.catalog.get_targets(), ['Quiet Sun', 'Sunspot'])
+        self.assertEqual(self.catalog.query(targets=['QS']).index.tolist(), [1])
+        self.assertEqual(len(self.catalog.query(targets=[''])), 2)
+
+    def test_date_lookups(self):
+        self.assertEqual(self.catalog.get_years(), [2020])
+        self.assertEqual(self.catalog.get_days(2020, 8), [7])
+        self.assertEqual(self.catalog.get_times(2020, 8, 7), ['08:22:14', '09:40:02'])
+        self.assertEqual(self.catalog.find_obs_id('2020-08-07 09:40:02'), 1)
+        self.assertIsNone(self.catalog.find_obs_id('2020-08-07 10:00:00'))
+
+    def test_get_observation(self):
+        observation = self.catalog.get_observation(0)
+        self.assertEqual(observation['instruments'], ['CRISP', 'CHROMIS'])
+        self.assertEqual(observation['polarimetry'], 'True')
+        self.assertEqual(observation['video_links'], make_sample_dataframe().at[0, 'video_links'])
+        self.assertEqual(len(observation['links']), 2)
+        with self.assertRaises(KeyError):
+            self.catalog.get_observation(5)
+
+    def test_query(self):
+        self.assertEqual(self.catalog.query(instruments=['CHROMIS']).index.tolist(), [0, 1])
+        self.assertEqual(self.catalog.query(instruments=['CRISP', 'CHROMIS']).index.tolist(), [0])
+        self.assertEqual(self.catalog.query(targets=['SUNSPOT']).index.tolist(), [0, 1])
+        self.assertEqual(self.catalog.query(targets=['Quiet Sun']).index.tolist(), [1])
+        self.assertEqual(self.catalog.query(polarimetry=False).index.tolist(), [1])
+        self.assertEqual(self.catalog.query(start_time='09:00', end_time='10:00').index.tolist(), [1])
+        self.assertEqual(self.catalog.query(start_date='2020-08-07', end_date='2020-08-07').index.tolist(), [0, 1])
+        self.assertTrue(self.catalog.query(start_date='2020-08-08').empty)
+
+        df = self.catalog.query(instruments=['CRISP'])
+        self.assertEqual(df.at[0, 'instruments'], ['CRISP', 'CHROMIS'])
+        self.assertEqual(df.at[0, 'date_time'], pd.Timestamp('2020-08-07 08:22:14'))
+
+    def test_query_without_instruments(self):
+        df = self.df.copy()
+        df.at[1, 'instruments'] = []
+        catalog = build_catalog(df, os.path.join(self.temp_dir.name, 'empty.sqlite'))
+        self.assertEqual(catalog.query()['instruments'].tolist(), [['CRISP', 'CHROMIS'], []])
+        catalog.close()
+
+    def test_observation_lookup(self):
+        for lookup in [ObservationLookup(self.df), ObservationLookup(catalog=self.catalog),
+                       ObservationLookup(self.df, self.catalog)]:
+            self.assertEqual(lookup.get_years(), [2020])
+            self.assertEqual(lookup.get_months(2020), [8])
+            self.assertEqual(lookup.get_days(2020, 8), [7])
+            self.assertEqual(lookup.get_times(2020, 8, 7), ['08:22:14', '09:40:02'])
+            self.assertEqual(lookup.get_index(pd.Timestamp('2020-08-07 09:40:02')), 1)
+            self.assertIsNone(lookup.get_index(pd.Timestamp('2020-08-07 10:00:00')))
+            self.assertEqual(lookup.get_video_links(pd.Timestamp('2020-08-07 08:22:14')), self.df.at[0, 'video_links'])
+
+    def test_search_terms(self):
+        self.assertEqual(get_search_terms(self.catalog, 0), ['SST', 'CRISP', 'CHROMIS', '7 August 2020'])
+
+    def test_missing_catalog(self):
+        with self.assertRaises(FileNotFoundError):
+            ObservationCatalog(os.path.join(self.temp_dir.name, 'missing.sqlite'))
+
+
+if __name__ == '__main__':
+    unittest.main()
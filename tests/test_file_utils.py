@@ -1,9 +1,24 @@
 import unittest
 import os
+import numpy as np
 import pandas as pd
 import tempfile
 from pipmag.file_utils import read_and_format_csv, preprocess_and_save_dataframe
 from pipmag.file_utils import read_and_format_csv_for_query
+from pipmag.file_utils import load_csv_snapshot, CSV_SNAPSHOT_SUFFIX
+from pipmag.file_utils import read_and_format_csv_lazy, LazyLinkDtype
+from pipmag.file_utils import decode_list_columns, encode_list_columns, nan_to_none
+from pipmag.file_utils import normalize_targets, get_target_token_lists
+from pipmag.file_utils import save_pickle, load_pickle, save_snapshot, load_snapshot
+from pipmag.file_utils import save_parquet, read_parquet, read_and_format_parquet
+from pipmag.catalog_utils import build_catalog
+from tests.helpers import make_sample_dataframe
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 
 class TestReadAndFormatCSV(unittest.TestCase):
@@ -45,6 +60,143 @@ class TestReadAndFormatCSV(unittest.TestCase):
         self.assertTrue(pd.to_datetime("2013-06-30 09:15:50") == df['date_time'][0])
         self.assertTrue(df['instruments'][0] == ['CRISP', 'IRIS'])
         self.assertTrue(df['polarimetry'][0] == 'False')
+        self.assertEqual(df['target_tokens'][0], ['Spicules'])
+
+    def test_compact_layout(self):
+        df = read_and_format_csv(self.sample_csv_file, compact=True)
+        self.assertNotIn('time', df.columns)
+        self.assertEqual(df['seconds_of_day'][0], 9 * 3600 + 15 * 60 + 50)
+        self.assertEqual(df['seconds_of_day'].dtype, np.int32)
+        self.assertEqual(df['instruments'].dtype, 'category')
+        self.assertEqual(df['instruments'][0], 'CRISP;IRIS')
+        self.assertEqual(df['instrument_mask'][0], 0b101)
+        self.assertEqual(df['target'].dtype, 'category')
+        self.assertEqual(df['polarimetry'].dtype, bool)
+        self.assertFalse(df['polarimetry'][0])
+        self.assertEqual(df['links'][0], ['http://example.com/links'])
+
+    def test_snapshot(self):
+        df = read_and_format_csv(self.sample_csv_file)
+        self.assertTrue(os.path.exists(self.sample_csv_file + CSV_SNAPSHOT_SUFFIX))
+        pd.testing.assert_frame_equal(load_csv_snapshot(self.sample_csv_file), df)
+        pd.testing.assert_frame_equal(read_and_format_csv(self.sample_csv_file), df)
+
+        # Same content with a new modification time keeps the snapshot valid
+        os.utime(self.sample_csv_file, ns=(0, 0))
+        self.assertIsNotNone(load_csv_snapshot(self.sample_csv_file))
+        # and records the new modification time, so later loads skip the checksum
+        header = load_snapshot(self.sample_csv_file + CSV_SNAPSHOT_SUFFIX, keys=['header'])['header']
+        self.assertEqual(header['mtime_ns'], 0)
+
+        # Changed content invalidates the snapshot
+        with open(self.sample_csv_file, "w") as f:
+            f.write(self.sample_csv_data.replace('Spicules', 'Sunspots'))
+        self.assertIsNone(load_csv_snapshot(self.sample_csv_file))
+        self.assertEqual(read_and_format_csv(self.sample_csv_file)['target'][0], 'Sunspots')
+
+    def test_lazy_links(self):
+        with open(self.sample_csv_file, "a") as f:
+            f.write("2013-06-30 10:15:50,2013,6,30,10:15:50,CRISP,,,,,http://a.com/1.jpg;http://a.com/2.jpg,2,True\n")
+        expected = read_and_format_csv(self.sample_csv_file, use_snapshot=False)
+
+        for _ in range(2):  # cold and warm load
+            df = read_and_format_csv_lazy(self.sample_csv_file)
+            self.assertEqual(list(df.columns), list(expected.columns))
+            self.assertEqual(df['date_time'].tolist(), expected['date_time'].tolist())
+            self.assertEqual(df['links'].dtype, LazyLinkDtype())
+            self.assertEqual(df.at[1, 'links'], ['http://a.com/1.jpg', 'http://a.com/2.jpg'])
+            self.assertEqual(df.at[1, 'video_links'], [])
+            for col in ['links', 'video_links', 'image_links']:
+                self.assertEqual(df[col].tolist(), expected[col].tolist())
+
+        # Filtering and concatenation select rows without decoding them
+        subset = df[df['year'] == 2013].iloc[::-1]
+        self.assertEqual(subset['links'].dtype, LazyLinkDtype())
+        self.assertEqual(subset['links'].tolist(), expected['links'].tolist()[::-1])
+        combined = pd.concat([df, expected], ignore_index=True)
+        self.assertEqual(combined['links'].tolist(), expected['links'].tolist() * 2)
+
+    @unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed")
+    def test_lazy_links_round_trip(self):
+        expected = make_sample_dataframe()
+        encode_list_columns(expected.copy()).to_csv(self.sample_csv_file, index=False)
+        df = read_and_format_csv_lazy(self.sample_csv_file)
+
+        parquet_file = os.path.join(self.temp_dir.name, 'sample.parquet')
+        save_parquet(df, parquet_file)
+        self.assertEqual(read_and_format_parquet(parquet_file)['links'].tolist(), expected['links'].tolist())
+
+        catalog = build_catalog(df, os.path.join(self.temp_dir.name, 'catalog.db'))
+        try:
+            self.assertEqual(catalog.get_links(0, kind='video'), expected['video_links'][0])
+            self.assertEqual(catalog.connection.execute("SELECT COUNT(*) FROM links").fetchone()[0], 3)
+        finally:
+            catalog.close()
+
+
+class TestListCodec(unittest.TestCase):
+
+    def test_round_trip(self):
+        df = pd.DataFrame({'links': ['a;b', np.nan, 'c'], 'instruments': ['CRISP', 'CHROMIS;CRISP', np.nan]})
+        decode_list_columns(df)
+        self.assertEqual(df['links'].tolist(), [['a', 'b'], [], ['c']])
+        self.assertEqual(df['instruments'].tolist(), [['CRISP'], ['CHROMIS', 'CRISP'], []])
+
+        encode_list_columns(df)
+        self.assertEqual(df['links'].tolist(), ['a;b', '', 'c'])
+        self.assertEqual(df['instruments'].tolist(), ['CRISP', 'CHROMIS;CRISP', ''])
+
+    def test_nan_to_none(self):
+        self.assertEqual(list(nan_to_none(pd.Series(['x', np.nan, True]))), ['x', None, True])
+
+
+class TestTargetNormalization(unittest.TestCase):
+
+    def test_normalize_targets(self):
+        result = normalize_targets(['AR, quiet sun', 'SS', 'SOLAR, Class', np.nan])
+        self.assertEqual(list(result), ['Active Region, Quiet Sun', 'Sunspot', 'SOLAR, Class', None])
+
+    def test_get_target_token_lists(self):
+        result = get_target_token_lists(['AR, Light bridge, EB', 'Sunspot,  , Jets, sunspot', None])
+        self.assertEqual(list(result), [['Active Region', 'Light Bridge', 'Ellerman Bombs'],
+                                        ['Sunspot', 'Jets'], []])
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.temp_dir.name, 'data.snapshot')
+        self.data = {
+            'links': ['http://example.com/a.mp4', 'http://example.com/b.jpg'],
+            'df': pd.DataFrame({'x': np.arange(1000), 'y': np.linspace(0, 1, 1000), 'z': ['a'] * 1000}),
+        }
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        for compression in [None, 'zlib', 'lzma']:
+            save_snapshot(self.data, self.file_name, compression=compression, chunk_size=1000)
+            data = load_snapshot(self.file_name)
+            self.assertEqual(data['links'], self.data['links'])
+            pd.testing.assert_frame_equal(data['df'], self.data['df'])
+
+    def test_selective_load(self):
+        save_snapshot(self.data, self.file_name)
+        self.assertEqual(load_snapshot(self.file_name, keys=['links']), {'links': self.data['links']})
+
+    def test_pickle_functions(self):
+        array = np.arange(10.0)
+        save_pickle(array, self.file_name, compression='zlib')
+        loaded = load_pickle(self.file_name)
+        np.testing.assert_array_equal(loaded, array)
+        loaded[0] = 1.0  # out-of-band buffers are restored writable
+
+        save_pickle(self.data['links'], self.file_name)
+        self.assertEqual(load_pickle(self.file_name), self.data['links'])
+        with self.assertRaises(ValueError):
+            load_snapshot(self.file_name)
 
 
 class TestPreprocessAndSaveDataFrame(unittest.TestCase):
@@ -70,11 +222,12 @@ class TestPreprocessAndSaveDataFrame(unittest.TestCase):
         self.assertEqual(df_read['target'][1], 'Quiet Sun')
         self.assertEqual(df_read['target'][2], 'Sunspot')
         self.assertEqual(df_read['links'][0], 'a')
+        self.assertEqual(df_read['target_tokens'][3], 'Active Region')
         
         # Clean up
         os.remove(self.output_file)
 
-class TestReadAndFormatCSV(unittest.TestCase):
+class TestReadAndFormatCSVForQuery(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
@@ -104,5 +257,47 @@ class TestReadAndFormatCSV(unittest.TestCase):
         # Delete the temporary file
         os.remove(cls.temp_file.name)
 
+@unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed")
+class TestParquetStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.csv_file = os.path.join(self.temp_dir.name, 'sample.csv')
+        self.parquet_file = os.path.join(self.temp_dir.name, 'sample.parquet')
+        with open(self.csv_file, "w") as f:
+            f.write("""date_time,year,month,day,time,instruments,target,comments,video_links,image_links,links,num_links,polarimetry
+2022-07-01 09:46:53,2022,7,1,09:46:53,CRISP;   CHROMIS,"Active Region, Sunspot",AR13040,http://a.mp4,http://b.jpg,http://a.mp4;http://b.jpg,2,True
+2022-07-01 10:46:53,2022,7,1,10:46:53,CRISP,,,,,,0,False
+""")
+        self.df = read_and_format_csv(self.csv_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        save_parquet(self.df, self.parquet_file)
+        df = read_and_format_parquet(self.parquet_file)
+
+        self.assertEqual(list(df.columns), list(self.df.columns))
+        self.assertEqual(df['instruments'][0], ['CRISP', 'CHROMIS'])
+        self.assertEqual(df['links'][0], ['http://a.mp4', 'http://b.jpg'])
+        self.assertEqual(df['links'][1], [])
+        self.assertEqual(df['target'][0], 'Active Region, Sunspot')
+        self.assertIsNone(df['target'][1])
+        self.assertEqual(df['polarimetry'].tolist(), ['True', 'False'])
+        self.assertEqual(df['date_time'][0], pd.Timestamp('2022-07-01 09:46:53'))
+
+    def test_typed_columns_and_projection(self):
+        save_parquet(self.df, self.parquet_file)
+        df = read_parquet(self.parquet_file, columns=['date_time', 'target', 'polarimetry'])
+
+        self.assertEqual(list(df.columns), ['date_time', 'target', 'polarimetry'])
+        self.assertEqual(df['polarimetry'].dtype, bool)
+        self.assertEqual(df['target'].dtype, 'category')
+
+    def test_file_not_found(self):
+        self.assertEqual(read_parquet("nonexistent.parquet"), "Error: The specified file was not found.")
+
+
 if __name__ == '__main__':
     unittest.main()
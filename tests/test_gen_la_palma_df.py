@@ -2,8 +2,20 @@ import unittest
 import pandas as pd
 from datetime import datetime
 import os
+import tempfile
 
 from pipmag.gen_la_palma_df import load_or_fetch_links, preprocess_links, generate_dataframe, fix_duplicate_times, add_existing_and_new_dataframes
+from pipmag.gen_la_palma_df import parse_links, load_parse_cache, save_parse_cache, add_session_ids
+from pipmag.gen_la_palma_df import add_obs_ids, get_obs_id_index
+from pipmag.gen_la_palma_df import iter_media_links, generate_dataframe_chunked
+from pipmag.gen_la_palma_df import first_valid_per_group
+from pipmag.gen_la_palma_df import update_store, read_store_table, record_export, is_exported
+from pipmag.file_utils import preprocess_and_save_dataframe
+from pipmag.query_utils import QueryEngine
+from pipmag.journal_utils import AnnotationJournal
+from tests.helpers import make_sample_dataframe
+from pipmag import instrument_utils
+from pipmag import file_utils as fu
 
 class TestLaPalmaDataFrameFunctions(unittest.TestCase):
     def setUp(self):
@@ -97,12 +109,92 @@ class TestLaPalmaDataFrameFunctions(unittest.TestCase):
 
 
     def test_fix_duplicate_times(self):
-        # Call the function with some test input
-        # result = fix_duplicate_times(test_input)
-        # Perform some assertions based on what you expect
-        # self.assertEqual(result, ...)
-        # self.assertTrue(result, ...)
-        pass
+        # Two rows 30 s apart are merged, the third row 10 min later stays on its own
+        test_input = pd.DataFrame({
+            'date_time': pd.to_datetime(['2020-08-07 08:22:14', '2020-08-07 08:22:44', '2020-08-07 08:32:44']),
+            'year': [2020, 2020, 2020],
+            'month': [8, 8, 8],
+            'day': [7, 7, 7],
+            'time': ['08:22:14', '08:22:44', '08:32:44'],
+            'instruments': [['CRISP'], ['CHROMIS', 'CRISP'], None],
+            'target': [None, 'Sunspot', None],
+            'comments': [None, None, None],
+            'video_links': [['a.mp4'], ['b.mp4', 'a.mp4'], []],
+            'image_links': [[], ['c.jpg'], ['d.jpg']],
+            'links': [['a.mp4'], ['b.mp4', 'a.mp4', 'c.jpg'], ['d.jpg']],
+            'num_links': [1, 3, 1],
+            'polarimetry': ['False', 'True', 'False']
+        })
+
+        result = fix_duplicate_times(test_input)
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result.loc[0, 'date_time'], pd.Timestamp('2020-08-07 08:22:14'))
+        self.assertEqual(result.loc[0, 'instruments'], ['CRISP', 'CHROMIS'])
+        self.assertEqual(result.loc[0, 'target'], 'Sunspot')
+        self.assertEqual(result.loc[0, 'links'], ['a.mp4', 'b.mp4', 'c.jpg'])
+        self.assertEqual(result.loc[0, 'video_links'], ['a.mp4', 'b.mp4'])
+        self.assertEqual(result.loc[0, 'num_links'], 3)
+        self.assertEqual(result.loc[0, 'polarimetry'], 'True')
+        self.assertEqual(result.loc[1, 'instruments'], [])
+        self.assertEqual(result.loc[1, 'polarimetry'], 'False')
+
+    def test_first_valid_per_group(self):
+        # Every group repeats, so the result does not depend on the order of repeated assignments
+        values = [None, 'a', 'b', float('nan'), 'c', None, 'd', 'e']
+        group_ids = pd.Series([0, 0, 0, 1, 1, 2, 3, 3]).values
+        result = first_valid_per_group(values, group_ids, 5)
+        self.assertEqual(result.tolist(), ['a', 'c', None, 'd', None])
+
+    def test_add_session_ids(self):
+        test_input = pd.DataFrame({
+            'date_time': pd.to_datetime(['2020-08-07 12:00:00', '2020-08-07 08:00:30', '2020-08-07 08:00:00',
+                                         '2020-08-08 08:00:00']),
+            'target': ['Flare', 'Sunspot', 'Sunspot', 'Sunspot']
+        })
+
+        result = add_session_ids(test_input, thresholds={'scan_id': 60, 'run_id': 3600, 'day_id': None})
+        self.assertEqual(result['scan_id'].tolist(), [1, 0, 0, 2])
+        self.assertEqual(result['run_id'].tolist(), [1, 0, 0, 2])
+        self.assertEqual(result['day_id'].tolist(), [0, 0, 0, 1])
+
+        result = add_session_ids(test_input, thresholds={'day_id': None}, by=['target'])
+        self.assertEqual(result['day_id'].tolist(), [1, 0, 0, 2])
+
+    def test_add_obs_ids(self):
+        base_url = 'http://tsih3.uio.no/lapalma/2020/2020-08-07//'
+        test_input = pd.DataFrame({
+            'date_time': pd.to_datetime(['2020-08-07 08:22:14', '2020-08-07 09:40:02']),
+            'links': [[base_url + 'wb_6563_2020-08-07T08:22:14_histoopt.mp4', base_url + 'crisp_082214.jpg'],
+                      [base_url + 'chromis_cak_094002.jpg']]
+        })
+
+        result = add_obs_ids(test_input)
+        self.assertEqual(list(result.columns), ['obs_id', 'date_time', 'links'])
+        self.assertTrue((result['obs_id'] >= 0).all())
+
+        # The ids do not depend on the row order, the link order or the variants present
+        shuffled = test_input.iloc[::-1].copy()
+        shuffled.at[0, 'links'] = [base_url + 'crisp_082214.jpg', base_url + 'wb_6563_2020-08-07T08:22:14_minmax.mp4']
+        self.assertEqual(add_obs_ids(shuffled)['obs_id'].tolist(), result['obs_id'].tolist()[::-1])
+
+        # Adding a variant or another media item to an observation keeps its id
+        extended = test_input.copy()
+        extended.at[0, 'links'] = test_input.at[0, 'links'] + [base_url + 'wb_6563_2020-08-07T08:22:14.mov',
+                                                               base_url + 'aaa_082214.jpg']
+        self.assertEqual(add_obs_ids(extended)['obs_id'].tolist(), result['obs_id'].tolist())
+
+        index = get_obs_id_index(result)
+        self.assertEqual(index[result.at[1, 'obs_id']], 1)
+
+        # Rows that share a start time are told apart by their media items
+        same_time = pd.concat([test_input, test_input.iloc[[0]].assign(links=[[base_url + 'ibis_082214.jpg']])])
+        obs_ids = add_obs_ids(same_time)['obs_id'].tolist()
+        self.assertEqual(obs_ids[:2], result['obs_id'].tolist())
+        self.assertEqual(len(set(obs_ids)), 3)
+
+        with self.assertRaises(ValueError):
+            add_obs_ids(pd.concat([test_input, test_input]))
 
     def test_add_existing_and_new_dataframes(self):
         # Call the function with some test input
@@ -112,6 +204,158 @@ class TestLaPalmaDataFrameFunctions(unittest.TestCase):
         # self.assertTrue(result, ...)
         pass
 
+class TestUpdateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store_dir = os.path.join(self.temp_dir.name, 'store')
+        self.csv_file = os.path.join(self.temp_dir.name, 'la_palma_obs_data.csv')
+        self.df = add_obs_ids(make_sample_dataframe())
+        preprocess_and_save_dataframe(self.df.iloc[:1].copy(), self.csv_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_update_store(self):
+        self.assertEqual(len(update_store(self.df, self.store_dir, self.csv_file)), 1)
+        self.assertFalse(is_exported(self.store_dir))
+
+        # Export the table, after which nothing changes until new observations or CSV edits arrive
+        preprocess_and_save_dataframe(read_store_table(self.store_dir), self.csv_file)
+        record_export(self.store_dir, self.csv_file)
+        self.assertTrue(is_exported(self.store_dir))
+        self.assertEqual(update_store(self.df, self.store_dir, self.csv_file), [])
+        self.assertTrue(is_exported(self.store_dir))
+
+        # Annotations saved to the CSV file are merged into the store, not overwritten by it
+        edited = read_store_table(self.store_dir)
+        edited.at[1, 'comments'] = 'Good seeing'
+        preprocess_and_save_dataframe(edited, self.csv_file)
+        self.assertEqual(len(update_store(self.df, self.store_dir, self.csv_file)), 1)
+        self.assertFalse(is_exported(self.store_dir))
+        self.assertEqual(read_store_table(self.store_dir)['comments'].tolist(), [None, 'Good seeing'])
+
+    def test_journal_edits(self):
+        update_store(self.df, self.store_dir, self.csv_file)
+        journal = AnnotationJournal(os.path.join(self.temp_dir.name, 'annotations.jsonl'))
+        journal.record(self.df, 1, 'comments', 'Clouds')
+
+        self.assertEqual(update_store(self.df, self.store_dir, self.csv_file, journal),
+                         [str(self.df.at[1, 'obs_id'])])
+        self.assertEqual(read_store_table(self.store_dir).at[1, 'comments'], 'Clouds')
+        self.assertEqual(update_store(self.df, self.store_dir, self.csv_file, journal), [])
+
+    def test_one_edit_writes_one_row(self):
+        update_store(self.df, self.store_dir, self.csv_file)
+
+        # Export as main() does, with the derived session id and target token columns
+        exported = fu.add_target_tokens(add_session_ids(read_store_table(self.store_dir)))
+        fu.encode_list_columns(exported).to_csv(self.csv_file, index=False)
+        record_export(self.store_dir, self.csv_file)
+
+        edited = pd.read_csv(self.csv_file)
+        edited.loc[0, 'comments'] = 'Good seeing'
+        edited.to_csv(self.csv_file, index=False)
+        self.assertEqual(update_store(self.df, self.store_dir, self.csv_file), [str(self.df.at[0, 'obs_id'])])
+
+    def test_changed_upstream_rows_keep_annotations(self):
+        update_store(self.df, self.store_dir, self.csv_file)
+        edited = read_store_table(self.store_dir)
+        edited.at[1, 'target'] = 'Quiet Sun'
+        preprocess_and_save_dataframe(edited, self.csv_file)
+        update_store(self.df, self.store_dir, self.csv_file)
+
+        # Upstream adds a link to the second observation, which has no target there
+        changed = self.df.copy()
+        changed.at[1, 'links'] = changed.at[1, 'links'] + ['http://tsih3.uio.no/lapalma/2020/2020-08-07//new.jpg']
+        changed.at[1, 'image_links'] = changed.at[1, 'image_links'] + [changed.at[1, 'links'][-1]]
+        self.assertEqual(update_store(changed, self.store_dir, self.csv_file), [str(self.df.at[1, 'obs_id'])])
+        stored = read_store_table(self.store_dir)
+        self.assertEqual(stored.at[1, 'links'], changed.at[1, 'links'])
+        self.assertEqual(stored.at[1, 'target'], 'Quiet Sun')
+
+
+    def test_engine_follows_the_store(self):
+        update_store(self.df.iloc[:1], self.store_dir, self.csv_file)
+        engine = QueryEngine(read_store_table(self.store_dir))
+        journal = AnnotationJournal(os.path.join(self.temp_dir.name, 'annotations.jsonl'))
+        journal.record(self.df, 0, 'target', 'Flare')
+
+        # The edited row is refreshed in place and the new observation is appended
+        update_store(self.df, self.store_dir, self.csv_file, journal, engine=engine)
+        self.assertEqual(len(engine), 2)
+        self.assertEqual(engine.query(targets=['Flare']).to_frame()['obs_id'].astype(str).tolist(),
+                         [str(self.df.at[0, 'obs_id'])])
+        self.assertEqual(engine.query(time_range=('09:00', '10:00')).positions.tolist(), [1])
+
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.temp_dir.name, 'parse_cache.snapshot')
+        self.links = ['http://tsih3.uio.no/lapalma/2020/2020-08-07//crisp_blos_2020-08-07T08:22:14.mp4',
+                      'http://tsih3.uio.no/lapalma/2020/2020-08-07//chromis_cak_2020-08-07_082214.jpg',
+                      'http://invalid_link']
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_parse_links(self):
+        records = parse_links(self.links)
+        self.assertEqual(records[0].date_time, datetime(2020, 8, 7, 8, 22, 14))
+        self.assertEqual(records[0].instruments, ('CRISP',))
+        self.assertTrue(records[0].polarimetry)
+        self.assertEqual(records[0].kind, 'video')
+        self.assertEqual(records[1].instruments, ('CHROMIS',))
+        self.assertEqual(records[1].extension, 'jpg')
+        self.assertEqual(records[1].kind, 'image')
+        self.assertIsNone(records[2])
+
+    def test_cache_round_trip(self):
+        parse_cache = load_parse_cache(self.cache_file)
+        parse_links(self.links, parse_cache)
+        save_parse_cache(parse_cache, self.cache_file)
+
+        reloaded = load_parse_cache(self.cache_file)
+        self.assertEqual(reloaded['records'], parse_cache['records'])
+
+    def test_cache_invalidated_when_keywords_change(self):
+        parse_cache = load_parse_cache(self.cache_file)
+        parse_links(self.links, parse_cache)
+        save_parse_cache(parse_cache, self.cache_file)
+
+        original_keywords = instrument_utils.INSTRUMENT_KEYWORDS
+        instrument_utils.INSTRUMENT_KEYWORDS = dict(original_keywords, HMI=['hmi'])
+        try:
+            self.assertEqual(load_parse_cache(self.cache_file)['records'], {})
+        finally:
+            instrument_utils.INSTRUMENT_KEYWORDS = original_keywords
+
+    def test_generate_dataframe_with_cache(self):
+        parse_cache = load_parse_cache(self.cache_file)
+        dates, links = preprocess_links(self.links, parse_cache)
+        self.assertEqual(len(parse_cache['records']), 3)
+        df = generate_dataframe(dates, links, parse_cache)
+        self.assertEqual(df.loc[0, 'instruments'], ['CRISP', 'CHROMIS'])
+        self.assertEqual(df.loc[0, 'polarimetry'], 'True')
+        self.assertEqual(df.loc[0, 'video_links'], [self.links[0]])
+        self.assertEqual(df.loc[0, 'image_links'], [self.links[1]])
+        self.assertEqual(df.loc[0, 'num_links'], 2)
+
+    def test_generate_dataframe_chunked(self):
+        links_file = os.path.join(self.temp_dir.name, 'links.csv')
+        links = self.links + ['http://tsih3.uio.no/lapalma/2020/2020-08-07//crisp_2020-08-07T09:40:02.mp4']
+        pd.DataFrame(links[::-1], columns=['Links']).to_csv(links_file, index=False)
+        self.assertEqual([len(chunk) for chunk in iter_media_links(chunk_size=3, file_path=links_file)], [3, 1])
+
+        # The observation at 08:22:14 is split over both chunks
+        df = generate_dataframe_chunked(iter_media_links(chunk_size=3, file_path=links_file))
+        expected = generate_dataframe(*preprocess_links(links[::-1]))
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertEqual(df.loc[0, 'instruments'], ['CRISP', 'CHROMIS'])
+        self.assertEqual(df.loc[0, 'num_links'], 2)
+
+
 class TestCSVDataFrame(unittest.TestCase):
     def setUp(self):
         if os.path.exists('data/la_palma_obs_data.csv'):
@@ -0,0 +1,91 @@
+import unittest
+import os
+import tempfile
+
+from pipmag.journal_utils import AnnotationJournal, JOURNAL_BASE_SUFFIX
+from pipmag.selector_utils import DataUpdater
+from pipmag.query_utils import QueryEngine
+from tests.helpers import make_sample_dataframe
+
+
+class TestAnnotationJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.journal = AnnotationJournal(os.path.join(self.temp_dir.name, 'annotations.jsonl'))
+        self.df = make_sample_dataframe()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_record_and_replay(self):
+        self.journal.record(self.df, 1, 'target', 'Quiet Sun')
+        self.journal.record(self.df, 1, 'target', 'Pores')
+        self.journal.record(self.df, 0, 'instruments', ['CRISP'])
+
+        # A truncated last line from an interrupted write is skipped
+        with open(self.journal.file_path, 'a') as f:
+            f.write('{"timestamp": "2')
+
+        df = self.journal.replay(self.df)
+        self.assertEqual(df.at[1, 'target'], 'Pores')
+        self.assertEqual(df.at[0, 'instruments'], ['CRISP'])
+        self.assertEqual(self.df.at[1, 'target'], None)
+
+        # Edits are keyed by date_time, so they apply to a reordered table
+        df = self.journal.replay(self.df.iloc[::-1].reset_index(drop=True))
+        self.assertEqual(df.at[0, 'target'], 'Pores')
+
+    def test_obs_id_keys(self):
+        self.df['obs_id'] = [11, 12]
+        self.journal.record(self.df, 0, 'comments', 'Good seeing')
+        self.df['date_time'] = self.df['date_time'].iloc[::-1].values
+        self.assertEqual(self.journal.replay(self.df).at[0, 'comments'], 'Good seeing')
+
+    def test_compact(self):
+        for target in ['Flare', 'Sunspot', 'Pores']:
+            self.journal.record(self.df, 0, 'target', target)
+        self.journal.record(self.df, 1, 'comments', 'Clouds')
+
+        self.assertEqual(self.journal.compact(), 2)
+        self.assertFalse(os.path.exists(self.journal.file_path))
+        self.assertTrue(os.path.exists(self.journal.file_path + JOURNAL_BASE_SUFFIX))
+
+        self.journal.record(self.df, 0, 'target', 'Filament')
+        df = self.journal.replay(self.df)
+        self.assertEqual(df.at[0, 'target'], 'Filament')
+        self.assertEqual(df.at[1, 'comments'], 'Clouds')
+
+    def test_data_updater(self):
+        updater = DataUpdater(self.df, ['target', 'comments'], journal=self.journal)
+        updater.index_text.value = '1'
+        updater.value_texts['target'].value = 'Flare'
+        updater.update_values(None)
+
+        self.assertEqual(len(self.journal.read_edits()), 2)
+        self.assertEqual(self.journal.replay(make_sample_dataframe()).at[1, 'target'], 'Flare')
+
+    def test_query_reflects_edit(self):
+        engine = QueryEngine(self.df)
+        self.assertEqual(len(engine.query(targets=['Flare'])), 0)
+        updater = DataUpdater(self.df, ['target', 'comments'], journal=self.journal, engine=engine)
+        updater.index_text.value = '1'
+        updater.value_texts['target'].value = 'Flare'
+        updater.update_values(None)
+        self.assertEqual(engine.query(targets=['Flare']).positions.tolist(), [1])
+
+        # Edits replayed from the journal by a new widget are indexed too
+        df = make_sample_dataframe()
+        engine = QueryEngine(df)
+        DataUpdater(df, ['target', 'comments'], journal=self.journal, engine=engine)
+        self.assertEqual(engine.query(targets=['Flare']).positions.tolist(), [1])
+
+    def test_widgets_start_from_the_journal(self):
+        self.journal.record(self.df, 1, 'target', 'Flare')
+        df = make_sample_dataframe()
+        DataUpdater(df, ['target', 'comments'], journal=self.journal)
+        self.assertEqual(df.at[1, 'target'], 'Flare')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from pipmag.la_palma_utils import get_media_variants, get_canonical_links
+
+
+class TestMediaVariants(unittest.TestCase):
+
+    def setUp(self):
+        self.base_url = 'http://tsih3.uio.no/lapalma/2014/2014-09-09//'
+        self.links = [
+            self.base_url + 'wb_6563_2014-09-09T07:59:43_histoopt.mp4',
+            self.base_url + 'wb_6563_2014-09-09T07:59:43_minmax.mp4',
+            self.base_url + 'ha+ca+sji_6pan_2014-09-09_20140909_075943_3860256865_081340.mp4',
+            self.base_url + 'ha+ca+sji_6pan_2014-09-09_20140909_075943_3860256865.mp4',
+            self.base_url + 'Crisp-T_quick_2014-09-09_07:59:43.mov',
+            self.base_url + 'Crisp-T_quick_2014-09-09_07:59:43.mp4',
+            self.base_url + 'halpha_SDO_8pan_2014-09-09_075943.mp4'
+        ]
+
+    def test_get_media_variants(self):
+        media_variants = get_media_variants(self.links)
+
+        self.assertEqual(len(media_variants), 4)
+        scaling = media_variants[self.base_url + 'wb_6563_2014-09-09T07:59:43']
+        self.assertEqual([variant for variant, _ in scaling], ['histoopt.mp4', 'minmax.mp4'])
+        continuation = media_variants[self.base_url + 'ha+ca+sji_6pan_2014-09-09_20140909_075943_3860256865']
+        self.assertEqual([variant for variant, _ in continuation], ['mp4', '081340.mp4'])
+        formats = media_variants[self.base_url + 'Crisp-T_quick_2014-09-09_07:59:43']
+        self.assertEqual([variant for variant, _ in formats], ['mp4', 'mov'])
+        # A trailing time stamp without a matching base link is not a continuation
+        self.assertIn(self.base_url + 'halpha_SDO_8pan_2014-09-09_075943', media_variants)
+
+    def test_get_canonical_links(self):
+        canonical_links = get_canonical_links(self.links)
+
+        self.assertEqual(canonical_links, [self.links[0], self.links[3], self.links[5], self.links[6]])
+
+
+if __name__ == '__main__':
+    unittest.main()
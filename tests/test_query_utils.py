@@ -0,0 +1,179 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from pipmag.query_utils import QueryEngine, InvertedIndex, query, normalize_filters, narrows, \
+    get_facet_options
+from pipmag.file_utils import to_compact_layout
+from tests.helpers import make_sample_dataframe
+
+
+class TestInvertedIndex(unittest.TestCase):
+
+    def test_set_operations(self):
+        index = InvertedIndex([['CRISP'], ['CRISP', 'CHROMIS'], [], ['CHROMIS', 'IRIS']])
+        self.assertEqual(index.keys(), ['CHROMIS', 'CRISP', 'IRIS'])
+        self.assertEqual(index.intersection(['CRISP', 'CHROMIS']).tolist(), [1])
+        self.assertEqual(index.union(['CRISP', 'IRIS']).tolist(), [0, 1, 3])
+        self.assertEqual(index.intersection(['CRISP', 'HMI']).tolist(), [])
+        self.assertEqual(InvertedIndex.contains(index.get('CHROMIS'), np.arange(4)).tolist(),
+                         [False, True, False, True])
+
+    def test_count(self):
+        index = InvertedIndex([['CRISP'], ['CRISP', 'CHROMIS'], ['CHROMIS']])
+        self.assertEqual(index.count(np.array([True, True, False])), {'CHROMIS': 1, 'CRISP': 2})
+        index.add([['IRIS']], start=3)
+        self.assertEqual(index.count(np.array([False, False, True, True])), {'CHROMIS': 1, 'IRIS': 1})
+
+    def test_incremental_updates(self):
+        index = InvertedIndex([['CRISP'], ['CHROMIS']])
+        index.add([['CRISP'], ['IRIS']], start=2)
+        self.assertEqual(index.get('CRISP').tolist(), [0, 2])
+        index.remove([0], [['CRISP']])
+        index.add([['CHROMIS']], start=0)
+        self.assertEqual(index.get('CRISP').tolist(), [2])
+        self.assertEqual(index.get('CHROMIS').tolist(), [0, 1])
+
+
+class TestQueryEngine(unittest.TestCase):
+
+    def setUp(self):
+        df = make_sample_dataframe()
+        extra = df.iloc[[0]].copy()
+        extra['date_time'] = pd.Timestamp('2021-05-02 13:00:00')
+        extra['instruments'] = [['CRISP', 'IRIS']]
+        extra['target'] = 'AR, Light bridge'
+        extra['polarimetry'] = 'False'
+        self.df = pd.concat([df, extra], ignore_index=True)
+        self.engine = QueryEngine(self.df)
+
+    def test_instruments(self):
+        self.assertEqual(self.engine.query(instruments=['CRISP']).positions.tolist(), [0, 2])
+        self.assertEqual(self.engine.query(instruments=['CRISP', 'CHROMIS']).positions.tolist(), [0])
+        result = self.engine.query(instruments=['CHROMIS', 'IRIS'], all_instruments=False)
+        self.assertEqual(result.positions.tolist(), [0, 1, 2])
+
+    def test_dates_times_and_polarimetry(self):
+        self.assertEqual(len(self.engine.query(date_range=('2021-01-01', None))), 1)
+        self.assertEqual(len(self.engine.query(date_range=(None, '2020-08-07'))), 2)
+        self.assertEqual(self.engine.query(time_range=('09:00', '14:00')).positions.tolist(), [1, 2])
+        self.assertEqual(self.engine.query(polarimetry=True).positions.tolist(), [0])
+        self.assertEqual(len(self.engine.query(polarimetry='All')), 3)
+
+    def test_sorted_time_index(self):
+        self.assertEqual(self.engine.get_date_positions('2020-08-07', '2020-08-07').tolist(), [0, 1])
+        self.assertEqual(self.engine.get_date_positions('2020-08-08', None).tolist(), [2])
+        self.assertEqual(self.engine.get_date_positions('2022-01-01', '2021-01-01').tolist(), [])
+
+        # Rows out of time order are returned by position
+        engine = QueryEngine(self.df.iloc[::-1].reset_index(drop=True))
+        self.assertEqual(engine.get_date_positions(None, '2020-12-31').tolist(), [1, 2])
+        self.assertEqual(engine.query(date_range=('2020-08-07', None), time_range=('09:00', None))
+                         .positions.tolist(), [0, 1])
+
+        engine = QueryEngine(self.df)
+        engine.append(self.df.iloc[:1])
+        self.assertFalse(engine.is_time_ordered)
+        self.assertEqual(engine.get_date_positions(None, '2020-12-31').tolist(), [0, 1, 3])
+
+    def test_time_window_wrapping_midnight(self):
+        self.assertEqual(self.engine.query(time_range=('13:00', '09:00')).positions.tolist(), [0, 2])
+        self.assertEqual(self.engine.query(time_range=('23:00', '01:00')).positions.tolist(), [])
+
+    def test_targets(self):
+        self.assertEqual(self.engine.query(targets=['Active Region']).positions.tolist(), [2])
+        self.assertEqual(self.engine.query(targets=['light bridge', 'Sunspot']).positions.tolist(), [0, 2])
+        self.assertEqual(len(self.engine.query(targets=['', 'None'])), 3)
+        self.assertEqual(self.engine.get_targets(), ['Active Region', 'Light Bridge', 'Sunspot'])
+
+    def test_result_view(self):
+        result = self.engine.query(instruments=['CRISP'])
+        self.assertEqual(result.get_targets(), ['Active Region', 'Light Bridge', 'Sunspot'])
+        refined = result.refine(date_range=('2021-01-01', '2021-12-31'))
+        self.assertEqual(refined.positions.tolist(), [2])
+        pd.testing.assert_frame_equal(refined.to_frame(), self.df.iloc[[2]])
+        self.assertEqual(refined[0]['target'], 'AR, Light bridge')
+
+    def test_narrows(self):
+        spec = normalize_filters(instruments=['CRISP'], date_range=('2020-01-01', '2020-12-31'), targets=['Sunspot'])
+        self.assertEqual(spec, normalize_filters(instruments={'CRISP'}, date_range=(pd.Timestamp('2020-01-01'),
+                                                 '2020-12-31 10:00'), targets=['sunspot'], polarimetry='All'))
+        wider = normalize_filters(date_range=('2020-01-01', None), targets=['Sunspot', 'Flare'])
+        self.assertTrue(narrows(spec, wider))
+        self.assertFalse(narrows(wider, spec))
+        self.assertTrue(narrows(normalize_filters(instruments=['CRISP', 'IRIS']),
+                                normalize_filters(instruments=['CRISP'])))
+        self.assertTrue(narrows(normalize_filters(instruments=['IRIS']),
+                                normalize_filters(instruments=['CRISP', 'IRIS'], all_instruments=False)))
+        self.assertFalse(narrows(normalize_filters(instruments=['CRISP'], all_instruments=False),
+                                 normalize_filters(instruments=['CRISP', 'IRIS'])))
+        self.assertTrue(narrows(normalize_filters(time_range=('10:00', '11:00')),
+                                normalize_filters(time_range=('09:00', None))))
+        self.assertFalse(narrows(normalize_filters(time_range=('23:00', '01:00')),
+                                 normalize_filters(time_range=('09:00', None))))
+
+    def test_result_cache(self):
+        engine = QueryEngine(self.df, cache_size=2)
+        result = engine.query(instruments=['CRISP'])
+        self.assertIs(engine.query(instruments=['CRISP']).positions, result.positions)
+
+        # A narrowing query is evaluated on the cached rows only
+        spec = normalize_filters(instruments=['CRISP'])
+        engine.cache[spec] = np.array([2])
+        self.assertEqual(engine.query(instruments=['CRISP'], polarimetry=False).positions.tolist(), [2])
+        self.assertEqual(engine.query(instruments=['CRISP'], targets=['Sunspot']).positions.tolist(), [])
+        self.assertNotIn(spec, engine.cache)
+        self.assertEqual(engine.query(instruments=['CRISP']).positions.tolist(), [0, 2])
+
+        engine.append(self.df.iloc[2:])
+        self.assertEqual(len(engine.cache), 0)
+        self.assertEqual(engine.query(instruments=['CRISP']).positions.tolist(), [0, 2, 3])
+
+    def test_facets(self):
+        facets = self.engine.get_facets()
+        self.assertEqual(facets['instruments'], {'CRISP': 2, 'CHROMIS': 2, 'IRIS': 1})
+        self.assertEqual(facets['targets'], {'Active Region': 1, 'Light Bridge': 1, 'Sunspot': 1})
+        self.assertEqual(facets['years'], {2020: 2, 2021: 1})
+        self.assertEqual(facets['months'], {'2020-08': 2, '2021-05': 1})
+        self.assertEqual(facets['polarimetry'], {True: 1, False: 2})
+
+        result = self.engine.query(instruments=['CRISP'])
+        self.assertEqual(result.get_facets(['targets', 'polarimetry']),
+                         {'targets': {'Active Region': 1, 'Light Bridge': 1, 'Sunspot': 1},
+                          'polarimetry': {True: 1, False: 1}})
+        self.assertEqual(get_facet_options(result.get_facets(['targets'])['targets'])[-1], ('Sunspot (1)', 'Sunspot'))
+        self.assertEqual(self.engine.query(date_range=('2030-01-01', None)).get_facets()['instruments'], {})
+
+    def test_append_and_refresh_rows(self):
+        engine = QueryEngine(self.df.iloc[:2].reset_index(drop=True))
+        engine.append(self.df.iloc[2:])
+        self.assertEqual(engine.get_date_positions('2021-01-01').tolist(), [2])
+        np.testing.assert_array_equal(engine.query(targets=['Light Bridge']).positions, [2])
+        self.assertEqual(engine.query(instruments=['IRIS']).positions.tolist(), [2])
+
+        engine.df.at[0, 'target'] = 'Flare'
+        engine.df.at[0, 'instruments'] = ['IRIS']
+        engine.refresh_rows([0])
+        self.assertEqual(engine.query(targets=['Sunspot']).positions.tolist(), [])
+        self.assertEqual(engine.query(targets=['Flare']).positions.tolist(), [0])
+        self.assertEqual(engine.query(instruments=['IRIS']).positions.tolist(), [0, 2])
+        self.assertEqual(engine.query(instruments=['CRISP']).positions.tolist(), [2])
+        self.assertEqual(engine.get_facets(facets=['targets'])['targets'],
+                         {'Active Region': 1, 'Flare': 1, 'Light Bridge': 1})
+
+    def test_layouts(self):
+        filters = {'instruments': ['CRISP'], 'time_range': ('08:00', '14:00'), 'targets': ['Sunspot']}
+        expected = self.engine.query(**filters).positions
+        for df in [to_compact_layout(self.df), self.df.assign(
+                instruments=[';'.join(x) for x in self.df['instruments']],
+                target=self.df['target'].fillna('None'))]:
+            np.testing.assert_array_equal(query(df, **filters).positions, expected)
+
+    def test_package_entry_point(self):
+        import pipmag
+        self.assertIs(pipmag.query, query)
+        self.assertEqual(pipmag.query(self.df, instruments=['IRIS']).positions.tolist(), [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
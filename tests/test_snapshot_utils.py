@@ -0,0 +1,73 @@
+import unittest
+import os
+import tempfile
+import pandas as pd
+
+from pipmag.file_utils import get_latest_file
+from pipmag.snapshot_utils import SnapshotStore
+from tests.helpers import make_sample_dataframe
+
+
+class TestSnapshotStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, 'versions')
+        df = make_sample_dataframe()
+        later = df.iloc[[1]].copy()
+        later['date_time'] = pd.to_datetime(['2021-03-02 10:00:00'])
+        later['year'], later['month'], later['day'], later['time'] = 2021, 3, 2, '10:00:00'
+        self.df = pd.concat([df, later], ignore_index=True)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_latest_file(self):
+        pattern = os.path.join(self.temp_dir.name, '*.csv')
+        self.assertIsNone(get_latest_file(pattern, store_dir=self.directory))
+        SnapshotStore(self.directory).commit(self.df)
+        self.df.at[2, 'comments'] = 'Clouds'
+        store = SnapshotStore(self.directory)
+        store.commit(self.df)
+        self.assertEqual(get_latest_file(pattern, store_dir=self.directory), store.get_path(2))
+
+    def test_commit_and_latest(self):
+        store = SnapshotStore(self.directory)
+        self.assertIsNone(store.latest())
+
+        first = store.commit(self.df)
+        self.assertEqual((first['version'], first['parent'], first['rows']), (1, None, 3))
+        self.assertEqual(store.commit(self.df), first)
+
+        self.df.at[2, 'comments'] = 'Clouds'
+        second = store.commit(self.df)
+        self.assertEqual((second['version'], second['parent']), (2, 1))
+        self.assertEqual(SnapshotStore(self.directory).latest(), second)
+
+        # The unchanged 2020 partition is shared, the changed 2021 partition is not
+        self.assertTrue(os.path.samefile(os.path.join(store.get_path(1), 'year=2020.csv'),
+                                         os.path.join(store.get_path(2), 'year=2020.csv')))
+        self.assertFalse(os.path.samefile(os.path.join(store.get_path(1), 'year=2021.csv'),
+                                          os.path.join(store.get_path(2), 'year=2021.csv')))
+
+        self.assertEqual(store.read(1)['comments'].tolist(), [None, None, None])
+        self.assertEqual(store.read(start_date='2021-01-01')['comments'].tolist(), ['Clouds'])
+
+    def test_prune(self):
+        store = SnapshotStore(self.directory, keep_last=2)
+        for comment in ['a', 'b', 'c']:
+            self.df.at[0, 'comments'] = comment
+            store.commit(self.df)
+
+        self.assertEqual(sorted(store.manifest['versions']), ['2', '3'])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'versions', 'v000001')))
+        self.assertEqual(store.read(2)['comments'][0], 'b')
+
+        self.assertEqual(store.prune(max_age_days=-1), [2])
+        self.assertEqual(store.latest()['version'], 3)
+        with self.assertRaises(KeyError):
+            store.get_path(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
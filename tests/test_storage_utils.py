@@ -0,0 +1,87 @@
+import unittest
+import os
+import tempfile
+import pandas as pd
+
+from pipmag.storage_utils import normalize_observations, denormalize_observations
+from pipmag.storage_utils import write_partitioned, read_partitioned, update_partitions, load_partition_manifest
+from tests.helpers import make_sample_dataframe
+
+class TestNormalizedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.df = make_sample_dataframe()
+
+    def test_normalize_observations(self):
+        observations, links = normalize_observations(self.df)
+
+        self.assertNotIn('links', observations.columns)
+        self.assertEqual(observations['obs_id'].tolist(), [0, 1])
+        self.assertEqual(links['obs_id'].tolist(), [0, 0, 1])
+        self.assertEqual(links['kind'].tolist(), ['video', 'image', 'image'])
+        self.assertEqual(links['prefix'].cat.categories.tolist(), ['http://tsih3.uio.no/lapalma/2020/2020-08-07//'])
+        self.assertEqual(links['relative_path'][0], 'crisp_blos_082214.mp4')
+        self.assertEqual(links['instrument_mask'].tolist(), [1, 2, 2])
+
+    def test_denormalize_observations(self):
+        df = denormalize_observations(*normalize_observations(self.df))
+
+        for col in ['links', 'video_links', 'image_links']:
+            self.assertEqual(df[col].tolist(), self.df[col].tolist())
+
+    def test_missing_link(self):
+        self.df.at[1, 'video_links'] = ['http://elsewhere/movie.mp4']
+        with self.assertRaises(ValueError):
+            normalize_observations(self.df)
+
+
+class TestPartitionedDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, 'dataset')
+        df = make_sample_dataframe()
+        later = df.iloc[[1]].copy()
+        later['date_time'] = pd.to_datetime(['2021-03-02 10:00:00'])
+        later['year'], later['month'], later['day'], later['time'] = 2021, 3, 2, '10:00:00'
+        self.df = pd.concat([df, later], ignore_index=True)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_write_only_changed_partitions(self):
+        self.assertEqual(write_partitioned(self.df, self.directory), [2020, 2021])
+        self.assertEqual(write_partitioned(self.df, self.directory), [])
+
+        self.df.at[2, 'comments'] = 'Seeing was poor'
+        self.assertEqual(write_partitioned(self.df, self.directory), [2021])
+        self.assertEqual(write_partitioned(self.df.iloc[:2], self.directory), [2021])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'year=2021.csv')))
+
+        manifest = load_partition_manifest(self.directory)
+        self.assertEqual(list(manifest['partitions']), ['2020'])
+        self.assertEqual(manifest['partitions']['2020']['instruments'], ['CHROMIS', 'CRISP'])
+        self.assertEqual(manifest['partitions']['2020']['rows'], 2)
+
+    def test_read_partitioned(self):
+        write_partitioned(self.df, self.directory)
+        os.remove(os.path.join(self.directory, 'year=2020.csv'))
+
+        # Only the 2021 partition overlaps the range, so the missing 2020 file is never opened
+        df = read_partitioned(self.directory, start_date='2021-01-01', end_date='2021-03-02')
+        self.assertEqual(df['date_time'].tolist(), [pd.Timestamp('2021-03-02 10:00:00')])
+        self.assertEqual(df.at[0, 'image_links'], self.df.at[2, 'image_links'])
+        self.assertTrue(read_partitioned(self.directory, start_date='2021-03-03').empty)
+        self.assertTrue(read_partitioned(self.temp_dir.name).startswith('Error'))
+
+    def test_update_partitions(self):
+        write_partitioned(self.df.iloc[:2], self.directory)
+        self.assertEqual(update_partitions(self.df.iloc[1:], self.directory), [2021])
+
+        df = read_partitioned(self.directory)
+        self.assertEqual(df['date_time'].tolist(), self.df['date_time'].tolist())
+        self.assertEqual(df['links'].tolist(), self.df['links'].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+import pandas as pd
+
+from pipmag import upsert_utils
+from pipmag.upsert_utils import create_store, upsert, read_store, compact_store, get_segment_files
+from tests.helpers import make_sample_dataframe
+
+
+class TestUpsertStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, 'store')
+        self.df = make_sample_dataframe()
+        create_store(self.df.iloc[:1], self.directory)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_upsert_writes_only_new_and_changed_rows(self):
+        self.assertEqual(upsert(self.df, self.directory), ['2020-08-07 09:40:02'])
+        self.assertEqual(upsert(self.df, self.directory), [])
+
+        changed = self.df.copy()
+        changed.at[0, 'comments'] = 'Good seeing'
+        self.assertEqual(upsert(changed, self.directory, keep_existing=True), [])
+        self.assertEqual(upsert(changed, self.directory), ['2020-08-07 08:22:14'])
+        self.assertEqual(len(get_segment_files(self.directory)), 2)
+
+        df = read_store(self.directory)
+        self.assertEqual(df['comments'].tolist(), ['Good seeing', None])
+        self.assertEqual(df['links'].tolist(), self.df['links'].tolist())
+
+    def test_compact_store(self):
+        upsert(self.df, self.directory)
+        before = read_store(self.directory)
+
+        self.assertEqual(compact_store(self.directory), 1)
+        self.assertEqual(get_segment_files(self.directory), [])
+        pd.testing.assert_frame_equal(read_store(self.directory), before)
+        self.assertEqual(compact_store(self.directory), 0)
+
+    def test_compaction_threshold(self):
+        for i in range(3):
+            new = self.df.iloc[[1]].copy()
+            new['date_time'] = new['date_time'] + pd.Timedelta(days=i + 1)
+            upsert(new, self.directory, compact_threshold=3, background=False)
+        self.assertEqual(get_segment_files(self.directory), [])
+        self.assertEqual(len(read_store(self.directory)), 4)
+
+    def test_read_store_after_background_compaction_starts(self):
+        # Slow down the replay of read_store, so that the background compaction started by upsert
+        # would remove the listed segments while they are read
+        replay_segments = upsert_utils.replay_segments
+        main_thread = threading.current_thread()
+
+        def slow_replay_segments(*args):
+            if threading.current_thread() is main_thread:
+                time.sleep(0.2)
+            return replay_segments(*args)
+
+        with mock.patch.object(upsert_utils, 'replay_segments', slow_replay_segments):
+            for i in range(3):
+                new = self.df.iloc[[1]].copy()
+                new['date_time'] = new['date_time'] + pd.Timedelta(days=i + 1)
+                upsert(new, self.directory, compact_threshold=2)
+                self.assertEqual(len(read_store(self.directory)), i + 2)
+
+    def test_concurrent_upserts(self):
+        # Slow down the segment writes, so that two upserts would read the same next segment number
+        write_csv_atomic = upsert_utils.write_csv_atomic
+
+        def slow_write_csv_atomic(*args):
+            time.sleep(0.1)
+            return write_csv_atomic(*args)
+
+        news = [self.df.iloc[[1]].assign(date_time=self.df['date_time'][1] + pd.Timedelta(days=i + 1))
+                for i in range(2)]
+        with mock.patch.object(upsert_utils, 'write_csv_atomic', slow_write_csv_atomic):
+            threads = [threading.Thread(target=upsert, args=(new, self.directory), kwargs={'compact_threshold': None})
+                       for new in news]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(get_segment_files(self.directory)), 2)
+        self.assertEqual(len(read_store(self.directory)), 3)
+
+    def test_derived_columns_are_not_stored(self):
+        exported = self.df.assign(scan_id=[0, 1])
+        self.assertEqual(upsert(exported, self.directory), ['2020-08-07 09:40:02'])
+        self.assertEqual(upsert(exported.assign(scan_id=[5, 6]), self.directory), [])
+        self.assertNotIn('scan_id', read_store(self.directory).columns)
+
+
+if __name__ == '__main__':
+    unittest.main()